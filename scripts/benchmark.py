@@ -0,0 +1,176 @@
+"""
+Offline pipeline benchmark.
+
+Generates a deterministic synthetic corpus at each size, runs every stage
+script on it in a scratch directory, and reports wall time, records/sec and
+peak RSS per stage. With --baseline, results are compared to a saved run and
+the process exits non-zero on any regression beyond --tolerance.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from builder.metrics import METRICS_FILE
+from builder.synthetic import write_corpus
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE = "benchmarks/baseline.json"
+
+# name -> (script, args)
+STAGES = {
+    "canonicalize": ("scripts/canonicalize_last_7_days.py", []),
+    "transform": ("scripts/transform_to_linkml.py", []),
+    "dump-rdf": ("scripts/dump_rdf.py", []),
+    "dump-rdf-stream": ("scripts/dump_rdf.py", ["--stream"]),
+    "load-oxigraph": ("scripts/load_into_oxigraph.py", []),
+    "load-oxigraph-bulk": ("scripts/load_into_oxigraph.py", ["--bulk"]),
+    "dump-rdf-shards": ("scripts/dump_rdf.py", ["--shards", str(os.cpu_count() or 1)]),
+    "load-oxigraph-shards": ("scripts/load_into_oxigraph.py", ["--shards"]),
+}
+DEFAULT_STAGES = ["canonicalize", "transform", "dump-rdf", "load-oxigraph"]
+
+
+def parse_size(s: str) -> int:
+    s = s.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(s[:-1] if mult > 1 else s) * mult
+
+
+def size_label(n: int) -> str:
+    if n >= 1_000_000 and n % 1_000_000 == 0:
+        return f"{n // 1_000_000}m"
+    if n >= 1_000 and n % 1_000 == 0:
+        return f"{n // 1_000}k"
+    return str(n)
+
+
+def run_stage(script: str, args: list[str], cwd: str) -> tuple[float, int]:
+    """Run one stage; returns (wall seconds, peak RSS bytes of that process)."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in [str(ROOT / "src"), env.get("PYTHONPATH", "")] if p)
+
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, str(ROOT / script), *args], cwd=cwd, env=env, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, script)
+
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return wall, rss
+
+
+def bench_size(n: int, stages: list[str], seed: int, chats: int) -> dict[str, dict[str, float]]:
+    results: dict[str, dict[str, float]] = {}
+    with tempfile.TemporaryDirectory(prefix="kg-bench-") as tmp:
+        for d in ("data/raw", "data/rdf", "data/oxigraph/store"):
+            os.makedirs(os.path.join(tmp, d))
+        shutil.copytree(ROOT / "schemas", os.path.join(tmp, "schemas"))
+
+        write_corpus(os.path.join(tmp, "data/raw/messages_last_7_days.jsonl"), n, seed=seed, chats=chats)
+
+        for name in stages:
+            script, args = STAGES[name]
+            if name.startswith("load-oxigraph"):
+                # Each load variant starts from an empty store.
+                shutil.rmtree(os.path.join(tmp, "data/oxigraph/store"))
+                os.makedirs(os.path.join(tmp, "data/oxigraph/store"))
+            wall, rss = run_stage(script, args, tmp)
+            results[name] = {"wall_s": round(wall, 3), "records_per_s": round(n / wall, 1), "peak_rss_mb": round(rss / 2**20, 1)}
+            # Sub-step timings the stage itself recorded (see builder.metrics)
+            with open(os.path.join(tmp, METRICS_FILE), "r", encoding="utf-8") as f:
+                results[name]["steps"] = json.loads(f.readlines()[-1])["steps"]
+            print(f"{size_label(n):>6} {name:<20} {wall:9.2f}s {n / wall:12.0f} rec/s {rss / 2**20:9.1f} MiB", flush=True)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for size, stages in results.items():
+        for name, cur in stages.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            if cur["records_per_s"] < base["records_per_s"] * (1 - tolerance):
+                regressions.append(
+                    f"{size} {name}: {cur['records_per_s']:.0f} rec/s vs baseline {base['records_per_s']:.0f}"
+                )
+            if cur["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+                regressions.append(
+                    f"{size} {name}: peak RSS {cur['peak_rss_mb']:.1f} MiB vs baseline {base['peak_rss_mb']:.1f}"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10k", help="comma-separated corpus sizes, e.g. 10k,100k,1m (default: 10k)")
+    parser.add_argument(
+        "--stages", default=",".join(DEFAULT_STAGES), help=f"comma-separated subset of {', '.join(STAGES)}"
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="runs per size; each stage keeps its median run (default: 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chats", type=int, default=1, help="communities in the synthetic corpus")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE, help=f"compare against a saved run (default path: {BASELINE})")
+    parser.add_argument(
+        "--save-baseline", nargs="?", const=BASELINE, help="write this run into the baseline (other sizes and stages are kept)"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (default: 0.2)")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    results = {}
+    for n in (parse_size(s) for s in args.sizes.split(",")):
+        runs = [bench_size(n, stages, args.seed, args.chats) for _ in range(args.repeat)]
+        # The median run of each stage: a single lucky or slow run neither sets nor breaks the baseline.
+        results[size_label(n)] = {
+            name: sorted((r[name] for r in runs), key=lambda r: r["wall_s"])[len(runs) // 2] for name in stages
+        }
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        # Sizes and stages not in this run keep their saved results.
+        saved = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        for size, stages_run in results.items():
+            saved.setdefault(size, {}).update(stages_run)
+        os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(saved, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"REGRESSION (beyond {args.tolerance:.0%} of {args.baseline}):", file=sys.stderr)
+            for r in regressions:
+                print(f"  {r}", file=sys.stderr)
+            sys.exit(1)
+        print(f"OK: no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,123 +1,106 @@
-import json
+import argparse
 import os
-import re
-from datetime import timezone
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from builder.canonical import canonicalize_chunk, drop_superseded, superseded_positions
+from builder.checkpoint import CHECKPOINT_EVERY, ResumableOutput, read_lines
+from builder.jsonl import existing_jsonl, glob_jsonl, target_jsonl
+from builder.metrics import add_profile_argument, stage
 
 INP = "data/raw/messages_last_7_days.jsonl"
+SHARD_DIR = "data/raw/messages"
 OUT = "data/raw/canonical_last_7_days.jsonl"
 
-URL_RE = re.compile(r"(https?://[^\s<>()\[\]{}\"']+)", re.IGNORECASE)
-
-def to_iso_utc(dt):
-    if dt is None:
-        return None
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc).isoformat()
-
-def extract_chat_id(peer_id_obj):
-    # Telethon encodes peer_id like {"_":"PeerChannel","channel_id":...} etc.
-    if not isinstance(peer_id_obj, dict):
-        return None
-    if "channel_id" in peer_id_obj:
-        return f"-100{peer_id_obj['channel_id']}"
-    if "chat_id" in peer_id_obj:
-        return f"-{peer_id_obj['chat_id']}"
-    if "user_id" in peer_id_obj:
-        return str(peer_id_obj["user_id"])
-    return None
-
-def extract_from_user_id(obj):
-    # Prefer from_id.user_id if present, else None
-    from_id = obj.get("from_id")
-    if isinstance(from_id, dict) and "user_id" in from_id:
-        return int(from_id["user_id"])
-    return None
-
-def extract_reply_to_message_id(obj):
-    r = obj.get("reply_to")
-    if isinstance(r, dict) and "reply_to_msg_id" in r:
-        return int(r["reply_to_msg_id"])
-    return None
-
-def build_permalink(chat_id, message_id):
-    # Best-effort; true permalink depends on whether the group has a public username.
-    # For now keep None; we can fill later if you provide group username.
-    return None
-
-def extract_urls(text):
-    if not text:
-        return []
-    return URL_RE.findall(text)
-
-def simplify_entities(entities):
-    out=[]
-    if not entities:
-        return out
-    for e in entities:
-        # e is already a dict in your raw JSON
-        if not isinstance(e, dict):
-            continue
-        item = {
-            "type": e.get("_"),
-            "offset": e.get("offset"),
-            "length": e.get("length"),
-        }
-        if "url" in e:
-            item["url"] = e.get("url")
-        # mention-name entities can embed user_id-ish structures depending on constructor
-        if "user_id" in e:
-            item["user_id"] = e.get("user_id")
-        out.append(item)
-    return out
+def iter_chunks(lines, size):
+    """Group (line, position) pairs into (lines, position after the last one) chunks."""
+    it = iter(lines)
+    while chunk := list(islice(it, size)):
+        yield [line for line, _ in chunk], chunk[-1][1]
+
+def canonicalize_chunks(chunks, jobs):
+    """
+    Yield (canonicalize_chunk result, input position) in input order, with at
+    most 2*jobs chunks in flight.
+    """
+    if jobs <= 1:
+        for lines, position in chunks:
+            yield canonicalize_chunk(lines), position
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for lines, position in chunks:
+            pending.append((pool.submit(canonicalize_chunk, lines), position))
+            if len(pending) >= 2 * jobs:
+                future, position = pending.popleft()
+                yield future.result(), position
+        while pending:
+            future, position = pending.popleft()
+            yield future.result(), position
+
+def default_inputs():
+    """The raw extract, or the per-chat shards if they were written after it (several entities)."""
+    raw = existing_jsonl(INP)
+    shards = glob_jsonl(SHARD_DIR)
+    if shards and (not os.path.exists(raw) or max(map(os.path.getmtime, shards)) > os.path.getmtime(raw)):
+        return shards
+    return [raw]
 
 def main():
+    parser = argparse.ArgumentParser(description="Canonicalize raw Telegram messages.")
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help=f"read the per-chat files in {SHARD_DIR}/ instead of {INP} (the default when they are newer)",
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="worker processes (default: 1, in-process)")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="lines per batch")
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="ignore the checkpoint of an interrupted run and start from the first line",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    inputs = glob_jsonl(SHARD_DIR) if args.shards else default_inputs()
+
     os.makedirs(os.path.dirname(OUT), exist_ok=True)
     n_in = 0
     n_out = 0
 
-    with open(INP, "r", encoding="utf-8") as f_in, open(OUT, "w", encoding="utf-8") as f_out:
-        for line in f_in:
-            n_in += 1
-            obj = json.loads(line)
-
-            chat_id = extract_chat_id(obj.get("peer_id"))
-            msg_id = obj.get("id")
-            created = obj.get("date")
-            # Telethon to_dict() already serializes datetime to ISO-ish string sometimes,
-            # but treat it as a string and pass through if so.
-            if isinstance(created, str):
-                created_at = created
-            else:
-                created_at = to_iso_utc(created)
-
-            text = obj.get("message") or ""
-            from_user_id = extract_from_user_id(obj)
-            reply_to_message_id = extract_reply_to_message_id(obj)
-            urls = extract_urls(text)
-
-            if chat_id is None or msg_id is None or created_at is None:
-                # Skip messages missing core identifiers
-                continue
-
-            canonical = {
-                "chat_id": chat_id,
-                "message_id": int(msg_id),
-                "created_at": created_at,
-                "text": text,
-                "from_user_id": from_user_id,
-                "reply_to_message_id": reply_to_message_id,
-                "permalink": build_permalink(chat_id, int(msg_id)),
-                "urls": urls,
-                "forwards": obj.get("forwards"),
-                "pinned": bool(obj.get("pinned")) if obj.get("pinned") is not None else None,
-                "entities": simplify_entities(obj.get("entities")),
-            }
-
-            f_out.write(json.dumps(canonical, ensure_ascii=False) + "\n")
-            n_out += 1
-
-    print(f"Read {n_in} lines, wrote {n_out} canonical messages to {OUT}")
+    with stage("canonicalize", profile=args.profile) as m:
+        m.read(*inputs)
+        out = target_jsonl(OUT)
+        with m.step("dedup") as s:
+            # Edited messages appended by incremental extraction keep their last copy (see superseded_positions).
+            superseded = superseded_positions(inputs)
+            dropped = len(superseded)
+            s.count(lines_dropped=dropped)
+        with m.step("canonicalize") as s, ResumableOutput(out, inputs, resume=not args.restart) as f_out:
+            if f_out.resumed:
+                n_in, n_out = f_out.state["records_in"], f_out.state["records_out"]
+                print(f"Resuming after {n_in} lines (checkpoint {f_out.ckpt.path})")
+            since_checkpoint = 0
+            chunks = iter_chunks(drop_superseded(read_lines(inputs, f_out.start), superseded), args.batch_size)
+            for (read, kept, text), position in canonicalize_chunks(chunks, args.jobs):
+                f_out.write(text)
+                n_in += read
+                n_out += kept
+                since_checkpoint += read
+                if since_checkpoint >= CHECKPOINT_EVERY:
+                    f_out.checkpoint(position, {"records_in": n_in, "records_out": n_out})
+                    since_checkpoint = 0
+            f_out.finish()
+            s.count(records_in=n_in, records_out=n_out)
+        m.count(records_in=n_in, records_out=n_out)
+        m.wrote(out)
+
+    print(f"Read {n_in} lines, wrote {n_out} canonical messages to {out}")
+    if dropped:
+        print(f"  dropped {dropped} superseded copies of edited messages")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,145 @@
+import argparse
+import os
+from datetime import date, datetime, timezone
+
+from pyoxigraph import Store
+
+from builder.days import (
+    DAYS_DIR,
+    MANIFEST,
+    WINDOWS_DIR,
+    assemble_window,
+    expired_days,
+    load_manifest,
+    load_window,
+    process_days,
+    prune,
+    save_manifest,
+    split_raw,
+    window_days,
+    window_name,
+)
+from builder.jsonl import existing_jsonl, glob_jsonl
+from builder.metrics import StageMetrics, add_profile_argument, stage
+from builder.store import bump_generation
+
+RAW = "data/raw/messages_last_7_days.jsonl"
+SHARD_DIR = "data/raw/messages"
+STORE_DIR = "data/oxigraph/store"
+
+
+def update(args: argparse.Namespace, m: StageMetrics) -> None:
+    inputs = [existing_jsonl(p) for p in args.raw] if args.raw else [existing_jsonl(RAW)]
+    if args.shards:
+        inputs = glob_jsonl(SHARD_DIR)
+    m.read(*inputs)
+    manifest = load_manifest()
+
+    with m.step("split") as s:
+        changed = split_raw(inputs, manifest)
+        s.count(days_changed=len(changed))
+    # Saved before processing: an interrupted run still knows which days are stale.
+    save_manifest(manifest)
+
+    with m.step("process") as s:
+        processed = process_days(manifest, jobs=args.jobs)
+        s.count(days=len(processed), records=sum(manifest["days"][n]["records"] for n in processed))
+    save_manifest(manifest)
+
+    m.count(days=len(manifest["days"]), days_changed=len(changed), days_processed=len(processed))
+    m.wrote(DAYS_DIR)
+    print(f"{len(changed)} of the days in {', '.join(inputs)} changed; processed {len(processed)} days")
+    print(f"  {len(manifest['days'])} day partitions in {DAYS_DIR}")
+
+
+def window(args: argparse.Namespace, m: StageMetrics) -> None:
+    manifest = load_manifest()
+    name = window_name(None if args.all else args.days)
+    names = window_days(manifest, None if args.all else args.days, args.today)
+    if not names:
+        raise RuntimeError(f"No processed days in window {name} ending {args.today}; run the update command first.")
+    out_dir = os.path.join(WINDOWS_DIR, name)
+    m.read(MANIFEST)
+
+    with m.step("assemble") as s:
+        info = assemble_window(manifest, names, name, out_dir)
+        s.count(days=len(names), records=info["records"], quads=info["quads"], aggregate_quads=info["aggregates"])
+    m.count(days=len(names), records=info["records"], quads=info["quads"])
+    m.wrote(out_dir)
+    print(f"Assembled {name} from {len(names)} days: {info['records']} records, {info['quads']} quads in {out_dir}")
+
+    if args.load:
+        with m.step("load") as s:
+            store = Store(STORE_DIR)
+            summary = load_window(store, manifest, info, out_dir)
+            s.count(graphs=len(info["graphs"]))
+        save_manifest(manifest)
+        # Tells readers holding the store open (builder.query) that its contents changed.
+        bump_generation(STORE_DIR)
+        m.wrote(STORE_DIR)
+        print(f"  store: {summary}")
+
+
+def prune_days(args: argparse.Namespace, m: StageMetrics) -> None:
+    manifest = load_manifest()
+    names = expired_days(manifest, args.keep_days, args.today)
+    if not names:
+        print(f"Nothing older than {args.keep_days} days to prune")
+        return
+    # Only opened when a loaded window still holds some of the expired days.
+    loaded = any(n in days for days in manifest["windows"].values() for n in names)
+    with m.step("prune") as s:
+        store = Store(STORE_DIR) if loaded else None
+        removed = prune(manifest, names, store)
+        s.count(days=len(names), posts_removed=removed)
+    save_manifest(manifest)
+    if store is not None:
+        bump_generation(STORE_DIR)
+    m.count(days=len(names), posts_removed=removed)
+    print(f"Pruned {len(names)} days older than {args.keep_days} days ({removed} posts removed from the store)")
+    if store is not None:
+        print(f"  run the window command with --load again to trim user and link tables in {', '.join(manifest['windows'])}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain daily per-chat partitions and the windows built from them.")
+    add_profile_argument(parser)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("update", help="split raw extracts into days and reprocess the days that changed")
+    p.add_argument("--raw", action="append", metavar="PATH", help=f"raw JSONL to split (repeatable; default {RAW})")
+    p.add_argument("--shards", action="store_true", help=f"split the per-chat files in {SHARD_DIR}/ instead")
+    p.add_argument("--jobs", type=int, help="worker processes (default: one per CPU)")
+    p.set_defaults(run=update)
+
+    def add_today(p: argparse.ArgumentParser) -> None:
+        p.add_argument(
+            "--today",
+            type=date.fromisoformat,
+            default=datetime.now(timezone.utc).date(),
+            help="last day of the window, YYYY-MM-DD (default: today, UTC)",
+        )
+
+    p = sub.add_parser("window", help=f"assemble a rolling window from the day partitions into {WINDOWS_DIR}/<window>")
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument("--days", type=int, help="window length in days, e.g. 7 (graphs tg:graph/<chat>/last7d)")
+    group.add_argument("--all", action="store_true", help="every retained day (graphs tg:graph/<chat>/all)")
+    p.add_argument("--load", action="store_true", help="also bring the window's graphs in the store up to date")
+    add_today(p)
+    p.set_defaults(run=window)
+
+    p = sub.add_parser("prune", help="drop partitions older than the retention period, from disk and the store")
+    p.add_argument("--keep-days", type=int, required=True, help="days to retain, counting today")
+    add_today(p)
+    p.set_defaults(run=prune_days)
+
+    args = parser.parse_args()
+    if getattr(args, "days", None) is not None and args.days < 1 or getattr(args, "keep_days", 1) < 1:
+        parser.error("--days and --keep-days must be at least 1")
+
+    with stage(f"days-{args.command}", profile=args.profile) as m:
+        args.run(args, m)
+
+
+if __name__ == "__main__":
+    main()
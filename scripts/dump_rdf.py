@@ -1,17 +1,36 @@
+import argparse
 import json
 import os
-from collections.abc import Mapping
+import shutil
+from collections import Counter
+from collections.abc import Iterator, Mapping
+from concurrent.futures import ProcessPoolExecutor
+from itertools import batched, chain
 from typing import Any, cast
 
 from linkml_runtime.dumpers import rdflib_dumper
 from linkml_runtime.loaders import json_loader
 from linkml_runtime.utils.schemaview import SchemaView
 
+from builder.aggregates import Key, StatsCollector
+from builder.checkpoint import CHECKPOINT_EVERY, ResumableOutput, read_lines
+from builder.jsonl import existing_jsonl, iter_jsonl_shard, loads
+from builder.metrics import StageMetrics, add_profile_argument, stage
+from builder.rdf import DocumentState, Triple, expand, graph_quads, write_quads, write_triples
 from builder.sioc_model import GraphDocument
+from builder.sioc_triples import graph_document_triples
+from builder.transform import graph_id
 
 INP = "data/raw/linkml_graph.json"
+# Written by transform_to_linkml.py instead of INP when the input spans several chats
+INDEX = "data/raw/linkml/index.json"
+CANONICAL_INP = "data/raw/canonical_last_7_days.jsonl"
 SCHEMA = "schemas/sioc_min.yaml"
 OUT = "data/rdf/sioc_graph.ttl"
+SHARD_DIR = "data/rdf/shards"
+MANIFEST = "manifest.json"
+# Stats graphs for the N-Quads shards, merged from every worker's counts
+AGGREGATES = "aggregates.nq"
 
 
 def ensure_str_keys(x: Any) -> Any:
@@ -49,28 +68,211 @@ def deep_clean_ids(x: Any) -> Any:
     return x
 
 
-def main() -> None:
-    raw = json.load(open(INP, "r", encoding="utf-8"))
-    raw = ensure_str_keys(raw)
-    raw = deep_clean_ids(raw)
+def dump_streaming(inp: str, out: str, fmt: str, m: StageMetrics, resume: bool = True) -> None:
+    """
+    Write the streaming dump, checkpointing every `CHECKPOINT_EVERY` records so
+    an interrupted run picks up where it stopped (see `builder.checkpoint`).
+    """
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    inp = existing_jsonl(inp)
+    m.read(inp)
+    with m.step("write_triples") as s, ResumableOutput(out, [inp], {"format": fmt}, resume=resume) as f:
+        # The users and links each document already lists are part of the checkpoint.
+        docs: DocumentState = {c: (doc, set(u), set(l)) for c, (doc, u, l) in f.state.get("docs", {}).items()}
+        n = f.state.get("triples", 0)
+        if f.resumed:
+            print(f"Resuming after {n} triples (checkpoint {f.ckpt.path})")
+        for chunk in batched(read_lines([inp], f.start), CHECKPOINT_EVERY):
+            quads = graph_quads((loads(line) for line, _ in chunk), docs)
+            if fmt == "nq":
+                n += write_quads(quads, f)
+            else:
+                n += write_triples(((s, p, o) for s, p, o, _ in quads), f, fmt=fmt, header=not f.resumed and n == 0)
+            f.checkpoint(chunk[-1][1], {"docs": {c: [doc, list(u), list(l)] for c, (doc, u, l) in docs.items()}, "triples": n})
+        if not docs:
+            raise RuntimeError("No messages found in canonical input file.")
+        f.finish()
+        s.count(triples=n)
+    m.count(triples=n)
+    m.wrote(out)
+
+    print(f"Wrote {n} triples to {out}")
+
+
+def dump_shard(inp: str, out: str, fmt: str, index: int, count: int) -> tuple[int, list[str], dict[str, Counter[Key]]]:
+    """
+    Write shard `index` of `count` of the canonical records as N-Triples or N-Quads.
+
+    Runs in a worker process. Returns the number of lines written, the graphs
+    the shard touches and, for N-Quads, the aggregate counts of its posts.
+    """
+    chats: dict[str, None] = {}
+
+    def records() -> Iterator[dict[str, Any]]:
+        for obj in iter_jsonl_shard(inp, index, count):
+            chats.setdefault(obj["chat_id"])
+            yield obj
+
+    it = records()
+    collector = StatsCollector()
+    with open(out, "w", encoding="utf-8") as f:
+        first = next(it, None)
+        if first is None:
+            return 0, [], {}
+        # Every shard repeats the header triples of the documents it touches; the store keeps one copy.
+        quads = graph_quads(chain([first], it))
+        if fmt == "nq":
+            n = write_quads(collector.observe(quads), f)
+        else:
+            n = write_triples(((s, p, o) for s, p, o, _ in quads), f)
+    return n, [expand(graph_id(c)) for c in chats], collector.counts
+
+
+def dump_shards(inp: str, count: int, jobs: int | None, fmt: str, m: StageMetrics) -> None:
+    """
+    Split the streaming dump into `count` line-oriented files written by `jobs` processes.
+
+    The shards and a `manifest.json` describing them are built in a scratch
+    directory that replaces `SHARD_DIR` only once every worker has finished.
+    """
+    m.read(existing_jsonl(inp))
+    tmp, old = SHARD_DIR + ".tmp", SHARD_DIR + ".old"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    names = [f"part-{i:05d}.{fmt}" for i in range(count)]
+    with m.step("write_shards") as s, ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(dump_shard, inp, os.path.join(tmp, name), fmt, i, count) for i, name in enumerate(names)]
+        results = [f.result() for f in futures]
+        n = sum(r[0] for r in results)
+        s.count(shards=count, lines=n)
+    if n == 0:
+        raise RuntimeError("No messages found in canonical input file.")
+    graphs = list(dict.fromkeys(g for _, gs, _ in results for g in gs))
 
-    tmp = "data/raw/linkml_graph.normalized.json"
-    os.makedirs("data/raw", exist_ok=True)
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(raw, f, ensure_ascii=False)
+    manifest: dict[str, Any] = {"format": fmt, "shards": names, "graphs": graphs, "lines": n}
+    if fmt == "nq":
+        # Posts are split across shards, so per-shard counts add up (a post repeated in two shards counts twice).
+        with m.step("aggregates") as s, open(os.path.join(tmp, AGGREGATES), "w", encoding="utf-8") as f:
+            collector = StatsCollector()
+            for _, _, counts in results:
+                for g, c in counts.items():
+                    collector.counts.setdefault(g, Counter()).update(c)
+            agg = write_quads(collector.quads(), f)
+            s.count(quads=agg)
+        manifest["aggregates"] = AGGREGATES
+    with open(os.path.join(tmp, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
 
-    sv = SchemaView(SCHEMA)
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(SHARD_DIR):
+        os.rename(SHARD_DIR, old)
+    os.rename(tmp, SHARD_DIR)
+    shutil.rmtree(old, ignore_errors=True)
 
-    doc = cast(GraphDocument, json_loader.load(tmp, target_class=GraphDocument))
+    m.count(lines=n, shards=count, graphs=len(graphs))
+    m.wrote(SHARD_DIR)
+    print(f"Wrote {n} lines to {count} shards in {SHARD_DIR}")
 
-    ttl = rdflib_dumper.dumps(doc, schemaview=sv)
+
+def document_to_turtle(path: str, sv: SchemaView, m: StageMetrics) -> str:
+    with m.step("normalize_json"):
+        raw = json.load(open(path, "r", encoding="utf-8"))
+        raw = ensure_str_keys(raw)
+        raw = deep_clean_ids(raw)
+
+        tmp = "data/raw/linkml_graph.normalized.json"
+        os.makedirs("data/raw", exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(raw, f, ensure_ascii=False)
+
+    with m.step("json_loader") as s:
+        doc = cast(GraphDocument, json_loader.load(tmp, target_class=GraphDocument))
+        s.count(posts=len(doc.posts))
+
+    with m.step("rdflib_dumper"):
+        return rdflib_dumper.dumps(doc, schemaview=sv)
+
+
+def document_triples(paths: list[str], m: StageMetrics) -> Iterator[Triple]:
+    for path in paths:
+        with m.step("normalize_json"), open(path, "r", encoding="utf-8") as f:
+            raw = deep_clean_ids(ensure_str_keys(json.load(f)))
+        yield from graph_document_triples(raw)
+
+
+def dump_linkml(m: StageMetrics, generic: bool = False) -> None:
+    if os.path.exists(INDEX):
+        with open(INDEX, "r", encoding="utf-8") as f:
+            paths = [g["path"] for g in json.load(f)["graphs"]]
+    else:
+        paths = [INP]
+    m.read(*paths)
 
     os.makedirs("data/rdf", exist_ok=True)
-    with open(OUT, "w", encoding="utf-8") as f:
-        f.write(ttl)
+    if generic:
+        with m.step("schema_view"):
+            sv = SchemaView(SCHEMA)
+        with open(OUT, "w", encoding="utf-8") as f:
+            # Documents share no blank nodes, so concatenated Turtle is their union.
+            for path in paths:
+                f.write(document_to_turtle(path, sv, m))
+    else:
+        with open(OUT, "w", encoding="utf-8") as f:
+            n = write_triples(document_triples(paths, m), f, fmt="ttl")
+        m.count(triples=n)
+    m.count(documents=len(paths))
+    m.wrote(OUT)
 
     print(f"Wrote RDF to {OUT}")
 
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serialize the graph to RDF.")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=f"emit triples straight from {CANONICAL_INP} without building a GraphDocument",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        metavar="N",
+        help=f"like --stream, but write N N-Triples/N-Quads files to {SHARD_DIR} in parallel",
+    )
+    parser.add_argument("--jobs", type=int, help="worker processes for --shards (default: one per CPU)")
+    parser.add_argument(
+        "--format",
+        choices=["ttl", "nt", "nq"],
+        help="output format for --stream (default: ttl) or --shards (default: nq, one named graph per document)",
+    )
+    parser.add_argument("--out", help="output path for --stream (default: data/rdf/sioc_graph.<format>)")
+    parser.add_argument(
+        "--linkml",
+        action="store_true",
+        help="serialize through json_loader and rdflib_dumper instead of the functions generated from the schema",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="with --stream, ignore the checkpoint of an interrupted run and start over",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.shards is not None and args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.shards and args.format == "ttl":
+        parser.error("Turtle can't be split into shards; use --format nt or nq")
+
+    with stage("dump-rdf", profile=args.profile) as m:
+        if args.shards:
+            dump_shards(CANONICAL_INP, args.shards, args.jobs, args.format or "nq", m)
+        elif args.stream:
+            fmt = args.format or "ttl"
+            dump_streaming(CANONICAL_INP, args.out or f"data/rdf/sioc_graph.{fmt}", fmt, m, resume=not args.restart)
+        else:
+            dump_linkml(m, generic=args.linkml)
+
+
 if __name__ == "__main__":
     main()
@@ -1,51 +1,141 @@
-import json
+import argparse
 import os
 from datetime import datetime, timedelta, timezone
 
 from dotenv import load_dotenv
 from telethon import TelegramClient
-from telethon.tl.types import PeerChannel
+
+from builder.extract import (
+    RawWriter,
+    coerce_entity,
+    extract_many,
+    fetch_new,
+    fetch_window,
+    load_checkpoint,
+    refresh_tail,
+    save_checkpoint,
+)
+from builder.metrics import StageMetrics, add_profile_argument, stage
 
 load_dotenv()
 
 API_ID = int(os.environ["TG_API_ID"])
 API_HASH = os.environ["TG_API_HASH"]
 SESSION = os.environ.get("TG_SESSION", "tg.session")
-ENTITY = os.environ["TG_ENTITY"]
+# One entity, or several separated by commas
+ENTITIES = [e.strip() for e in os.environ["TG_ENTITY"].split(",") if e.strip()]
 
 OUT = "data/raw/messages_last_7_days.jsonl"
+SHARD_DIR = "data/raw/messages"
+# Complete `to_dict()` copies, written only with --archive
+ARCHIVE = "data/raw/archive/messages_last_7_days.jsonl"
+ARCHIVE_DIR = "data/raw/archive/messages"
+CHECKPOINT = "data/raw/extract_checkpoint.json"
 
-def coerce_entity(entity_str: str):
-    s = entity_str.strip()
-    # Telegram "supergroup/channel" ids are often represented as -100<channel_id>
-    if s.startswith("-100") and s[4:].isdigit():
-        channel_id = int(s[4:])  # drop the -100 prefix
-        return PeerChannel(channel_id)
-    # If it's a plain negative int (e.g. -123...), let Telethon try
-    if s.lstrip("-").isdigit():
-        return int(s)
-    return s  # @username, invite link, etc.
 
-async def main():
-    since = datetime.now(timezone.utc) - timedelta(days=7)
+async def run_many(client, args, entities: list[str], m: StageMetrics) -> None:
+    now = datetime.now(timezone.utc)
+    since = now - timedelta(days=7)
+
+    state = load_checkpoint(CHECKPOINT)
+    try:
+        results = await extract_many(
+            client,
+            entities,
+            state,
+            out_dir=SHARD_DIR,
+            archive_dir=ARCHIVE_DIR if args.archive else None,
+            since=since,
+            now=now,
+            incremental=args.incremental,
+            refresh=timedelta(hours=args.refresh_hours),
+            concurrency=args.concurrency,
+        )
+    finally:
+        # Keep whatever progress the finished (or partially finished) entities made.
+        save_checkpoint(CHECKPOINT, state)
+
+    for entity, (path, new, edited) in results.items():
+        m.count(messages=new, edited=edited)
+        m.wrote(path)
+        print(f"{entity}: {new} new, {edited} edited messages -> {path}")
+
+
+async def run(client, args, entity_str: str, m: StageMetrics) -> None:
+    now = datetime.now(timezone.utc)
+    since = now - timedelta(days=7)
 
-    async with TelegramClient(SESSION, API_ID, API_HASH) as client:
-        entity = coerce_entity(ENTITY)
-        entity = await client.get_entity(entity)  # now resolves PeerChannel properly
+    entity = coerce_entity(entity_str)
+    entity = await client.get_entity(entity)  # now resolves PeerChannel properly
 
-        count = 0
-        os.makedirs(os.path.dirname(OUT), exist_ok=True)
+    os.makedirs(os.path.dirname(OUT), exist_ok=True)
+    state = load_checkpoint(CHECKPOINT)
+    archive = ARCHIVE if args.archive else None
+
+    if not args.incremental:
+        # A full sweep rewrites the file and re-seeds the checkpoint for later incremental runs.
+        mark = state[entity_str] = {}
+        with RawWriter(OUT, archive) as out:
+            count = await fetch_window(client, entity, since, out, mark)
+        mark["synced_at"] = now.isoformat()
+        save_checkpoint(CHECKPOINT, state)
+        m.count(messages=count)
+        m.wrote(out.path)
+        print(f"Wrote {count} messages to {out.path}")
+        return
+
+    mark = state.setdefault(entity_str, {})
+    with RawWriter(OUT, archive, append=True) as out:
+        edited = await refresh_tail(client, entity, timedelta(hours=args.refresh_hours), now, out, mark)
+        count = await fetch_new(client, entity, since, out, mark)
+    mark["synced_at"] = now.isoformat()
+    save_checkpoint(CHECKPOINT, state)
+    m.count(messages=count, edited=edited)
+    m.wrote(out.path)
+
+    print(f"Appended {count} new and {edited} edited messages to {out.path} (last id {mark.get('last_id')})")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Extract recent Telegram messages.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=f"append only messages newer than the checkpoint in {CHECKPOINT}",
+    )
+    parser.add_argument(
+        "--refresh-hours",
+        type=float,
+        default=48,
+        help="with --incremental, re-check this much recent history for edits (0 disables)",
+    )
+    parser.add_argument(
+        "--entity",
+        action="append",
+        help="entity to extract (repeatable); defaults to the comma-separated TG_ENTITY",
+    )
+    parser.add_argument(
+        "--shard",
+        action="store_true",
+        help=f"write one file per chat under {SHARD_DIR}/ (implied by more than one entity)",
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="max entities fetched at once")
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help=f"also keep the complete message dicts (media, reactions, ...) under {os.path.dirname(ARCHIVE)}/",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
 
-        with open(OUT, "w", encoding="utf-8") as f:
-            async for msg in client.iter_messages(entity, limit=None):
-                if not msg.date:
-                    continue
-                if msg.date < since:
-                    break
-                f.write(json.dumps(msg.to_dict(), ensure_ascii=False, default=str) + "\n")
-                count += 1
+    entities = args.entity or ENTITIES
 
-        print(f"Wrote {count} messages to {OUT}")
+    with stage("extract", profile=args.profile) as m:
+        async with TelegramClient(SESSION, API_ID, API_HASH) as client:
+            if args.shard or len(entities) > 1:
+                await run_many(client, args, entities, m)
+            else:
+                await run(client, args, entities[0], m)
 
 if __name__ == "__main__":
     import asyncio
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import os
+from contextlib import suppress
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pyoxigraph import Store
+from telethon import TelegramClient
+from telethon.utils import get_peer_id
+
+from builder.extract import coerce_entity
+from builder.listen import BATCH_SIZE, MAX_DELAY, Listener
+from builder.metrics import add_profile_argument, stage
+from builder.search import SEARCH_DB
+
+load_dotenv()
+
+API_ID = int(os.environ["TG_API_ID"])
+API_HASH = os.environ["TG_API_HASH"]
+SESSION = os.environ.get("TG_SESSION", "tg.session")
+# One entity, or several separated by commas
+ENTITIES = [e.strip() for e in os.environ["TG_ENTITY"].split(",") if e.strip()]
+
+STORE_DIR = "data/oxigraph/store"
+
+
+async def listen(args, entities: list[str]) -> None:
+    Path(STORE_DIR).mkdir(parents=True, exist_ok=True)
+    store = Store(STORE_DIR)
+
+    with stage("listen", profile=args.profile) as m:
+        async with TelegramClient(SESSION, API_ID, API_HASH) as client:
+            resolved = [await client.get_entity(coerce_entity(e)) for e in entities]
+            listener = Listener(
+                store,
+                STORE_DIR,
+                search_path=None if args.no_search else SEARCH_DB,
+                chats=[str(get_peer_id(e)) for e in resolved],
+                batch_size=args.batch_size,
+                max_delay=args.max_delay,
+            )
+            listener.attach(client, chats=resolved)
+            print(f"Listening to {', '.join(entities)} (Ctrl-C to stop)")
+
+            committer = asyncio.create_task(listener.run())
+            disconnected = asyncio.create_task(client.run_until_disconnected())
+            try:
+                # A failed commit ends the run too, rather than buffering events forever.
+                await asyncio.wait([committer, disconnected], return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                pass  # Ctrl-C: stop listening and commit what is pending
+            finally:
+                disconnected.cancel()
+                committer.cancel()
+                with suppress(asyncio.CancelledError):
+                    await committer
+
+        m.count(batches=listener.stats.batches, messages=listener.stats.messages, deletions=listener.stats.deletions)
+        m.wrote(STORE_DIR)
+    print(f"Stopped: {listener.stats}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Ingest new, edited and deleted messages as they happen, committing in micro-batches."
+    )
+    parser.add_argument(
+        "--entity",
+        action="append",
+        help="entity to listen to (repeatable); defaults to the comma-separated TG_ENTITY",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="commit once this many messages changed")
+    parser.add_argument(
+        "--max-delay",
+        type=float,
+        default=MAX_DELAY,
+        help="commit once the oldest pending change is this many seconds old",
+    )
+    parser.add_argument("--no-search", action="store_true", help="do not update the full-text index")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(listen(args, args.entity or ENTITIES))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,34 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Iterable, cast
 
 from pyoxigraph import RdfFormat, Store
 
+from builder.aggregates import StatsCollector, stats_graph
+from builder.jsonl import existing_jsonl, iter_jsonl
+from builder.metrics import StageMetrics, add_profile_argument, stage
+from builder.rdf import graph_quads
+from builder.search import SEARCH_DB, SearchIndex
+from builder.store import bulk_load_quads, bump_generation, clear_graphs, replacing_chats, upsert_records
+
 RDF_FILE = "data/rdf/sioc_graph.ttl"
+CANONICAL_INP = "data/raw/canonical_last_7_days.jsonl"
 STORE_DIR = "data/oxigraph/store"
+# Written by dump_rdf.py --shards
+SHARD_DIR = "data/rdf/shards"
+SHARD_FORMATS = {"nt": RdfFormat.N_TRIPLES, "nq": RdfFormat.N_QUADS}
 
 
-def main() -> None:
-    Path(STORE_DIR).mkdir(parents=True, exist_ok=True)
-
-    store = Store(STORE_DIR)
-
-    with open(RDF_FILE, "rb") as f:
+def load_turtle(store: Store, m: StageMetrics) -> None:
+    m.read(RDF_FILE)
+    with m.step("load"), open(RDF_FILE, "rb") as f:
         store.load(f, format=RdfFormat.TURTLE)
 
-    store.flush()
+    with m.step("flush"):
+        store.flush()
     print("Loaded RDF into Oxigraph store")
 
     q = """
@@ -27,8 +40,122 @@ def main() -> None:
     rows = cast(Iterable[Any], result)
 
     for row in rows:
+        m.count(triples=int(row["count"].value))
         print("Triple count:", row["count"].value)
 
 
+def load_bulk(store: Store, m: StageMetrics) -> None:
+    m.read(existing_jsonl(CANONICAL_INP))
+    # Aggregates are counted as the quads stream past, then written to each graph's stats graph.
+    # Each chat's graphs are replaced, not merged, when its first record streams past.
+    collector = StatsCollector()
+    with m.step("bulk_load") as s:
+        records = replacing_chats(store, iter_jsonl(CANONICAL_INP))
+        stats = bulk_load_quads(store, collector.observe(graph_quads(records)))
+        s.count(quads=sum(stats.values()))
+    with m.step("aggregates") as s:
+        agg = bulk_load_quads(store, collector.quads())
+        s.count(quads=sum(agg.values()))
+    with m.step("flush"):
+        store.flush()
+    m.count(quads=sum(stats.values()), graphs=len(stats), aggregate_quads=sum(agg.values()))
+
+    print(f"Bulk loaded {sum(stats.values())} quads into {len(stats)} named graphs, plus {sum(agg.values())} aggregate quads")
+    for g, n in stats.items():
+        print(f"  {g}: {n}")
+
+
+def load_shards(store: Store, jobs: int | None, m: StageMetrics) -> None:
+    with open(os.path.join(SHARD_DIR, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    fmt = SHARD_FORMATS[manifest["format"]]
+    paths = [os.path.join(SHARD_DIR, name) for name in manifest["shards"]]
+    if manifest.get("aggregates"):
+        paths.append(os.path.join(SHARD_DIR, manifest["aggregates"]))
+    m.read(*paths)
+
+    graphs = manifest["graphs"]
+    if fmt == RdfFormat.N_QUADS:
+        with m.step("clear_graphs") as s:
+            clear_graphs(store, [*graphs, *(stats_graph(g) for g in graphs)])
+            s.count(graphs=len(graphs))
+
+    # Each thread parses and bulk-loads its own shard; Oxigraph releases the GIL while doing so.
+    with m.step("bulk_load") as s, ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        for _ in pool.map(lambda p: store.bulk_load(path=p, format=fmt), paths):
+            pass
+        s.count(shards=len(paths))
+    with m.step("flush"):
+        store.flush()
+    m.count(lines=manifest["lines"], shards=len(paths), graphs=len(graphs))
+
+    print(f"Bulk loaded {manifest['lines']} lines from {len(paths)} shards in {SHARD_DIR} ({len(graphs)} graphs)")
+
+
+def load_upsert(store: Store, m: StageMetrics) -> None:
+    m.read(existing_jsonl(CANONICAL_INP))
+    with m.step("upsert"):
+        stats = upsert_records(store, lambda: iter_jsonl(CANONICAL_INP))
+    with m.step("flush"):
+        store.flush()
+    m.count(
+        inserted=stats.inserted, updated=stats.updated, unchanged=stats.unchanged, deleted=stats.deleted, triples=stats.triples
+    )
+    print(f"Upserted {CANONICAL_INP}: {stats}")
+
+
+def update_search_index(m: StageMetrics) -> None:
+    if not os.path.exists(existing_jsonl(CANONICAL_INP)):
+        print(f"Skipping search index: {CANONICAL_INP} not found")
+        return
+    with m.step("search_index") as s, SearchIndex(SEARCH_DB) as index:
+        stats = index.sync(iter_jsonl(CANONICAL_INP))
+        s.count(inserted=stats.inserted, updated=stats.updated, unchanged=stats.unchanged, deleted=stats.deleted)
+    m.wrote(SEARCH_DB)
+    print(f"Search index {SEARCH_DB}: {stats}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load the graph into the Oxigraph store.")
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help=f"stream quads from {CANONICAL_INP} via bulk loading, one named graph per community and window",
+    )
+    parser.add_argument(
+        "--upsert",
+        action="store_true",
+        help="rewrite only posts whose content changed since the last load (and drop deleted ones)",
+    )
+    parser.add_argument(
+        "--shards",
+        action="store_true",
+        help=f"bulk load the N-Triples/N-Quads shards in {SHARD_DIR} (see dump_rdf.py --shards) concurrently",
+    )
+    parser.add_argument("--jobs", type=int, help="loader threads for --shards (default: one per CPU)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    Path(STORE_DIR).mkdir(parents=True, exist_ok=True)
+
+    with stage("load-oxigraph", profile=args.profile) as m:
+        with m.step("open_store"):
+            store = Store(STORE_DIR)
+
+        if args.upsert:
+            load_upsert(store, m)
+        elif args.bulk:
+            load_bulk(store, m)
+        elif args.shards:
+            load_shards(store, args.jobs, m)
+        else:
+            load_turtle(store, m)
+        m.wrote(STORE_DIR)
+        update_search_index(m)
+
+    # Tells readers holding the store open (builder.query) that its contents changed.
+    bump_generation(STORE_DIR)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,79 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from builder.query import BUCKET_WIDTHS, STORE_DIR, GraphQueries
+
+
+def print_posts(title: str, page) -> None:
+    print(title)
+    for post in page.items:
+        content = (post.content or "").replace("\n", " ")
+        print(f"  {post.created.isoformat()}  {post.iri}  {content[:60]}")
+    if page.next_cursor:
+        print(f"  ... more (--after '{page.next_cursor[0]}' '{page.next_cursor[1]}')")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the prepared dashboard queries against the Oxigraph store.")
+    parser.add_argument("--days", type=float, default=7, help="window length for top/activity queries (default: 7)")
+    parser.add_argument("--end", help="window end as ISO datetime (default: now)")
+    parser.add_argument("--community", help="restrict top/activity queries to one community, e.g. tg:community/-100123")
+    parser.add_argument("--bucket", choices=sorted(BUCKET_WIDTHS), default="day", help="activity bucket size")
+    parser.add_argument(
+        "--window",
+        help="read the top hashtags/links of this loaded window (e.g. last7d) from its aggregates instead of scanning posts",
+    )
+    parser.add_argument("--top", type=int, default=10, help="rows in the top hashtags/links lists")
+    parser.add_argument("--user", help="list posts by this user (id, CURIE or IRI)")
+    parser.add_argument("--thread", help="list the reply thread containing this post (CURIE or IRI)")
+    parser.add_argument("--search", help="full-text search over post content (all words must match)")
+    parser.add_argument("--limit", type=int, default=20, help="page size for --user/--thread/--search")
+    parser.add_argument("--after", nargs=2, metavar=("CREATED", "POST"), help="cursor printed by the previous page")
+    args = parser.parse_args()
+
+    q = GraphQueries(STORE_DIR)
+    after = tuple(args.after) if args.after else None
+
+    if args.user:
+        user = int(args.user) if args.user.isdigit() else args.user
+        print_posts(f"Posts by {args.user}:", q.posts_by_user(user, limit=args.limit, after=after))
+        return
+    if args.thread:
+        print_posts(f"Thread of {args.thread}:", q.thread(args.thread, limit=args.limit, after=after))
+        return
+
+    end = datetime.fromisoformat(args.end) if args.end else datetime.now(timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    start = end - timedelta(days=args.days)
+
+    if args.search:
+        print(f"Posts matching {args.search!r}:")
+        for hit in q.search(args.search, limit=args.limit, start=start, end=end, community=args.community):
+            content = (hit.post.content or "").replace("\n", " ")
+            print(f"  {hit.score:6.2f}  {hit.post.created.isoformat()}  {hit.post.iri}  {content[:60]}")
+        return
+    print(f"Window: {start.isoformat()} .. {end.isoformat()}")
+
+    if args.window:
+        hashtags = q.window_hashtags(args.window, limit=args.top, community=args.community)
+        links = q.window_links(args.window, limit=args.top, community=args.community)
+    else:
+        hashtags = q.top_hashtags(start, end, limit=args.top, community=args.community)
+        links = q.top_links(start, end, limit=args.top, community=args.community)
+
+    print("Top hashtags:" if not args.window else f"Top hashtags in {args.window}:")
+    for row in hashtags:
+        print(f"  {row.posts:6}  {row.value}")
+
+    print("Top links:" if not args.window else f"Top links in {args.window}:")
+    for row in links:
+        print(f"  {row.posts:6}  {row.value}")
+
+    print(f"Activity per {args.bucket}:")
+    for row in q.activity(start, end, bucket=args.bucket, community=args.community):
+        print(f"  {row.bucket}  {row.posts:6} posts  {row.users:5} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import argparse
+
+from builder.stages import STAGES, run_stages
+
+
+def main() -> None:
+    names = [s.name for s in STAGES]
+    parser = argparse.ArgumentParser(
+        description="Run the batch pipeline, skipping stages whose inputs, code and schema are unchanged."
+    )
+    parser.add_argument("stages", nargs="*", metavar="STAGE", help=f"subset of {names} (default: all)")
+    parser.add_argument("--force", action="store_true", help="run every selected stage regardless of the cache")
+    parser.add_argument("--dry-run", action="store_true", help="only report which stages would run")
+    parser.add_argument("--profile", action="store_true", help="profile the stages that run (see builder.metrics)")
+    args = parser.parse_args()
+
+    unknown = set(args.stages) - set(names)
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    # Keep pipeline order whatever order the stages were given in.
+    selected = [n for n in names if n in args.stages] if args.stages else names
+    report = run_stages(selected, force=args.force, dry_run=args.dry_run, profile=args.profile)
+
+    ran = sum(1 for _, status in report if status == "ran")
+    print(f"OK: {ran} of {len(report)} stages ran")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import argparse
+
+from builder.query import STORE_DIR
+from builder.server import SparqlFrontend, SparqlServer
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve cached, read-only SPARQL queries over the Oxigraph store.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=7879)
+    parser.add_argument("--cache-size", type=int, default=512, help="cached query results (default: 512)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    frontend = SparqlFrontend(STORE_DIR, cache_size=args.cache_size)
+    with SparqlServer((args.host, args.port), frontend, verbose=args.verbose) as server:
+        print(f"Serving {STORE_DIR} on http://{args.host}:{args.port}/query (stats at /stats)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,203 +1,236 @@
+import argparse
 import json
 import os
-from collections import OrderedDict
+import shutil
+from collections.abc import Iterable
+from dataclasses import asdict
+from itertools import batched
+from typing import Any, TextIO
 
 from linkml_runtime.dumpers import json_dumper
 
-from builder.sioc_model import Community, GraphDocument, Link, Post, UserAccount
+from builder.checkpoint import CHECKPOINT_EVERY, Checkpoint, Position, read_lines
+from builder.documents import (
+    TABLES,
+    ChatShard,
+    ShardResult,
+    build_rows,
+    graph_document,
+    merge_tables,
+    partition_by_chat,
+    stream_document,
+    transform_shards,
+    write_document,
+)
+from builder.jsonl import existing_jsonl, open_jsonl
+from builder.metrics import StageMetrics, add_profile_argument, stage
+from builder.threads import THREAD_DIR, build_thread_index
 
 INP = "data/raw/canonical_last_7_days.jsonl"
 OUT = "data/raw/linkml_graph.json"
+# One GraphDocument per community when the input spans several chats
+OUT_DIR = "data/raw/linkml"
+INDEX = os.path.join(OUT_DIR, "index.json")
+# Per-chat partitions and the progress of a run, kept until it finishes so an interrupted run can resume
+WORK_DIR = "data/raw/.transform-work"
+# One ShardResult per finished document, appended as they finish
+RESULTS = os.path.join(WORK_DIR, "results.jsonl")
+
+
+def partition(inp: str, checkpoint: Checkpoint, progress: dict[str, Any]) -> list[ChatShard]:
+    """Split the input into per-chat files in WORK_DIR, checkpointing every CHECKPOINT_EVERY lines."""
+    shards = {d["chat_id"]: ChatShard(**d) for d in progress.get("shards", [])}
+    if progress.get("partitioned"):
+        return list(shards.values())
+
+    # Drop whatever an interrupted run appended after its last checkpoint.
+    for chat_id, size in progress.get("sizes", {}).items():
+        with open(shards[chat_id].path, "r+b") as f:
+            f.truncate(size)
+
+    start = Position(*progress.get("position", Position()))
+    for chunk in batched(read_lines([inp], start), CHECKPOINT_EVERY):
+        partition_by_chat((line.decode("utf-8") for line, _ in chunk), WORK_DIR, shards)
+        for shard in shards.values():
+            with open(shard.path, "rb") as f:
+                os.fsync(f.fileno())
+        progress["position"] = list(chunk[-1][1])
+        progress["shards"] = [asdict(sh) for sh in shards.values()]
+        progress["sizes"] = {chat_id: os.path.getsize(sh.path) for chat_id, sh in shards.items()}
+        checkpoint.save(progress)
+    progress["partitioned"] = True
+    checkpoint.save(progress)
+    return list(shards.values())
+
+
+def load_results(path: str) -> dict[str, ShardResult]:
+    """Results appended to `path` by an interrupted run; a torn last line is cut off (its shard is redone)."""
+    done: dict[str, ShardResult] = {}
+    if not os.path.exists(path):
+        return done
+    size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            result = ShardResult(**json.loads(line))
+            done[result.chat_id] = result
+            size += len(line)
+    with open(path, "r+b") as f:
+        f.truncate(size)
+    return done
 
 
-def community_id(chat_id: str) -> str:
-    return f"tg:community/{chat_id}"
-
-
-def user_id(user_id: int) -> str:
-    return f"tg:user/{user_id}"
-
-
-def post_id(chat_id: str, message_id: int) -> str:
-    return f"tg:post/{chat_id}/{message_id}"
-
-
-def hashtag_topic_iri(tag: str) -> str:
-    # Keep it simple + deterministic; you can URL-encode later if you want.
-    return f"tg:tag/hashtag/{tag}"
-
-
-def mention_iri(handle: str) -> str:
-    return f"tg:mention/{handle}"
-
-
-def normalize_url(url: str) -> str:
+def write_index(graphs: list[dict[str, Any]], tables: dict[str, Iterable[str]], f: TextIO) -> dict[str, int]:
     """
-    Normalize a URL-like string to a proper URL.
-
-    Telegram sometimes detects bare domain names like "Fly.io" or "Gitcoin.co"
-    as URLs. These need to be normalized to proper URLs with a protocol
-    to avoid issues with RDF serialization (where they'd be mistaken for CURIEs).
+    Write the index as `json.dump(..., ensure_ascii=False, indent=2)` would,
+    streaming the merged tables; returns the number of keys in each.
     """
-    url = url.strip()
-    if not url:
-        return url
-
-    # If it already has a protocol, return as-is
-    if "://" in url:
-        return url
-
-    # Otherwise, add https:// prefix
-    return f"https://{url}"
-
-
-def ordered_dedup(items: list[str]) -> list[str]:
-    seen: set[str] = set()
-    out: list[str] = []
-    for x in items:
-        if not x:
-            continue
-        if x in seen:
-            continue
-        seen.add(x)
-        out.append(x)
-    return out
-
-def graph_id(chat_id: str) -> str:
-    return f"tg:graph/{chat_id}/last7d"
-
-
-def main():
+    counts = {}
+    f.write(json.dumps({"graphs": graphs}, ensure_ascii=False, indent=2)[:-2])
+    for name, keys in tables.items():
+        n = 0
+        f.write(f',\n  "{name}": [')
+        for key in keys:
+            f.write(("," if n else "") + "\n    " + json.dumps(key, ensure_ascii=False))
+            n += 1
+        f.write("\n  ]" if n else "]")
+        counts[name] = n
+    f.write("\n}")
+    return counts
+
+
+def transform(
+    jobs: int, m: StageMetrics, linkml: bool = False, resume: bool = True, memory_budget: int | None = None
+) -> None:
     os.makedirs(os.path.dirname(OUT), exist_ok=True)
-
-    # Keep these for dedup and stable output ordering
-    users: "OrderedDict[int, UserAccount]" = OrderedDict()
-    links: "OrderedDict[str, Link]" = OrderedDict()
-    posts: list[Post] = []
-
-    first_chat_id: str | None = None
-
-    with open(INP, "r", encoding="utf-8") as f:
-        for line in f:
-            obj = json.loads(line)
-
-            chat_id = obj["chat_id"]
-            if first_chat_id is None:
-                first_chat_id = chat_id
-            elif chat_id != first_chat_id:
-                # MVP: single community in one run
-                continue
-
-            message_id = int(obj["message_id"])
-            created_at = obj["created_at"]
-            text = obj.get("text") or ""
-            from_user_id = obj.get("from_user_id")
-            reply_to_message_id = obj.get("reply_to_message_id")
-
-            # From Slice 3
-            urls = obj.get("urls") or []
-            forwards = obj.get("forwards")
-            pinned = obj.get("pinned")
-
-            # From Slice 4 (entities)
-            entities = obj.get("entities") or []
-
-            # Create community object (kept in the document),
-            # but posts will reference it by id string to satisfy LinkML typing.
-            community_obj = Community(id=community_id(chat_id))
-            community_ref = community_obj.id
-
-            creator_ref: str | None = None
-            if from_user_id is not None:
-                uid = int(from_user_id)
-                if uid not in users:
-                    users[uid] = UserAccount(id=user_id(uid))
-                creator_ref = users[uid].id
-
-            # --- Slice 4 parsing: topics, mentions, entity URLs ---
-            topics: list[str] = []
-            mentions: list[str] = []
-            entity_urls: list[str] = []
-
-            for ent in entities:
-                if not isinstance(ent, dict):
-                    continue
-
-                t = ent.get("type")
-                off = ent.get("offset")
-                ln = ent.get("length")
-
-                snippet: str | None = None
-                if isinstance(off, int) and isinstance(ln, int) and ln > 0:
-                    # Note: Telegram entity offsets are in UTF-16 code units.
-                    # This substring can be off for emojis; MVP accepts occasional mismatch.
-                    snippet = text[off : off + ln]
-
-                if t == "MessageEntityHashtag" and snippet:
-                    tag = snippet.lstrip("#")
-                    if tag:
-                        topics.append(hashtag_topic_iri(tag))
-
-                if t == "MessageEntityMention" and snippet:
-                    handle = snippet.lstrip("@")
-                    if handle:
-                        mentions.append(mention_iri(handle))
-
-                if t == "MessageEntityUrl" and snippet:
-                    entity_urls.append(snippet)
-
-                if t == "MessageEntityTextUrl":
-                    url = ent.get("url")
-                    if isinstance(url, str) and url:
-                        entity_urls.append(url)
-
-            topics = ordered_dedup(topics)
-            mentions = ordered_dedup(mentions)
-
-            # Merge regex URLs + entity-derived URLs, normalizing them
-            all_urls = ordered_dedup([normalize_url(u) for u in [*urls, *entity_urls]])
-
-            link_objs: list[Link] = []
-            for url in all_urls:
-                if url not in links:
-                    links[url] = Link(id=url)  # URL string as identifier
-                link_objs.append(links[url])
-
-            link_refs = [lo.id for lo in link_objs] if link_objs else None
-
-            # NOTE: This assumes you've added `topics` and `mentions` slots to Post in your schema.
-            p = Post(
-                id=post_id(chat_id, message_id),
-                content=text,
-                created=created_at,
-                has_container=community_ref,  # reference by id
-                has_creator=creator_ref,      # reference by id
-                links_to=link_refs,           # list of ids
-                reply_to=post_id(chat_id, int(reply_to_message_id)) if reply_to_message_id is not None else None,
-                forwards=int(forwards) if forwards is not None else None,
-                pinned=bool(pinned) if pinned is not None else None,
-                topics=topics if topics else None,
-                mentions=mentions if mentions else None,
-            )
-            posts.append(p)
-
-    if first_chat_id is None:
+    inp = existing_jsonl(INP)
+    m.read(inp)
+
+    checkpoint = Checkpoint(os.path.join(WORK_DIR, "checkpoint.json"), [inp], {"linkml": linkml})
+    progress = (checkpoint.load() if resume else None) or {}
+    if progress:
+        print(f"Resuming from {checkpoint.path}")
+    else:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+        os.makedirs(WORK_DIR)
+
+    if not progress.get("threads"):
+        with m.step("thread_index") as s, open_jsonl(inp) as f:
+            s.count(nodes=build_thread_index((json.loads(line) for line in f), THREAD_DIR))
+        progress["threads"] = True
+        checkpoint.save(progress)
+    m.wrote(THREAD_DIR)
+
+    with m.step("partition") as s:
+        shards = partition(inp, checkpoint, progress)
+        s.count(records_in=sum(sh.records for sh in shards), chats=len(shards))
+
+    if not shards:
+        shutil.rmtree(WORK_DIR)
         raise RuntimeError("No messages found in canonical input file.")
 
-    # Build a single root document.
-    # Use dict forms for inlined multivalued slots to satisfy generated LinkML typing.
-    doc = GraphDocument(
-        id=graph_id(first_chat_id),
-        community=community_id(first_chat_id),
-        users={u.id: {"id": u.id} for u in users.values()},
-        links={link.id: {"id": link.id} for link in links.values()},
-        posts={p.id: p for p in posts},
-    )
+    if len(shards) == 1:
+        # Single community: keep writing the one root document.
+        shard = shards[0]
+        tmp = OUT + ".partial"
+        if memory_budget is not None:
+            with m.step("stream_document") as s, open(shard.path, "r", encoding="utf-8") as f_in:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    result = stream_document(shard.chat_id, (json.loads(line) for line in f_in), f, memory_budget, WORK_DIR)
+                n_posts, n_users, n_links = result.posts, result.users, result.links
+                s.count(posts=n_posts, users=n_users, links=n_links)
+        else:
+            with m.step("build_document") as s, open(shard.path, "r", encoding="utf-8") as f:
+                doc = build_rows(shard.chat_id, (json.loads(line) for line in f))
+                n_posts, n_users, n_links = len(doc.posts), len(doc.users), len(doc.links)
+                s.count(posts=n_posts, users=n_users, links=n_links)
+
+            with m.step("json_dump"), open(tmp, "w", encoding="utf-8") as f:
+                if linkml:
+                    f.write(json_dumper.dumps(graph_document(doc), inject_type=False))
+                else:
+                    write_document(doc, f)
+        os.replace(tmp, OUT)
+        if os.path.exists(INDEX):
+            os.remove(INDEX)  # stale multi-community output
+        shutil.rmtree(WORK_DIR)
+
+        m.count(records_in=shard.records, posts=n_posts)
+        m.wrote(OUT)
+        print(f"Wrote {n_posts} posts, {n_users} users, {n_links} links to {OUT}")
+        return
+
+    # Documents finished before an interruption are kept, with their user and link key files.
+    done = load_results(RESULTS)
+
+    with m.step("transform_shards") as s, open(RESULTS, "a", encoding="utf-8") as f_results:
+
+        def finished(result: ShardResult) -> None:
+            done[result.chat_id] = result
+            f_results.write(json.dumps(asdict(result), ensure_ascii=False) + "\n")
+            f_results.flush()
+            os.fsync(f_results.fileno())
+
+        todo = [sh for sh in shards if sh.chat_id not in done]
+        transform_shards(todo, OUT_DIR, jobs=jobs, linkml=linkml, on_result=finished, memory_budget=memory_budget)
+        results = [done[sh.chat_id] for sh in shards]
+        s.count(posts=sum(r.posts for r in results), resumed=len(shards) - len(todo))
+
+    with m.step("merge_tables") as s:
+        graphs = [
+            {"id": r.graph_id, "chat_id": r.chat_id, "path": r.path, "posts": r.posts, "users": r.users, "links": r.links}
+            for r in results
+        ]
+        tables = {name: merge_tables(shards, name, memory_budget, WORK_DIR) for name in TABLES}
+        # Renamed into place last: dump_rdf.py and the loaders read the documents it lists.
+        with open(INDEX + ".tmp", "w", encoding="utf-8") as f:
+            counts = write_index(graphs, tables, f)
+        os.replace(INDEX + ".tmp", INDEX)
+        users, links = counts["users"], counts["links"]
+        s.count(users=users, links=links)
+    if os.path.exists(OUT):
+        os.remove(OUT)  # stale single-community output
+    shutil.rmtree(WORK_DIR)
+
+    n_posts = sum(r.posts for r in results)
+    m.count(records_in=sum(sh.records for sh in shards), posts=n_posts)
+    m.wrote(OUT_DIR)
+    print(f"Wrote {n_posts} posts, {users} users, {links} links across {len(results)} communities to {OUT_DIR}/")
 
-    with open(OUT, "w", encoding="utf-8") as f:
-        f.write(json_dumper.dumps(doc, inject_type=False))
 
-    print(f"Wrote {len(posts)} posts, {len(users)} users, {len(links)} links to {OUT}")
+def main():
+    parser = argparse.ArgumentParser(description="Transform canonical messages into LinkML graph documents.")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="worker processes for multi-community input (default: CPU count)",
+    )
+    parser.add_argument(
+        "--linkml",
+        action="store_true",
+        help="build LinkML objects and write them with json_dumper (same output, slower; for validating against the model)",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        metavar="MIB",
+        help="stream each document to disk, keeping about MIB MiB of posts, users and links in memory per worker",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="ignore the partitions and documents of an interrupted run and start over",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.memory_budget is not None and args.linkml:
+        parser.error("--linkml builds the whole GraphDocument in memory; it can't be combined with --memory-budget")
+    memory_budget = args.memory_budget << 20 if args.memory_budget is not None else None
+
+    with stage("transform", profile=args.profile) as m:
+        transform(args.jobs, m, linkml=args.linkml, resume=not args.restart, memory_budget=memory_budget)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,161 @@
+"""
+Materialized aggregates kept next to each community graph.
+
+Every community/window graph `tg:graph/<chat>/last7d` gets a companion named
+graph `tg:stats/<chat>/last7d` with counts precomputed at load time:
+
+- posts per user per day: a `tg:UserDay` node with `tg:user`, `tg:day` and
+  `tg:postCount` (its IRI is `<stats graph>/user-day/<user IRI>/<day>`)
+- direct replies per post: `<post> tg:replyCount n`
+- posts per hashtag topic: a `tg:TopicCount` node with `tg:topic` and
+  `tg:postCount` (IRI `<stats graph>/topic/<topic>`)
+- posts linking to a URL: `<url> tg:postCount n`
+
+Counts are kept as signed deltas per key, so an incremental load only
+rewrites the keys touched by the posts it inserted, changed or deleted.
+"""
+
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from builder.rdf import (
+    POST,
+    POST_SLOTS,
+    PREFIXES,
+    RDF_TYPE,
+    XSD_INTEGER,
+    Literal,
+    Quad,
+    Triple,
+    escape_iri,
+)
+
+STATS_OF = PREFIXES["tg"] + "statsOf"
+USER_DAY = PREFIXES["tg"] + "UserDay"
+TOPIC_COUNT = PREFIXES["tg"] + "TopicCount"
+USER = PREFIXES["tg"] + "user"
+DAY = PREFIXES["tg"] + "day"
+TOPIC = PREFIXES["tg"] + "topic"
+POST_COUNT = PREFIXES["tg"] + "postCount"
+REPLY_COUNT = PREFIXES["tg"] + "replyCount"
+XSD_DATE = PREFIXES["xsd"] + "date"
+
+# Post predicates the aggregates are computed from
+TRACKED = {POST_SLOTS[s] for s in ("created", "has_creator", "reply_to", "topics", "links_to")}
+
+# ("user-day", user IRI, day) | ("replies", post IRI, "") | ("topic", topic, "") | ("link", url, "")
+Key = tuple[str, str, str]
+
+
+def stats_graph(graph: str) -> str:
+    """`tg:graph/<chat>/<window>` -> `tg:stats/<chat>/<window>` (as full IRIs)."""
+    return graph.replace(PREFIXES["tg"] + "graph/", PREFIXES["tg"] + "stats/", 1)
+
+
+def _day(created: str) -> str:
+    try:
+        dt = datetime.fromisoformat(created)
+    except ValueError:
+        return created[:10]
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.date().isoformat()
+
+
+def _lexical(o: "str | Literal") -> str:
+    return o.lexical if isinstance(o, Literal) else o
+
+
+def post_keys(pairs: Iterable[tuple[str, "str | Literal"]]) -> set[Key]:
+    """The aggregate keys one post counts towards, from its (predicate, object) pairs."""
+    creator = created = None
+    keys: set[Key] = set()
+    for p, o in pairs:
+        if p == POST_SLOTS["has_creator"]:
+            creator = escape_iri(_lexical(o))
+        elif p == POST_SLOTS["created"]:
+            created = _lexical(o)
+        elif p == POST_SLOTS["reply_to"]:
+            keys.add(("replies", escape_iri(_lexical(o)), ""))
+        elif p == POST_SLOTS["topics"]:
+            keys.add(("topic", _lexical(o), ""))
+        elif p == POST_SLOTS["links_to"]:
+            keys.add(("link", escape_iri(_lexical(o)), ""))
+    if creator is not None and created is not None:
+        keys.add(("user-day", creator, _day(created)))
+    return keys
+
+
+def key_node(stats: str, key: Key) -> str:
+    """Subject the count for `key` is attached to in the stats graph."""
+    kind, a, b = key
+    if kind == "user-day":
+        return f"{stats}/user-day/{quote(a, safe='')}/{b}"
+    if kind == "topic":
+        return f"{stats}/topic/{quote(a, safe='')}"
+    return a  # the post or URL itself
+
+
+def key_triples(stats: str, key: Key, count: int) -> list[Triple]:
+    kind, a, b = key
+    node = key_node(stats, key)
+    n = Literal(str(count), XSD_INTEGER)
+    if kind == "user-day":
+        return [(node, RDF_TYPE, USER_DAY), (node, USER, a), (node, DAY, Literal(b, XSD_DATE)), (node, POST_COUNT, n)]
+    if kind == "topic":
+        return [(node, RDF_TYPE, TOPIC_COUNT), (node, TOPIC, Literal(a)), (node, POST_COUNT, n)]
+    if kind == "replies":
+        return [(node, REPLY_COUNT, n)]
+    return [(node, POST_COUNT, n)]
+
+
+class StatsCollector:
+    """Per-graph aggregate counts (or deltas), fed with posts."""
+
+    def __init__(self) -> None:
+        self.counts: dict[str, Counter[Key]] = {}
+
+    def add(self, graph: str, pairs: Iterable[tuple[str, "str | Literal"]], sign: int = 1) -> None:
+        counts = self.counts.setdefault(graph, Counter())
+        for key in post_keys(pairs):
+            counts[key] += sign
+
+    def observe(self, quads: Iterable[Quad]) -> Iterator[Quad]:
+        """
+        Pass `quads` through unchanged while counting the posts in them.
+
+        Relies on each post's triples being contiguous and starting with its
+        `rdf:type`, as `graph_quads` emits them. A post repeated in the input
+        is counted once, by its first occurrence; `--upsert` is what resolves
+        edits.
+        """
+        seen: set[tuple[str, str]] = set()
+        post: str | None = None
+        graph = ""
+        pairs: list[tuple[str, str | Literal]] = []
+        for quad in quads:
+            s, p, o, g = quad
+            if p == RDF_TYPE and o == POST:
+                if post is not None:
+                    self.add(graph, pairs)
+                post, graph, pairs = None, g, []
+                if (g, s) not in seen:
+                    seen.add((g, s))
+                    post = s
+            elif s == post and p in TRACKED:
+                pairs.append((p, o))
+            yield quad
+        if post is not None:
+            self.add(graph, pairs)
+
+    def quads(self) -> Iterator[Quad]:
+        """Stats triples for every key with a positive count, one stats graph per data graph."""
+        for graph, counts in self.counts.items():
+            stats = stats_graph(graph)
+            yield stats, STATS_OF, graph, stats
+            for key, n in counts.items():
+                if n > 0:
+                    for s, p, o in key_triples(stats, key, n):
+                        yield s, p, o, stats
@@ -0,0 +1,195 @@
+"""
+Crash-safe, resumable line-oriented stages.
+
+A long backfill that dies halfway through shouldn't start over. A stage
+writes its output to `<out>.partial` and, every `CHECKPOINT_EVERY` input
+lines, records in `<out>.checkpoint.json`:
+
+- where it is in its inputs (file index and byte offset, decompressed for
+  `.gz`/`.zst` inputs),
+- how many bytes of the partial output are complete (synced to disk),
+- whatever state it needs to carry on, e.g. the users and links a document
+  has already listed.
+
+Run again over the same inputs (same paths, sizes and mtimes, and the same
+stage parameters), it truncates the partial output to the checkpointed size,
+seeks past the input it already consumed and continues. Otherwise it starts
+from scratch. Only a finished stage renames `<out>.partial` to `<out>`, so a
+file under the final name is always complete.
+
+Compressed outputs are written as one gzip member or zstd frame per
+checkpoint, so truncating at a checkpoint leaves a valid file; readers decode
+concatenated members as one stream. Checkpoints fall on fixed line counts,
+which keeps the output bytes identical across runs.
+"""
+
+import gzip
+import io
+import json
+import os
+from collections.abc import Iterator
+from typing import IO, Any, NamedTuple
+
+from builder.jsonl import GZIP_LEVEL, SUFFIXES, ZSTD_LEVEL, open_binary, zstandard
+
+# Input lines between checkpoints
+CHECKPOINT_EVERY = 100_000
+
+
+class Position(NamedTuple):
+    """Where a stage is in its inputs: the file being read and the byte offset in it."""
+
+    file: int = 0
+    offset: int = 0
+
+
+def fingerprint(paths: list[str]) -> list[list[Any]]:
+    """Identity of the inputs a checkpoint is valid for: path, size and mtime of each."""
+    out = []
+    for path in paths:
+        st = os.stat(path)
+        out.append([path, st.st_size, st.st_mtime_ns])
+    return out
+
+
+def read_lines(paths: list[str], start: Position = Position()) -> Iterator[tuple[bytes, Position]]:
+    """Yield the lines of `paths` from `start`, each with the position just past it."""
+    for i in range(start.file, len(paths)):
+        offset = start.offset if i == start.file else 0
+        with open_binary(paths[i]) as f:
+            if offset:
+                _skip(f, offset)
+            for line in f:
+                offset += len(line)
+                yield line, Position(i, offset)
+
+
+def _skip(f: IO[bytes], n: int) -> None:
+    if f.seekable():
+        # gzip seeks forward by decompressing; still cheaper than parsing the lines again.
+        f.seek(n)
+        return
+    while n > 0:
+        chunk = f.read(min(n, 1 << 20))
+        if not chunk:
+            raise ValueError("input is shorter than its checkpoint")
+        n -= len(chunk)
+
+
+def write_json_atomic(path: str, obj: Any) -> None:
+    # Write-then-rename, so an interrupted write never leaves a truncated file.
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Checkpoint:
+    """A stage's progress record in `path`, valid only for the inputs and `params` it was taken with."""
+
+    def __init__(self, path: str, inputs: list[str], params: dict[str, Any] | None = None):
+        self.path = path
+        self.key = {"inputs": fingerprint(inputs), "params": params or {}}
+
+    def load(self) -> dict[str, Any] | None:
+        """The saved progress, or None if there is none for these inputs."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if {k: saved.get(k) for k in self.key} != json.loads(json.dumps(self.key)):
+            return None
+        return saved["progress"]
+
+    def save(self, progress: dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        write_json_atomic(self.path, {**self.key, "progress": progress})
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ResumableOutput:
+    """
+    Text output of a line-oriented stage, written to `<path>.partial` and
+    renamed to `path` by `finish()`.
+
+    On construction it picks up a matching checkpoint: `start` is the input
+    position to continue from, `state` what the stage saved with it and
+    `resumed` whether there was one. `checkpoint()` makes everything written
+    so far durable and records it. Leaving the `with` block on an error keeps
+    the partial file and checkpoint for the next run.
+    """
+
+    def __init__(self, path: str, inputs: list[str], params: dict[str, Any] | None = None, resume: bool = True):
+        self.path = path
+        self.partial = f"{path}.partial"
+        self.ckpt = Checkpoint(f"{path}.checkpoint.json", inputs, params)
+        self.start = Position()
+        self.state: dict[str, Any] = {}
+        self.resumed = False
+
+        saved = self.ckpt.load() if resume else None
+        size = saved["output_bytes"] if saved else 0
+        if saved and os.path.exists(self.partial) and os.path.getsize(self.partial) >= size:
+            self.start = Position(*saved["position"])
+            self.state = saved["state"]
+            self.resumed = True
+            self.raw = open(self.partial, "r+b")
+            self.raw.truncate(size)
+            self.raw.seek(size)
+        else:
+            self.ckpt.remove()
+            self.raw = open(self.partial, "wb")
+        self._open_segment()
+
+    def _open_segment(self) -> None:
+        name = os.path.basename(self.path)
+        self.segment: IO[bytes] | None = None
+        if self.path.endswith(SUFFIXES["gzip"]):
+            # Named after the final file, so the gzip header doesn't mention `.partial`.
+            self.segment = gzip.GzipFile(name[: -len(SUFFIXES["gzip"])], "wb", GZIP_LEVEL, self.raw, mtime=0)
+        elif self.path.endswith(SUFFIXES["zstd"]):
+            if zstandard is None:
+                raise RuntimeError(f"Writing {self.path} needs the zstandard package (uv pip install zstandard)")
+            self.segment = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self.raw, closefd=False)
+        self.text = io.TextIOWrapper(self.segment or self.raw, encoding="utf-8")
+        # Bound directly: stages write one short line at a time.
+        self.write = self.text.write
+
+    def _close_segment(self) -> None:
+        self.text.detach()
+        if self.segment is not None:
+            # Ends the gzip member or zstd frame; the underlying file stays open.
+            self.segment.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+
+    def checkpoint(self, position: Position, state: dict[str, Any] | None = None) -> None:
+        """Record that the input up to `position` is fully written, along with the stage's `state`."""
+        self.text.flush()
+        self._close_segment()
+        self.ckpt.save({"position": list(position), "output_bytes": self.raw.tell(), "state": state or {}})
+        self._open_segment()
+
+    def finish(self) -> None:
+        """Complete the output: rename it to its final path and drop the checkpoint."""
+        self.text.flush()
+        self._close_segment()
+        self.raw.close()
+        os.replace(self.partial, self.path)
+        self.ckpt.remove()
+
+    def __enter__(self) -> "ResumableOutput":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc: Any) -> None:
+        if not self.raw.closed:
+            # Interrupted: whatever follows the last checkpoint is truncated on resume.
+            self.text.flush()
+            self._close_segment()
+            self.raw.close()
@@ -0,0 +1,177 @@
+"""
+Generate `builder/sioc_triples.py` from the LinkML schema.
+
+For every class the generator emits a function turning a plain record (a
+dict keyed by slot name, as `post_record` or `json_dumper` produce) straight
+into triples. Class and slot URIs, ranges and datatypes are resolved here,
+once, so the generated code is a flat sequence of `if`/`yield` statements
+with no schema lookups, reflection or `YAMLRoot` coercion per object. The
+triples match what `rdflib_dumper` writes for the same data.
+
+Usage (after editing the schema):
+
+    uv run python -m builder.codegen schemas/sioc_min.yaml > src/builder/sioc_triples.py
+"""
+
+import argparse
+import re
+import sys
+
+from linkml_runtime.linkml_model.meta import SlotDefinition
+from linkml_runtime.utils.schemaview import SchemaView
+
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+# xsd datatype -> expression building the object term from `v`
+_LITERALS = {
+    XSD + "string": "Literal(v)",
+    XSD + "dateTime": "Literal(normalize_datetime(v), {dt})",
+    XSD + "integer": "Literal(str(int(v)), {dt})",
+    XSD + "boolean": 'Literal("true" if v else "false", {dt})',
+}
+
+
+def constant(name: str) -> str:
+    """`GraphDocument` -> `GRAPH_DOCUMENT`."""
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", "_", name).upper()
+
+
+def snake(name: str) -> str:
+    return constant(name).lower()
+
+
+class Generator:
+    def __init__(self, schema: str):
+        self.schema = schema
+        self.sv = SchemaView(schema)
+        self.classes = list(self.sv.all_classes())
+        self.lines: list[str] = []
+
+    def emit(self, line: str = "", indent: int = 0) -> None:
+        self.lines.append("    " * indent + line if line else "")
+
+    def prefixes(self) -> dict[str, str]:
+        out = {"rdf": RDF, "xsd": XSD}
+        for prefix in self.sv.schema.prefixes:
+            out[prefix] = str(self.sv.namespaces()[prefix])
+        return out
+
+    def slots(self, cls: str) -> list[SlotDefinition]:
+        return [s for s in self.sv.class_induced_slots(cls) if not s.identifier]
+
+    def object_expr(self, slot: SlotDefinition) -> str:
+        """Expression for the object term of `slot` given its value `v`."""
+        if slot.range in self.sv.all_classes():
+            return "expand(_id(v))"
+        if slot.range in self.sv.all_types():
+            dt = self.sv.expand_curie(self.sv.get_type(slot.range).uri)
+            if dt not in _LITERALS:
+                raise ValueError(f"No literal conversion for {slot.name} (range {slot.range}, {dt})")
+            return _LITERALS[dt].format(dt=self.datatype_constant(dt))
+        if slot.range in self.sv.all_enums():
+            return "Literal(str(v))"
+        raise ValueError(f"Unsupported range {slot.range!r} for slot {slot.name}")
+
+    def datatype_constant(self, dt: str) -> str:
+        return "XSD_" + dt[len(XSD) :].upper()
+
+    def inlined(self, slot: SlotDefinition) -> bool:
+        return bool(slot.inlined or slot.inlined_as_list) and slot.range in self.sv.all_classes()
+
+    def generate(self) -> str:
+        self.emit(f"# Auto-generated from {self.schema} by `python -m builder.codegen`; do not edit.")
+        self.emit('"""')
+        self.emit(f"Record -> triples functions for every class of `{self.sv.schema.name}`.")
+        self.emit()
+        self.emit("Each `<class>_triples(record)` takes a dict keyed by slot name and yields")
+        self.emit("the triples `rdflib_dumper` writes for that object, with URIs and datatypes")
+        self.emit("fixed at generation time. Inlined slots recurse into the nested records.")
+        self.emit('"""')
+        self.emit()
+        self.emit("from collections.abc import Iterator")
+        self.emit("from typing import Any")
+        self.emit()
+        self.emit("from builder.terms import Literal, Triple, normalize_datetime")
+        self.emit()
+        self.emit("PREFIXES = {")
+        for prefix, ns in self.prefixes().items():
+            self.emit(f'"{prefix}": "{ns}",', 1)
+        self.emit("}")
+        self.emit()
+        self.emit(f'RDF_TYPE = "{RDF}type"')
+        used = {
+            self.sv.expand_curie(self.sv.get_type(s.range).uri)
+            for c in self.classes
+            for s in self.slots(c)
+            if s.range in self.sv.all_types()
+        }
+        for dt in sorted(used - {XSD + "string"}):
+            self.emit(f'{self.datatype_constant(dt)} = "{dt}"')
+        self.emit()
+        self.emit("# Class URIs")
+        for cls in self.classes:
+            self.emit(f'{constant(cls)} = "{self.sv.get_uri(cls, expand=True)}"')
+        for cls in self.classes:
+            self.emit()
+            self.emit(f"# {cls} slot name -> slot URI")
+            slots = self.slots(cls)
+            if not slots:
+                self.emit(f"{constant(cls)}_SLOTS: dict[str, str] = {{}}")
+                continue
+            self.emit(f"{constant(cls)}_SLOTS = {{")
+            for slot in slots:
+                self.emit(f'"{slot.name}": "{self.sv.get_uri(slot, expand=True)}",', 1)
+            self.emit("}")
+        self.emit()
+        self.emit()
+        self.emit("def expand(ref: str) -> str:")
+        self.emit('"""Expand a CURIE using the schema prefixes; full IRIs pass through."""', 1)
+        self.emit('prefix, sep, local = ref.partition(":")', 1)
+        self.emit('if sep and prefix in PREFIXES and not local.startswith("//"):', 1)
+        self.emit("return PREFIXES[prefix] + local", 2)
+        self.emit("return ref", 1)
+        self.emit()
+        self.emit()
+        self.emit("def _id(v: Any) -> str:")
+        self.emit("# References are ids; inlined objects carry theirs in `id`.", 1)
+        self.emit('return v if isinstance(v, str) else v["id"]', 1)
+        self.emit()
+        self.emit()
+        self.emit("def _items(v: Any) -> Any:")
+        self.emit("# Multivalued slots come as lists, or as dicts keyed by id when inlined as a dict.", 1)
+        self.emit("return v.values() if isinstance(v, dict) else v", 1)
+        for cls in self.classes:
+            self.function(cls)
+        return "\n".join(self.lines) + "\n"
+
+    def function(self, cls: str) -> None:
+        name = snake(cls)
+        self.emit()
+        self.emit()
+        self.emit(f"def {name}_triples(record: dict[str, Any]) -> Iterator[Triple]:")
+        self.emit('s = expand(record["id"])', 1)
+        self.emit(f"yield s, RDF_TYPE, {constant(cls)}", 1)
+        for slot in self.slots(cls):
+            # Predicates are inlined as string constants: no lookups per triple.
+            p = f'"{self.sv.get_uri(slot, expand=True)}"'
+            if slot.multivalued:
+                self.emit(f'for v in _items(record.get("{slot.name}") or ()):', 1)
+            else:
+                self.emit(f'v = record.get("{slot.name}")', 1)
+                self.emit("if v is not None:", 1)
+            self.emit(f"yield s, {p}, {self.object_expr(slot)}", 2)
+            if self.inlined(slot):
+                self.emit("if isinstance(v, dict):", 2)
+                self.emit(f"yield from {snake(slot.range)}_triples(v)", 3)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate record -> triples functions from a LinkML schema.")
+    parser.add_argument("schema", nargs="?", default="schemas/sioc_min.yaml")
+    args = parser.parse_args()
+    sys.stdout.write(Generator(args.schema).generate())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""
+Daily per-chat partitions of the raw, canonical and RDF data.
+
+The batch stages rebuild one hard-wired "last 7 days" window from scratch on
+every run. Here each (chat, UTC day) is a partition of its own:
+
+    data/days/manifest.json
+    data/days/<chat_id>/<YYYY-MM-DD>/raw.jsonl         messages posted that day, by message id
+    data/days/<chat_id>/<YYYY-MM-DD>/canonical.jsonl   the same, canonicalized
+    data/days/<chat_id>/<YYYY-MM-DD>/graph.nq          its GraphDocument, in graph tg:graph/<chat>/day/<day>
+    data/days/<chat_id>/<YYYY-MM-DD>/aggregates.json   its aggregate counts (see `builder.aggregates`)
+
+`split_raw` merges raw extracts into the days they touch (a re-fetched
+message replaces its earlier copy) and records a digest of each day's
+content in the manifest. `process_days` re-canonicalizes and re-serializes
+only the days whose digest changed since they were last processed, in
+parallel.
+
+Rolling windows (`last7d`, `last30d`, `all`) are assembled from the day
+files without reprocessing them: canonical lines are concatenated, quads
+are renamed from the day graph to the window graph, and aggregate counts are
+summed (each post belongs to exactly one day, so they add up). A loaded
+window is kept up to date incrementally: days that changed or entered the
+window are upserted and days that left it are deleted, through
+`builder.store.apply_changes`. Retention (`prune`) deletes expired days from
+the loaded windows the same way, then from disk.
+"""
+
+import hashlib
+import os
+import shutil
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+from datetime import date, datetime, timedelta, timezone
+from itertools import batched
+from typing import Any, cast
+
+from pyoxigraph import NamedNode, Quad, RdfFormat, Store, parse
+
+from builder.aggregates import Key, StatsCollector, stats_graph
+from builder.canonical import canonicalize, extract_chat_id
+from builder.checkpoint import write_json_atomic
+from builder.jsonl import dumps, existing_jsonl, iter_jsonl, loads, open_jsonl, target_jsonl
+from builder.rdf import DOC_POSTS, GRAPH_DOCUMENT, LINK, RDF_TYPE, USER_ACCOUNT, expand, graph_quads, nt_iri, write_quads
+from builder.store import UpsertStats, apply_changes, clear_graphs
+from builder.transform import graph_id
+
+DAYS_DIR = "data/days"
+WINDOWS_DIR = "data/windows"
+MANIFEST = os.path.join(DAYS_DIR, "manifest.json")
+
+RAW = "raw.jsonl"
+CANONICAL = "canonical.jsonl"
+GRAPH = "graph.nq"
+AGGREGATES = "aggregates.json"
+WINDOW_INFO = "window.json"
+
+# Raw lines buffered by `split_raw` before they are appended to their day's scratch file
+SPOOL_BYTES = 64 << 20
+# Posts per `apply_changes` transaction when updating a loaded window
+APPLY_BATCH = 1_000
+
+
+def day_dir(chat_id: str, day: str, root: str = DAYS_DIR) -> str:
+    return os.path.join(root, chat_id, day)
+
+
+def day_window(day: str) -> str:
+    """The `graph_id` window of a single day's document."""
+    return f"day/{day}"
+
+
+def window_name(days: int | None) -> str:
+    return "all" if days is None else f"last{days}d"
+
+
+def utc_day(created: str) -> str | None:
+    try:
+        dt = datetime.fromisoformat(created)
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.date().isoformat()
+
+
+def load_manifest(path: str = MANIFEST) -> dict[str, Any]:
+    """`days`: "<chat>/<day>" -> entry; `windows`: window -> the days loaded into the store, with digests."""
+    if not os.path.exists(path):
+        return {"days": {}, "windows": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return loads(f.read())
+
+
+def save_manifest(manifest: dict[str, Any], path: str = MANIFEST) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    manifest["days"] = dict(sorted(manifest["days"].items()))
+    write_json_atomic(path, manifest)
+
+
+def _write_jsonl_atomic(path: str, lines: Iterable[str]) -> str:
+    """Write `lines` to `path` (compressed per `KG_COMPRESS`) via a rename; returns the path written."""
+    out = target_jsonl(path)
+    # Keeps the compression suffix, which picks the codec.
+    tmp = os.path.join(os.path.dirname(out), ".tmp-" + os.path.basename(out))
+    with open_jsonl(tmp, "w") as f:
+        for line in lines:
+            f.write(line)
+    os.replace(tmp, out)
+    return out
+
+
+# --- Splitting raw extracts into days ---
+
+
+class _Spool:
+    """Lines grouped by key, appended to one scratch file per key whenever `limit` bytes are buffered."""
+
+    def __init__(self, directory: str, limit: int = SPOOL_BYTES):
+        self.dir = directory
+        self.limit = limit
+        self.buffers: dict[tuple[str, str], list[str]] = {}
+        self.size = 0
+        self.paths: dict[tuple[str, str], str] = {}
+
+    def add(self, key: tuple[str, str], line: str) -> None:
+        self.buffers.setdefault(key, []).append(line)
+        self.size += len(line)
+        if self.size > self.limit:
+            self.flush()
+
+    def flush(self) -> None:
+        for key, lines in self.buffers.items():
+            path = self.paths.setdefault(key, os.path.join(self.dir, f"{len(self.paths):06d}.jsonl"))
+            with open(path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+        self.buffers, self.size = {}, 0
+
+
+def _raw_key(obj: dict[str, Any]) -> tuple[str, str, int] | None:
+    chat_id = extract_chat_id(obj.get("peer_id"))
+    created = obj.get("date")
+    if chat_id is None or obj.get("id") is None or not isinstance(created, str):
+        return None  # canonicalize would drop it too
+    day = utc_day(created)
+    return (chat_id, day, int(obj["id"])) if day is not None else None
+
+
+def split_raw(paths: list[str], manifest: dict[str, Any], root: str = DAYS_DIR) -> list[str]:
+    """
+    Merge the raw JSONL `paths` into day partitions; returns the days whose content changed.
+
+    Days the input doesn't touch are left alone. Within a day, messages are
+    kept by id (the later copy of a message wins) and written in id order.
+    """
+    os.makedirs(root, exist_ok=True)
+    scratch = os.path.join(root, ".split")
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    try:
+        spool = _Spool(scratch)
+        for path in paths:
+            with open_jsonl(path) as f:
+                for line in f:
+                    key = _raw_key(loads(line))
+                    if key is not None:
+                        spool.add(key[:2], line if line.endswith("\n") else line + "\n")
+        spool.flush()
+
+        changed = []
+        for (chat_id, day), path in spool.paths.items():
+            d = day_dir(chat_id, day, root)
+            messages: dict[int, str] = {}
+            existing = existing_jsonl(os.path.join(d, RAW))
+            sources = [existing, path] if os.path.exists(existing) else [path]
+            for source in sources:
+                with open_jsonl(source) as f:
+                    for line in f:
+                        messages[int(loads(line)["id"])] = line
+            lines = [messages[i] for i in sorted(messages)]
+            digest = hashlib.sha256("".join(lines).encode("utf-8")).hexdigest()
+
+            name = f"{chat_id}/{day}"
+            entry = manifest["days"].get(name)
+            if entry is not None and entry["raw"] == digest and os.path.exists(existing):
+                continue
+            os.makedirs(d, exist_ok=True)
+            _write_jsonl_atomic(os.path.join(d, RAW), lines)
+            manifest["days"][name] = {
+                "chat_id": chat_id,
+                "day": day,
+                "raw": digest,
+                "messages": len(lines),
+                **{k: (entry or {}).get(k) for k in ("processed", "records", "quads")},
+            }
+            changed.append(name)
+        return changed
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+# --- Processing days ---
+
+
+def process_day(chat_id: str, day: str, root: str = DAYS_DIR) -> tuple[int, int]:
+    """Canonicalize one day and write its N-Quads and aggregate counts; returns (records, quads)."""
+    d = day_dir(chat_id, day, root)
+    records = [c for c in map(canonicalize, iter_jsonl(existing_jsonl(os.path.join(d, RAW)))) if c is not None]
+    _write_jsonl_atomic(os.path.join(d, CANONICAL), (dumps(r) + "\n" for r in records))
+
+    collector = StatsCollector()
+    tmp = os.path.join(d, ".tmp-" + GRAPH)
+    with open(tmp, "w", encoding="utf-8") as f:
+        n = write_quads(collector.observe(graph_quads(records, window=day_window(day))), f) if records else 0
+    os.replace(tmp, os.path.join(d, GRAPH))
+    counts = collector.counts.get(expand(graph_id(chat_id, day_window(day))), Counter())
+    write_json_atomic(os.path.join(d, AGGREGATES), [[*key, c] for key, c in counts.items()])
+    return len(records), n
+
+
+def stale_days(manifest: dict[str, Any], root: str = DAYS_DIR) -> list[str]:
+    """Days changed since they were processed (or whose outputs are missing)."""
+    out = []
+    for name, e in manifest["days"].items():
+        d = day_dir(e["chat_id"], e["day"], root)
+        done = os.path.exists(os.path.join(d, GRAPH)) and os.path.exists(os.path.join(d, AGGREGATES))
+        if e.get("processed") != e["raw"] or not done:
+            out.append(name)
+    return out
+
+
+def process_days(manifest: dict[str, Any], jobs: int | None = None, root: str = DAYS_DIR) -> list[str]:
+    """Process every stale day, in `jobs` worker processes; returns the days processed."""
+    names = stale_days(manifest, root)
+    entries = [manifest["days"][n] for n in names]
+    chats, days = [e["chat_id"] for e in entries], [e["day"] for e in entries]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for e, (records, quads) in zip(entries, pool.map(process_day, chats, days, [root] * len(days))):
+            e.update(processed=e["raw"], records=records, quads=quads)
+    return names
+
+
+# --- Windows ---
+
+
+def window_days(manifest: dict[str, Any], days: int | None, today: date) -> list[str]:
+    """The processed days of a `days`-day window ending `today` (all of them for None), by chat then day."""
+    first = (today - timedelta(days=days - 1)).isoformat() if days is not None else ""
+    last = today.isoformat()
+    return sorted(
+        name
+        for name, e in manifest["days"].items()
+        if first <= e["day"] <= last and e.get("processed") == e["raw"]
+    )
+
+
+def _day_records(e: dict[str, Any], root: str) -> Iterator[dict[str, Any]]:
+    path = existing_jsonl(os.path.join(day_dir(e["chat_id"], e["day"], root), CANONICAL))
+    if os.path.exists(path):
+        yield from iter_jsonl(path)
+
+
+def assemble_window(
+    manifest: dict[str, Any], names: list[str], window: str, out_dir: str, root: str = DAYS_DIR
+) -> dict[str, Any]:
+    """
+    Write the canonical JSONL, N-Quads and aggregates of `window` over the
+    days `names` to `out_dir`, plus a `window.json` describing them.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    entries = [manifest["days"][n] for n in names]
+
+    def canonical_lines() -> Iterator[str]:
+        for e in entries:
+            path = existing_jsonl(os.path.join(day_dir(e["chat_id"], e["day"], root), CANONICAL))
+            with open_jsonl(path) as f:
+                yield from f
+
+    canonical = _write_jsonl_atomic(os.path.join(out_dir, CANONICAL), canonical_lines())
+
+    # Post triples appear in exactly one day. Document headers and user/link tables repeat across
+    # days, so those lines are written once; the `tg:posts` edges are one per post and skip the check.
+    post_prefix = "<" + expand("tg:post/")
+    posts_edge = f" {nt_iri(DOC_POSTS)} "
+    seen: set[str] = set()
+    collector = StatsCollector()
+    graphs: dict[str, None] = {}
+    quads = 0
+    tmp = os.path.join(out_dir, ".tmp-" + GRAPH)
+    with open(tmp, "w", encoding="utf-8") as out:
+        for e in entries:
+            d = day_dir(e["chat_id"], e["day"], root)
+            graph = expand(graph_id(e["chat_id"], window))
+            graphs.setdefault(graph)
+            day_token = nt_iri(expand(graph_id(e["chat_id"], day_window(e["day"]))))
+            window_token = nt_iri(graph)
+            with open(os.path.join(d, GRAPH), "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.replace(day_token, window_token)
+                    if not line.startswith(post_prefix) and posts_edge not in line:
+                        if line in seen:
+                            continue
+                        seen.add(line)
+                    out.write(line)
+                    quads += 1
+            with open(os.path.join(d, AGGREGATES), "r", encoding="utf-8") as f:
+                counts = collector.counts.setdefault(graph, Counter())
+                for kind, a, b, c in loads(f.read()):
+                    key: Key = (kind, a, b)
+                    counts[key] += c
+    os.replace(tmp, os.path.join(out_dir, GRAPH))
+    with open(os.path.join(out_dir, "aggregates.nq"), "w", encoding="utf-8") as f:
+        aggregates = write_quads(collector.quads(), f)
+
+    info = {
+        "window": window,
+        "days": {n: manifest["days"][n]["raw"] for n in names},
+        "graphs": list(graphs),
+        "canonical": canonical,
+        "records": sum(e["records"] or 0 for e in entries),
+        "quads": quads,
+        "aggregates": aggregates,
+    }
+    write_json_atomic(os.path.join(out_dir, WINDOW_INFO), info)
+    return info
+
+
+def _apply(
+    store: Store, window: str, records: Iterable[dict[str, Any]], deleted: Iterable[tuple[str, int]] = ()
+) -> UpsertStats:
+    total = UpsertStats()
+    for batch in batched(records, APPLY_BATCH):
+        _add(total, apply_changes(store, batch, window=window))
+    for gone in batched(deleted, APPLY_BATCH):
+        _add(total, apply_changes(store, [], gone, window=window))
+    return total
+
+
+def _add(total: UpsertStats, stats: UpsertStats) -> None:
+    for f in fields(stats):
+        setattr(total, f.name, getattr(total, f.name) + getattr(stats, f.name))
+
+
+def window_graphs(store: Store, window: str) -> set[str]:
+    """The documents of `window` in the store (one per chat)."""
+    prefix, suffix = expand("tg:graph/"), f"/{window}"
+    q = f"SELECT ?g WHERE {{ GRAPH ?g {{ ?g {nt_iri(RDF_TYPE)} {nt_iri(GRAPH_DOCUMENT)} }} }}"
+    graphs = (row["g"].value for row in cast(Iterable[Any], store.query(q)))
+    # Chat ids contain no "/", so the suffix can't match another window's graphs.
+    return {g for g in graphs if g.startswith(prefix) and g.endswith(suffix) and "/" not in g[len(prefix) : -len(suffix)]}
+
+
+def _is_header(q: Quad) -> bool:
+    """Document slots other than `tg:posts`, and the user and link types: what `apply_changes` only ever adds."""
+    if q.subject == q.graph_name:
+        return q.predicate.value != DOC_POSTS
+    return q.predicate.value == RDF_TYPE and q.object.value in (USER_ACCOUNT, LINK)
+
+
+def _reconcile_headers(store: Store, graphs: list[str], out_dir: str) -> int:
+    """Make the header triples of `graphs` in the store match the assembled window; returns triples changed."""
+    nodes = {NamedNode(g) for g in graphs}
+    wanted = {q for q in parse(path=os.path.join(out_dir, GRAPH), format=RdfFormat.N_QUADS) if _is_header(q)}
+    current = {q for g in nodes for q in store.quads_for_pattern(None, None, None, g) if _is_header(q)}
+
+    def data(quads: set[Quad]) -> str:
+        return " ".join(f"GRAPH {q.graph_name} {{ {q.subject} {q.predicate} {q.object} }}" for q in quads)
+
+    ops = []
+    if current - wanted:
+        ops.append(f"DELETE DATA {{ {data(current - wanted)} }}")
+    if wanted - current:
+        ops.append(f"INSERT DATA {{ {data(wanted - current)} }}")
+    if ops:
+        store.update(" ;\n".join(ops))
+    return len(current ^ wanted)
+
+
+def load_window(store: Store, manifest: dict[str, Any], info: dict[str, Any], out_dir: str, root: str = DAYS_DIR) -> str:
+    """
+    Bring the store's `window` graphs up to date with an assembled window.
+
+    The first time (or if the graphs are gone) the window is bulk loaded,
+    replacing whatever its graphs held. Afterwards only the days that
+    changed or entered the window are upserted, and the days that left it
+    deleted; the documents' user and link tables, which `apply_changes`
+    only grows, are then set to the assembled ones. Returns a summary of
+    what was done.
+    """
+    window = info["window"]
+    target: dict[str, str] = info["days"]
+    loaded: dict[str, str] | None = manifest["windows"].get(window)
+    before = window_graphs(store, window)
+    expected = {expand(graph_id(manifest["days"][n]["chat_id"], window)) for n in loaded or () if n in manifest["days"]}
+
+    if loaded is None or not expected <= before:
+        graphs = [*info["graphs"], *(g for g in before if g not in info["graphs"])]
+        clear_graphs(store, [*graphs, *(stats_graph(g) for g in graphs)])
+        for name in (GRAPH, "aggregates.nq"):
+            store.bulk_load(path=os.path.join(out_dir, name), format=RdfFormat.N_QUADS)
+        summary = f"bulk loaded {info['quads']} quads from {len(target)} days"
+    else:
+        changed = [n for n in target if loaded.get(n) != target[n]]
+        left = [n for n in loaded if n not in target and n in manifest["days"]]
+        upserted = _apply(store, window, (r for n in changed for r in _day_records(manifest["days"][n], root)))
+        deleted = _apply(
+            store,
+            window,
+            (),
+            ((r["chat_id"], r["message_id"]) for n in left for r in _day_records(manifest["days"][n], root)),
+        )
+        # Chats with no days left in the window lose their graphs; the others get exact user and link tables.
+        dropped = [g for g in before if g not in info["graphs"]]
+        clear_graphs(store, [*dropped, *(stats_graph(g) for g in dropped)])
+        fixed = _reconcile_headers(store, info["graphs"], out_dir)
+        summary = (
+            f"{len(changed)} days upserted ({upserted}), {len(left)} days removed ({deleted.deleted} posts), "
+            f"{fixed} header triples reconciled"
+        )
+    store.flush()
+    manifest["windows"][window] = target
+    return summary
+
+
+# --- Retention ---
+
+
+def expired_days(manifest: dict[str, Any], keep_days: int, today: date) -> list[str]:
+    cutoff = (today - timedelta(days=keep_days - 1)).isoformat()
+    return [name for name, e in manifest["days"].items() if e["day"] < cutoff]
+
+
+def prune(manifest: dict[str, Any], names: list[str], store: Store | None = None, root: str = DAYS_DIR) -> int:
+    """
+    Drop the days `names`: their posts leave every loaded window (with
+    `store`), then their partitions are deleted. Returns the posts removed
+    from the store. Reloading a window afterwards trims its user and link
+    tables to the days that are left.
+    """
+    removed = 0
+    for window, loaded in manifest["windows"].items():
+        gone = [n for n in names if n in loaded]
+        if not gone:
+            continue
+        if store is None:
+            raise RuntimeError(f"Days to prune are loaded in window {window}; the store must be open")
+        ids = ((r["chat_id"], r["message_id"]) for n in gone for r in _day_records(manifest["days"][n], root))
+        removed += _apply(store, window, (), ids).deleted
+        for n in gone:
+            del loaded[n]
+    if store is not None:
+        store.flush()
+
+    for name in names:
+        e = manifest["days"].pop(name)
+        shutil.rmtree(day_dir(e["chat_id"], e["day"], root), ignore_errors=True)
+        chat_dir = os.path.join(root, e["chat_id"])
+        if os.path.isdir(chat_dir) and not os.listdir(chat_dir):
+            os.rmdir(chat_dir)
+    return removed
@@ -0,0 +1,427 @@
+"""
+Build `GraphDocument`s per community, optionally in parallel.
+
+Canonical input is partitioned by `chat_id` into one spill file per chat, and
+each partition is transformed independently (in a process pool when asked).
+Users and links are shared across communities; their merged tables are
+ordered by the first appearance of each chat and then by first-seen order
+within it, so the result does not depend on worker scheduling.
+
+Documents are held as `PostRow` tuples whose repeated IRIs (community,
+creators, topics, mentions, links) share one string per document, and are
+written as the JSON `json_dumper` would produce. LinkML objects are only
+built when asked for (`linkml=True`), e.g. to validate against the model.
+With a memory budget, `stream_document` writes each post out as it is built
+instead, and its tables move to disk past the budget (`builder.spill`).
+"""
+
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import repeat
+from typing import Any, NamedTuple, TextIO
+
+from linkml_runtime.dumpers import json_dumper
+
+from builder.sioc_model import GraphDocument, Post
+from builder.spill import MemoryBudget, SpillTable
+from builder.terms import normalize_datetime
+from builder.transform import community_id, graph_id, post_record
+
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+_decode_key = json.JSONDecoder().raw_decode
+
+
+@dataclass
+class ChatShard:
+    chat_id: str
+    path: str
+    records: int = 0
+
+
+@dataclass
+class ShardResult:
+    chat_id: str
+    graph_id: str
+    path: str
+    posts: int
+    users: int = 0
+    links: int = 0
+
+
+# Cross-community tables; each shard lists its keys in `key_file(shard, table)`
+TABLES = ("users", "links")
+
+
+class PostRow(NamedTuple):
+    """`Post` slot values, in the order `json_dumper` writes them."""
+
+    id: str
+    content: str | None
+    created: str | None
+    has_creator: str | None
+    has_container: str | None
+    reply_to: str | None
+    links_to: tuple[str, ...] | None
+    forwards: int | None
+    pinned: bool | None
+    topics: tuple[str, ...] | None
+    mentions: tuple[str, ...] | None
+
+
+class Interner:
+    """One shared copy of each repeated string (IRIs mostly), for the lifetime of a document."""
+
+    __slots__ = ("table",)
+
+    def __init__(self) -> None:
+        self.table: dict[str, str] = {}
+
+    def __call__(self, s: str) -> str:
+        return self.table.setdefault(s, s)
+
+    def many(self, items: list[str] | None) -> tuple[str, ...] | None:
+        return tuple(self.table.setdefault(s, s) for s in items) if items else None
+
+
+def post_row(record: dict[str, Any], intern: Interner) -> PostRow:
+    creator = record["has_creator"]
+    return PostRow(
+        id=record["id"],
+        content=record["content"],
+        # As XSDDateTime normalizes it when `Post` is built
+        created=normalize_datetime(record["created"]) if record["created"] is not None else None,
+        has_creator=intern(creator) if creator is not None else None,
+        has_container=intern(record["has_container"]),
+        reply_to=record["reply_to"],
+        links_to=intern.many(record["links_to"]),
+        forwards=record["forwards"],
+        pinned=record["pinned"],
+        topics=intern.many(record["topics"]),
+        mentions=intern.many(record["mentions"]),
+    )
+
+
+@dataclass
+class DocumentRows:
+    """One community's `GraphDocument`, without the LinkML objects."""
+
+    chat_id: str
+    users: dict[str, None] = field(default_factory=dict)
+    links: dict[str, None] = field(default_factory=dict)
+    posts: dict[str, PostRow] = field(default_factory=dict)
+
+    @property
+    def id(self) -> str:
+        return graph_id(self.chat_id)
+
+
+def build_rows(chat_id: str, records: Iterable[dict[str, Any]]) -> DocumentRows:
+    doc = DocumentRows(chat_id)
+    intern = Interner()
+    for obj in records:
+        row = post_row(post_record(obj), intern)
+        # Keep these for dedup and stable output ordering
+        if row.has_creator is not None:
+            doc.users.setdefault(row.has_creator)
+        for url in row.links_to or ():
+            doc.links.setdefault(url)
+        # A repeated post keeps its first position and its last values, like `posts={p.id: p}`.
+        doc.posts[row.id] = row
+    return doc
+
+
+def graph_document(doc: DocumentRows) -> GraphDocument:
+    """The LinkML `GraphDocument` for `doc`."""
+    # Use dict forms for inlined multivalued slots to satisfy generated LinkML typing.
+    return GraphDocument(
+        id=doc.id,
+        community=community_id(doc.chat_id),
+        users={u: {"id": u} for u in doc.users},
+        links={url: {"id": url} for url in doc.links},
+        posts={
+            row.id: Post(**{k: list(v) if isinstance(v, tuple) else v for k, v in row._asdict().items()})
+            for row in doc.posts.values()
+        },
+    )
+
+
+def _post_json(row: PostRow) -> str:
+    fields = []
+    for key, v in zip(PostRow._fields, row):
+        if v is None:
+            continue
+        if isinstance(v, tuple):
+            items = ",\n".join(f"        {_encode(x)}" for x in v)
+            fields.append(f'      "{key}": [\n{items}\n      ]')
+        else:
+            fields.append(f'      "{key}": {_encode(v)}')
+    return "{\n" + ",\n".join(fields) + "\n    }"
+
+
+def _ref_json(iri: str) -> str:
+    return f'{{\n      "id": {_encode(iri)}\n    }}'
+
+
+def _entry(key: str, value: str) -> str:
+    return f"    {_encode(key)}: {value}"
+
+
+def _write_json(chat_id: str, tables: list[tuple[str, Iterable[tuple[str, str]] | TextIO]], f: TextIO) -> None:
+    """Members are `(key, value)` pairs, or a file of `_entry`s already joined by ",\n"."""
+    f.write(f'{{\n  "id": {_encode(graph_id(chat_id))},\n  "community": {_encode(community_id(chat_id))}')
+    for name, members in tables:
+        head = f',\n  "{name}": {{\n'
+        if isinstance(members, io.TextIOBase):
+            members.seek(0)
+            first = members.read(1)
+            if first:
+                f.write(head + first)
+                shutil.copyfileobj(members, f)
+                f.write("\n  }")
+            continue
+        sep = head
+        for key, value in members:
+            f.write(sep + _entry(key, value))
+            sep = ",\n"
+        if sep == ",\n":
+            f.write("\n  }")  # json_dumper drops empty tables
+    f.write("\n}")
+
+
+def _spooled(spool: TextIO) -> Iterator[tuple[str, str]]:
+    """The `(key, value)` pairs of a file of `_entry`s, which start the only lines indented by exactly four."""
+    spool.seek(0)
+    key = None
+    value: list[str] = []
+    for line in spool:
+        if line.startswith('    "'):
+            if key is not None:
+                yield key, "".join(value).removesuffix(",\n")
+            key, end = _decode_key(line, 4)
+            value = [line[end + 2 :]]  # past the ': ' after the key
+        else:
+            value.append(line)
+    if key is not None:
+        yield key, "".join(value)
+
+
+def write_document(doc: DocumentRows, f: TextIO) -> None:
+    """Write `doc` byte for byte as `json_dumper.dumps(..., inject_type=False)` writes the `GraphDocument`."""
+    tables: list[tuple[str, Iterable[tuple[str, str]]]] = [
+        ("users", ((u, _ref_json(u)) for u in doc.users)),
+        ("links", ((url, _ref_json(url)) for url in doc.links)),
+        ("posts", ((row.id, _post_json(row)) for row in doc.posts.values())),
+    ]
+    _write_json(doc.chat_id, tables, f)
+
+
+class _NoInterning(Interner):
+    # Rows serialized right away share nothing worth keeping.
+    def __call__(self, s: str) -> str:
+        return s
+
+    def many(self, items: list[str] | None) -> tuple[str, ...] | None:
+        return tuple(items) if items else None
+
+
+def stream_document(
+    chat_id: str,
+    records: Iterable[dict[str, Any]],
+    f: TextIO,
+    memory_budget: int,
+    tmp_dir: str | None = None,
+    key_files: dict[str, TextIO] | None = None,
+) -> ShardResult:
+    """
+    Write the document `write_document(build_rows(chat_id, records))` would,
+    holding at most about `memory_budget` bytes of post ids, users and links.
+    Users and links are also written to `key_files` (see `write_keys`), if given.
+
+    Each post is appended to a spool file in `tmp_dir` as soon as it is
+    built, as the text it takes in the document, and the file is copied out
+    after the user and link tables. Those tables, and the post ids, spill to
+    hash-partitioned files past the budget (see `builder.spill`), which keeps
+    their first-seen order. Only if a post id repeats is the spool replayed
+    through a spilling table, so the post keeps its first position and its
+    last values. The returned result counts posts, users and links and has
+    an empty `path`.
+    """
+    budget = MemoryBudget(memory_budget)
+    no_interning = _NoInterning()
+    written = 0
+    with (
+        SpillTable(budget, tmp_dir) as users,
+        SpillTable(budget, tmp_dir) as links,
+        SpillTable(budget, tmp_dir) as post_ids,
+        tempfile.TemporaryFile("w+", encoding="utf-8", dir=tmp_dir, prefix=".posts-") as spool,
+    ):
+        for obj in records:
+            row = post_row(post_record(obj), no_interning)
+            if row.has_creator is not None:
+                users.add(row.has_creator)
+            for url in row.links_to or ():
+                links.add(url)
+            post_ids.add(row.id)
+            spool.write((",\n" if written else "") + _entry(row.id, _post_json(row)))
+            written += 1
+
+        result = ShardResult(chat_id=chat_id, graph_id=graph_id(chat_id), path="", posts=sum(1 for _ in post_ids.items()))
+
+        def listed(name: str, table: SpillTable) -> Iterator[tuple[str, str]]:
+            out = key_files.get(name) if key_files else None
+            n = 0
+            for key, _ in table.items():
+                if out is not None:
+                    out.write(_encode(key) + "\n")
+                n += 1
+                yield key, _ref_json(key)
+            setattr(result, name, n)
+
+        def deduped() -> Iterator[tuple[str, str]]:
+            with SpillTable(budget, tmp_dir) as posts:
+                for key, value in _spooled(spool):
+                    posts.add(key, value)
+                yield from posts.items()
+
+        posts: Iterable[tuple[str, str]] | TextIO = spool if result.posts == written else deduped()
+        _write_json(chat_id, [("users", listed("users", users)), ("links", listed("links", links)), ("posts", posts)], f)
+    return result
+
+
+def partition_by_chat(lines: Iterable[str], out_dir: str, shards: dict[str, ChatShard] | None = None) -> list[ChatShard]:
+    """
+    Split canonical JSONL lines into one file per chat, in first-seen chat order.
+
+    Passing the `shards` of earlier calls appends to their files, so the input
+    can be partitioned in chunks (and resumed from a checkpoint between them).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if shards is None:
+        shards = {}
+    handles = {}
+    try:
+        for line in lines:
+            chat_id = json.loads(line)["chat_id"]
+            shard = shards.get(chat_id)
+            if shard is None:
+                shard = shards[chat_id] = ChatShard(chat_id, os.path.join(out_dir, f"{chat_id}.jsonl"))
+            if chat_id not in handles:
+                handles[chat_id] = open(shard.path, "a" if shard.records else "w", encoding="utf-8")
+            handles[chat_id].write(line if line.endswith("\n") else line + "\n")
+            shard.records += 1
+    finally:
+        for h in handles.values():
+            h.close()
+    return list(shards.values())
+
+
+def key_file(shard: ChatShard, table: str) -> str:
+    """Where `transform_shard` lists the keys of `shard`'s `users` or `links` table."""
+    return f"{shard.path.removesuffix('.jsonl')}.{table}"
+
+
+def write_keys(keys: Iterable[str], f: TextIO) -> None:
+    """Write table keys one JSON string per line."""
+    for key in keys:
+        f.write(_encode(key) + "\n")
+
+
+def transform_shard(shard: ChatShard, out_path: str, linkml: bool = False, memory_budget: int | None = None) -> ShardResult:
+    """
+    Transform one chat partition and write its `GraphDocument` as JSON, with
+    `memory_budget` through `stream_document`. Its user and link IRIs go to
+    the `key_file`s of the shard, for `merge_tables`.
+    """
+    # Written aside and renamed, so a document under its final name is always complete.
+    tmp = f"{out_path}.partial"
+    key_paths = {name: key_file(shard, name) for name in TABLES}
+    if memory_budget is not None:
+        with (
+            open(shard.path, "r", encoding="utf-8") as f_in,
+            open(tmp, "w", encoding="utf-8") as f,
+            open(key_paths["users"], "w", encoding="utf-8") as f_users,
+            open(key_paths["links"], "w", encoding="utf-8") as f_links,
+        ):
+            records = (json.loads(line) for line in f_in)
+            key_files = {"users": f_users, "links": f_links}
+            result = stream_document(shard.chat_id, records, f, memory_budget, os.path.dirname(shard.path), key_files)
+        os.replace(tmp, out_path)
+        result.path = out_path
+        return result
+
+    with open(shard.path, "r", encoding="utf-8") as f:
+        doc = build_rows(shard.chat_id, (json.loads(line) for line in f))
+
+    with open(tmp, "w", encoding="utf-8") as f:
+        if linkml:
+            f.write(json_dumper.dumps(graph_document(doc), inject_type=False))
+        else:
+            write_document(doc, f)
+    os.replace(tmp, out_path)
+
+    for name, keys in (("users", doc.users), ("links", doc.links)):
+        with open(key_paths[name], "w", encoding="utf-8") as f:
+            write_keys(keys, f)
+
+    return ShardResult(
+        chat_id=shard.chat_id,
+        graph_id=doc.id,
+        path=out_path,
+        posts=len(doc.posts),
+        users=len(doc.users),
+        links=len(doc.links),
+    )
+
+
+def transform_shards(
+    shards: list[ChatShard],
+    out_dir: str,
+    jobs: int = 1,
+    linkml: bool = False,
+    on_result: Callable[[ShardResult], None] | None = None,
+    memory_budget: int | None = None,
+) -> list[ShardResult]:
+    """
+    Transform every shard, in a process pool when `jobs > 1`. Results keep
+    shard order; `on_result` is called with each as soon as it and those
+    before it are done.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    out_paths = [os.path.join(out_dir, f"{s.chat_id}.json") for s in shards]
+
+    if jobs <= 1 or len(shards) <= 1:
+        results = map(transform_shard, shards, out_paths, repeat(linkml), repeat(memory_budget))
+        return [_report(r, on_result) for r in results]
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(transform_shard, shards, out_paths, repeat(linkml), repeat(memory_budget))
+        return [_report(r, on_result) for r in results]
+
+
+def _report(result: ShardResult, on_result: Callable[[ShardResult], None] | None) -> ShardResult:
+    if on_result is not None:
+        on_result(result)
+    return result
+
+
+def merge_tables(shards: list[ChatShard], table: str, memory_budget: int | None = None, tmp_dir: str | None = None) -> Iterator[str]:
+    """
+    Deterministically merge one table (`users` or `links`) across communities:
+    the shards' `key_file`s in shard order, deduplicated within `memory_budget`
+    bytes (see `builder.spill`).
+    """
+    budget = MemoryBudget(memory_budget if memory_budget is not None else sys.maxsize)
+    with SpillTable(budget, tmp_dir) as merged:
+        for shard in shards:
+            with open(key_file(shard, table), "r", encoding="utf-8") as f:
+                for line in f:
+                    merged.add(json.loads(line))
+        for key, _ in merged.items():
+            yield key
@@ -0,0 +1,418 @@
+"""
+Telegram message extraction.
+
+The fetch functions only rely on `client.iter_messages(...)` and on messages
+exposing `id`, `date`, `edit_date` and `to_dict()`, so a small in-process
+fake can stand in for `TelegramClient`.
+
+Raw lines keep only the fields canonicalization reads (see `RAW_FIELDS`);
+media, reactions, reply markup and the like can go to an optional archive
+with the complete `to_dict()` instead.
+"""
+
+import asyncio
+import json
+import os
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+from typing import Any, TypeVar
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import PeerChannel
+from telethon.utils import get_peer_id
+
+from builder.canonical import SUPERSEDED, raw_sidecar
+from builder.checkpoint import Position, read_lines
+from builder.jsonl import loads, open_jsonl, target_jsonl
+
+T = TypeVar("T")
+
+# Sidecar of a raw extract: "<message id> <end offset>" per line (see RawWriter)
+IDS = ".ids"
+# Raw lines between flushes of the `.ids` index
+INDEX_EVERY = 10_000
+
+
+def coerce_entity(entity_str: str):
+    s = entity_str.strip()
+    # Telegram "supergroup/channel" ids are often represented as -100<channel_id>
+    if s.startswith("-100") and s[4:].isdigit():
+        channel_id = int(s[4:])  # drop the -100 prefix
+        return PeerChannel(channel_id)
+    # If it's a plain negative int (e.g. -123...), let Telethon try
+    if s.lstrip("-").isdigit():
+        return int(s)
+    return s  # @username, invite link, etc.
+
+
+# Message fields used by `builder.canonical`, plus `_` and `edit_date` for debugging edits
+RAW_FIELDS = ("_", "id", "peer_id", "date", "edit_date", "message", "from_id", "reply_to", "forwards", "pinned", "entities")
+REPLY_FIELDS = ("_", "reply_to_msg_id")
+ENTITY_FIELDS = ("_", "offset", "length", "url", "user_id")
+
+
+def _pick(d: Any, fields: tuple[str, ...]) -> Any:
+    return {k: d[k] for k in fields if k in d} if isinstance(d, dict) else d
+
+
+def project_message(d: dict[str, Any]) -> dict[str, Any]:
+    """The parts of a `to_dict()` message that canonicalization reads."""
+    out = _pick(d, RAW_FIELDS)
+    if "reply_to" in out:
+        out["reply_to"] = _pick(out["reply_to"], REPLY_FIELDS)
+    if isinstance(out.get("entities"), list):
+        out["entities"] = [_pick(e, ENTITY_FIELDS) for e in out["entities"]]
+    return out
+
+
+def raw_line(msg: Any, compact: bool = True) -> str:
+    d = msg.to_dict()
+    return json.dumps(project_message(d) if compact else d, ensure_ascii=False, default=str) + "\n"
+
+
+class RawWriter:
+    """
+    Writes fetched messages as compact raw lines to `path`, and complete ones
+    to `archive` if given. Both honour `KG_COMPRESS` (see `builder.jsonl`);
+    appending continues whichever variant of the file already exists.
+
+    Alongside the raw lines it keeps `<path>.ids`, each line's message id and
+    end offset, so `supersede` can list in `<path>.superseded` the lines an
+    appended edit replaces without reading the raw file again.
+    """
+
+    def __init__(self, path: str, archive: str | None = None, append: bool = False):
+        mode = "a" if append else "w"
+        self.path = target_jsonl(path, append)
+        self.ids_path = raw_sidecar(self.path, IDS)
+        self.superseded_path = raw_sidecar(self.path, SUPERSEDED)
+        self.offset = 0
+        self.pending: list[str] = []
+        if append:
+            self._catch_up()
+        else:
+            for p in (self.ids_path, self.superseded_path):
+                if os.path.exists(p):
+                    os.remove(p)
+        self.f = open_jsonl(self.path, mode)
+        self.archive_path = None
+        self.archive = None
+        if archive:
+            os.makedirs(os.path.dirname(archive) or ".", exist_ok=True)
+            self.archive_path = target_jsonl(archive, append)
+            self.archive = open_jsonl(self.archive_path, mode)
+
+    def write(self, msg: Any) -> None:
+        line = raw_line(msg)
+        self.f.write(line)
+        self.offset += len(line.encode("utf-8"))
+        self.pending.append(f"{msg.id} {self.offset}\n")
+        if len(self.pending) >= INDEX_EVERY:
+            self.f.flush()
+            self._flush_index()
+        if self.archive is not None:
+            self.archive.write(raw_line(msg, compact=False))
+
+    def supersede(self, ids: set[int]) -> int:
+        """Record every line of `ids` but the last as superseded; returns how many lines that is."""
+        if not ids:
+            return 0
+        self.f.flush()
+        self._flush_index()
+        return self._record_superseded(ids)
+
+    def _record_superseded(self, ids: set[int]) -> int:
+        copies: dict[int, list[int]] = {}
+        with open(self.ids_path, "r", encoding="utf-8") as f:
+            for entry in f:
+                msg_id, offset = entry.split()
+                if int(msg_id) in ids:
+                    copies.setdefault(int(msg_id), []).append(int(offset))
+        stale = [offset for offsets in copies.values() for offset in offsets[:-1]]
+        with open(self.superseded_path, "a", encoding="utf-8") as f:
+            f.writelines(f"{offset}\n" for offset in stale)
+        return len(stale)
+
+    def _flush_index(self) -> None:
+        # Callers flush the raw lines first, so the index never lists a line that isn't on disk.
+        with open(self.ids_path, "a", encoding="utf-8") as f:
+            f.writelines(self.pending)
+        self.pending.clear()
+
+    def _catch_up(self) -> None:
+        """Index raw lines the `.ids` file doesn't cover yet: a shard from before it existed, or a crash gap."""
+        start = 0
+        if os.path.exists(self.ids_path):
+            with open(self.ids_path, "rb+") as f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(max(0, size - 64))
+                tail = f.read()
+                complete = tail.rfind(b"\n") + 1
+                # Drop a torn last entry; the lines it covered are indexed again below.
+                f.truncate(size - len(tail) + complete)
+                if complete:
+                    start = int(tail[:complete].splitlines()[-1].split()[1])
+        if not os.path.exists(self.path):
+            return
+        self.offset = start
+        seen = set()
+        for line, position in read_lines([self.path], Position(0, start)):
+            msg_id = loads(line)["id"]
+            self.offset = position.offset
+            self.pending.append(f"{msg_id} {self.offset}\n")
+            seen.add(msg_id)
+        self._flush_index()
+        self._record_superseded(seen)
+
+    def close(self) -> None:
+        self.f.flush()
+        self._flush_index()
+        self.f.close()
+        if self.archive is not None:
+            self.archive.close()
+
+    def __enter__(self) -> "RawWriter":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def load_checkpoint(path: str) -> dict[str, dict[str, Any]]:
+    """Per-entity high-water marks: `{entity: {"last_id", "last_date", "synced_at"}}`."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, state: dict[str, dict[str, Any]]) -> None:
+    # Write-then-rename so an interrupted run never leaves a truncated checkpoint.
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _advance(mark: dict[str, Any], msg: Any) -> None:
+    if msg.id > mark.get("last_id", 0):
+        mark["last_id"] = msg.id
+        mark["last_date"] = msg.date.isoformat()
+
+
+async def fetch_window(client, entity, since: datetime, out: RawWriter, mark: dict[str, Any]) -> int:
+    """Full sweep: every message newer than `since`, newest first (the original behaviour)."""
+    count = 0
+    async for msg in client.iter_messages(entity, limit=None):
+        if not msg.date:
+            continue
+        if msg.date < since:
+            break
+        out.write(msg)
+        _advance(mark, msg)
+        count += 1
+    return count
+
+
+async def iter_new(client, entity, since: datetime, mark: dict[str, Any]):
+    """
+    Yield messages above the high-water mark, oldest first, advancing `mark`.
+
+    Without a mark yet this starts at `since`, so the first incremental run
+    covers the same window as `fetch_window` but in chronological order.
+    """
+    if mark.get("last_id"):
+        messages = client.iter_messages(entity, limit=None, min_id=mark["last_id"], reverse=True)
+    else:
+        messages = client.iter_messages(entity, limit=None, offset_date=since, reverse=True)
+
+    async for msg in messages:
+        if not msg.date or msg.date < since:
+            continue
+        yield msg
+        _advance(mark, msg)
+
+
+async def fetch_new(client, entity, since: datetime, out: RawWriter, mark: dict[str, Any]) -> int:
+    """Incremental sweep: append messages above the high-water mark."""
+    count = 0
+    async for msg in iter_new(client, entity, since, mark):
+        out.write(msg)
+        count += 1
+    return count
+
+
+async def refresh_tail(
+    client,
+    entity,
+    tail: timedelta,
+    now: datetime,
+    out: RawWriter,
+    mark: dict[str, Any],
+    written: set[int] | None = None,
+) -> int:
+    """
+    Re-fetch the most recent `tail` of already-seen history and append messages
+    edited since the previous sync. Appended copies supersede earlier lines with
+    the same message id: `out.supersede` records those for canonicalization to skip.
+
+    Ids in `written` are skipped and the ones appended are added to it, so a
+    retry with the same set doesn't append an edit twice.
+    """
+    if written is None:
+        written = set()
+    if not mark.get("last_id") or not mark.get("synced_at"):
+        return 0
+
+    cutoff = now - tail
+    synced_at = datetime.fromisoformat(mark["synced_at"])
+
+    appended: set[int] = set()
+    try:
+        # max_id is exclusive; new messages are left to `fetch_new`.
+        async for msg in client.iter_messages(entity, limit=None, max_id=mark["last_id"] + 1):
+            if not msg.date:
+                continue
+            if msg.date < cutoff:
+                break
+            if msg.edit_date is not None and msg.edit_date > synced_at and msg.id not in written:
+                out.write(msg)
+                written.add(msg.id)
+                appended.add(msg.id)
+    finally:
+        # Also on FloodWait, so a retry (which skips `written`) doesn't leave these unrecorded.
+        out.supersede(appended)
+    return len(appended)
+
+
+async def with_floodwait(
+    call: Callable[[], Awaitable[T]],
+    sem: asyncio.Semaphore,
+    label: str,
+    max_retries: int = 5,
+    sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+) -> T:
+    """
+    Run `call` under `sem`, sleeping out FloodWait errors and retrying.
+
+    The semaphore is released while waiting so other entities keep going.
+    `call` must be safe to repeat: the fetch functions resume from `mark`,
+    `refresh_tail` from the ids it has already written.
+    """
+    for attempt in range(max_retries + 1):
+        async with sem:
+            try:
+                return await call()
+            except FloodWaitError as e:
+                if attempt == max_retries:
+                    raise
+                wait = e.seconds
+        print(f"{label}: FloodWait {wait}s (retry {attempt + 1}/{max_retries})")
+        await sleep(wait)
+    raise AssertionError("unreachable")
+
+
+def shard_path(out_dir: str, chat_id: int | str) -> str:
+    return os.path.join(out_dir, f"{chat_id}.jsonl")
+
+
+async def extract_entity(
+    client,
+    entity_str: str,
+    *,
+    out_dir: str,
+    archive_dir: str | None = None,
+    mark: dict[str, Any],
+    since: datetime,
+    now: datetime,
+    incremental: bool,
+    refresh: timedelta,
+    sem: asyncio.Semaphore,
+    max_retries: int = 5,
+    sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+) -> tuple[str, int, int]:
+    """
+    Fetch one entity into its own per-chat shard (and archive shard, with
+    `archive_dir`). Returns `(path, new, edited)`.
+
+    Messages are always fetched oldest first, so a retry after a FloodWait
+    picks up from the high-water mark instead of duplicating lines; the edit
+    refresh skips the ids an earlier attempt already wrote.
+    """
+    label = entity_str
+    entity = await with_floodwait(
+        lambda: client.get_entity(coerce_entity(entity_str)), sem, label, max_retries, sleep
+    )
+    chat_id = get_peer_id(entity)
+    archive = shard_path(archive_dir, chat_id) if archive_dir else None
+
+    if not incremental:
+        mark.clear()
+
+    with RawWriter(shard_path(out_dir, chat_id), archive, append=incremental) as out:
+        # Shared by the refresh attempts, so edits written before a FloodWait aren't written again.
+        refreshed: set[int] = set()
+        if incremental:
+            await with_floodwait(
+                lambda: refresh_tail(client, entity, refresh, now, out, mark, refreshed), sem, label, max_retries, sleep
+            )
+        edited = len(refreshed)
+
+        new = 0
+
+        async def fetch() -> None:
+            # Each attempt resumes from the mark advanced by the previous one.
+            nonlocal new
+            async for msg in iter_new(client, entity, since, mark):
+                out.write(msg)
+                new += 1
+
+        await with_floodwait(fetch, sem, label, max_retries, sleep)
+
+    mark["synced_at"] = now.isoformat()
+    return out.path, new, edited
+
+
+async def extract_many(
+    client,
+    entities: list[str],
+    state: dict[str, dict[str, Any]],
+    *,
+    out_dir: str,
+    archive_dir: str | None = None,
+    since: datetime,
+    now: datetime,
+    incremental: bool = False,
+    refresh: timedelta = timedelta(hours=48),
+    concurrency: int = 4,
+    max_retries: int = 5,
+    sleep: Callable[[float], Awaitable[Any]] = asyncio.sleep,
+) -> dict[str, tuple[str, int, int]]:
+    """
+    Fetch several entities concurrently on one client, at most `concurrency`
+    requests in flight. Wall time is bounded by the slowest entity.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    sem = asyncio.Semaphore(concurrency)
+
+    results = await asyncio.gather(
+        *(
+            extract_entity(
+                client,
+                e,
+                out_dir=out_dir,
+                archive_dir=archive_dir,
+                mark=state.setdefault(e, {}),
+                since=since,
+                now=now,
+                incremental=incremental,
+                refresh=refresh,
+                sem=sem,
+                max_retries=max_retries,
+                sleep=sleep,
+            )
+            for e in entities
+        )
+    )
+    return dict(zip(entities, results))
@@ -0,0 +1,161 @@
+"""
+JSONL reading and writing shared by every stage.
+
+Files may be stored gzip- (`.gz`) or zstd-compressed (`.zst`) next to their
+plain path, e.g. `canonical_last_7_days.jsonl.gz`. Readers pick up whichever
+variant exists; writers compress according to the `KG_COMPRESS` environment
+variable (`gzip`, `zstd`, or unset for plain text). Compression is streamed,
+so no stage holds a whole file in memory.
+"""
+
+import glob
+import gzip
+import io
+import json
+import os
+from collections.abc import Iterator
+from typing import IO, Any, cast
+
+# orjson is an optional speedup; output is equivalent JSON, just without the spaces.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# zstandard is optional too; only needed to read or write `.zst` files.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESS_ENV = "KG_COMPRESS"
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+# Fast levels: these files are rewritten on every run, so speed matters more than ratio.
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def loads(s: str | bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+
+def dumps(obj: Any) -> str:
+    """One JSON document (no trailing newline), non-ASCII kept as-is."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def compression() -> str | None:
+    """Compression for newly written JSONL, from `KG_COMPRESS`; None for plain text."""
+    value = os.environ.get(COMPRESS_ENV, "").strip().lower()
+    if value in ("", "none"):
+        return None
+    if value not in SUFFIXES:
+        raise ValueError(f"Unsupported {COMPRESS_ENV}={value!r} (expected one of {sorted(SUFFIXES)} or none)")
+    return value
+
+
+def variants(path: str) -> list[str]:
+    """`path` and its compressed siblings."""
+    return [path, *(path + s for s in SUFFIXES.values())]
+
+
+def existing_jsonl(path: str) -> str:
+    """The variant of `path` on disk (the newest if several); `path` itself if none exists."""
+    found = [p for p in variants(path) if os.path.exists(p)]
+    if not found:
+        return path
+    return max(found, key=os.path.getmtime)
+
+
+def target_jsonl(path: str, append: bool = False) -> str:
+    """
+    Where to write `path`: with the configured compression suffix, or, when
+    appending, whichever variant already exists. Stale variants are removed
+    so readers never pick up an outdated sibling.
+    """
+    if append:
+        found = existing_jsonl(path)
+        if os.path.exists(found):
+            return found
+    comp = compression()
+    out = path + SUFFIXES[comp] if comp else path
+    for p in variants(path):
+        if p != out and os.path.exists(p):
+            os.remove(p)
+    return out
+
+
+def glob_jsonl(directory: str) -> list[str]:
+    """One path per JSONL file in `directory` (any variant), sorted by plain name."""
+    plain = {
+        p.removesuffix(s)
+        for s in ["", *SUFFIXES.values()]
+        for p in glob.glob(os.path.join(directory, f"*.jsonl{s}"))
+    }
+    return [existing_jsonl(p) for p in sorted(plain)]
+
+
+def open_binary(path: str, mode: str = "r") -> IO[bytes]:
+    """Open `path` in binary `mode` ("r", "w" or "a"), (de)compressing by its suffix."""
+    if path.endswith(SUFFIXES["gzip"]):
+        # A fixed header mtime keeps the bytes (and the stage cache digests) stable across identical runs.
+        return cast(IO[bytes], gzip.GzipFile(path, mode + "b", compresslevel=GZIP_LEVEL, mtime=0))
+    if path.endswith(SUFFIXES["zstd"]):
+        if zstandard is None:
+            raise RuntimeError(f"Reading or writing {path} needs the zstandard package (uv pip install zstandard)")
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if mode != "r" else None
+        # Appending adds a new frame; readers decode concatenated frames as one stream.
+        dctx = zstandard.ZstdDecompressor()
+        f = zstandard.open(path, mode + "b", cctx=cctx, dctx=dctx)
+        # The decompression reader has no readline(); buffering adds it (and line iteration).
+        return io.BufferedReader(f) if mode == "r" else f
+    return open(path, mode + "b")
+
+
+def open_jsonl(path: str, mode: str = "r") -> IO[str]:
+    """Open `path` as UTF-8 text (`mode` is "r", "w" or "a"), (de)compressing by its suffix."""
+    return io.TextIOWrapper(open_binary(path, mode), encoding="utf-8")
+
+
+def iter_jsonl(path: str) -> Iterator[Any]:
+    with open_jsonl(existing_jsonl(path)) as f:
+        for line in f:
+            yield loads(line)
+
+
+def iter_jsonl_shard(path: str, index: int, count: int) -> Iterator[Any]:
+    """
+    Shard `index` of `count` of the records in `path`, for parallel readers.
+
+    Plain files are split into byte ranges on line boundaries, so each reader
+    only touches its own part. Compressed streams can't be entered midway:
+    every reader decompresses the whole file and keeps every `count`-th line.
+    """
+    if not 0 <= index < count:
+        raise ValueError(f"Shard {index} out of range for {count} shards")
+    path = existing_jsonl(path)
+    if path.endswith(tuple(SUFFIXES.values())):
+        with open_jsonl(path) as f:
+            for n, line in enumerate(f):
+                if n % count == index:
+                    yield loads(line)
+        return
+
+    size = os.path.getsize(path)
+    start, end = size * index // count, size * (index + 1) // count
+    with open(path, "rb") as f:
+        # A line belongs to the shard its first byte falls in.
+        if start > 0:
+            f.seek(start - 1)
+            start += len(f.readline()) - 1
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield loads(line)
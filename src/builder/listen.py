@@ -0,0 +1,146 @@
+"""
+Real-time ingestion from Telethon update events.
+
+`Listener` subscribes to new, edited and deleted messages of the configured
+chats and commits them to the store in micro-batches: a batch is written
+once it holds `batch_size` messages or its oldest change is `max_delay`
+seconds old, whichever comes first. Events go through the batch pipeline's
+own functions (`project_message`, `canonicalize`, `post_record`), and each
+batch is applied with `builder.store.apply_changes` and
+`SearchIndex.apply`, each a single transaction.
+
+`attach` only calls `client.add_event_handler(callback, event)`, and the
+callbacks only read `event.message` (new and edited messages, exposing
+`to_dict()`) or `event.chat_id` and `event.deleted_ids` (deletions). So a
+small in-process fake can stand in for `TelegramClient` and replay scripted
+events.
+"""
+
+import asyncio
+from collections.abc import Iterable
+from dataclasses import dataclass
+from typing import Any
+
+from pyoxigraph import Store
+from telethon import events
+
+from builder.canonical import canonicalize
+from builder.extract import project_message
+from builder.rdf import expand
+from builder.search import SEARCH_DB, SearchIndex
+from builder.store import UpsertStats, apply_changes, bump_generation
+from builder.transform import post_id
+
+BATCH_SIZE = 200
+MAX_DELAY = 2.0  # seconds
+
+# (chat_id, message_id)
+MessageKey = tuple[str, int]
+
+
+@dataclass
+class ListenStats:
+    batches: int = 0
+    messages: int = 0
+    deletions: int = 0
+
+    def __str__(self) -> str:
+        return f"{self.batches} batches, {self.messages} new or edited messages, {self.deletions} deletions"
+
+
+class Listener:
+    """
+    Buffers changes per message (the latest event wins) and commits them in
+    micro-batches from `run()`. Commits run in a worker thread, so events keep
+    arriving while a batch is written.
+    """
+
+    def __init__(
+        self,
+        store: Store,
+        store_dir: str,
+        search_path: str | None = SEARCH_DB,
+        chats: Iterable[str] = (),
+        batch_size: int = BATCH_SIZE,
+        max_delay: float = MAX_DELAY,
+    ):
+        self.store = store
+        self.store_dir = store_dir
+        self.search_path = search_path
+        # Basic groups and private chats share one message id space per account and their
+        # deletions arrive without a chat, so an id is removed from each of them.
+        self.shared_id_chats = [c for c in chats if not c.startswith("-100")]
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pending: dict[MessageKey, dict[str, Any] | None] = {}
+        self.first_at = 0.0
+        self.changed = asyncio.Event()
+        self.stats = ListenStats()
+
+    def attach(self, client, chats: list[Any] | None = None) -> None:
+        """Register the event handlers on `client`, limited to `chats` (entities or ids) if given."""
+        client.add_event_handler(self.on_message, events.NewMessage(chats=chats))
+        client.add_event_handler(self.on_message, events.MessageEdited(chats=chats))
+        client.add_event_handler(self.on_deleted, events.MessageDeleted(chats=chats))
+
+    async def on_message(self, event: Any) -> None:
+        canonical = canonicalize(project_message(event.message.to_dict()))
+        if canonical is not None:
+            self._stage((canonical["chat_id"], canonical["message_id"]), canonical)
+
+    async def on_deleted(self, event: Any) -> None:
+        chats = [str(event.chat_id)] if event.chat_id is not None else self.shared_id_chats
+        for chat_id in chats:
+            for message_id in event.deleted_ids:
+                self._stage((chat_id, int(message_id)), None)
+
+    def _stage(self, key: MessageKey, record: dict[str, Any] | None) -> None:
+        if not self.pending:
+            self.first_at = asyncio.get_running_loop().time()
+        self.pending[key] = record
+        self.changed.set()
+
+    async def run(self) -> None:
+        """Commit batches as they fill up or age out, until cancelled (then commit what is left)."""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                self.changed.clear()
+                if self.pending:
+                    wait = self.first_at + self.max_delay - loop.time()
+                    if len(self.pending) >= self.batch_size or wait <= 0:
+                        await self.flush()
+                        continue
+                else:
+                    wait = None
+                try:
+                    await asyncio.wait_for(self.changed.wait(), wait)
+                except TimeoutError:
+                    pass
+        finally:
+            if self.pending:
+                # Shielded: a cancelled listener still writes what it has already received.
+                await asyncio.shield(self.flush())
+
+    async def flush(self) -> UpsertStats | None:
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return None
+        return await asyncio.to_thread(self.commit, batch)
+
+    def commit(self, batch: dict[MessageKey, dict[str, Any] | None]) -> UpsertStats:
+        records = [r for r in batch.values() if r is not None]
+        deleted = [key for key, r in batch.items() if r is None]
+        stats = apply_changes(self.store, records, deleted)
+        if self.search_path is not None:
+            with SearchIndex(self.search_path) as index:
+                index.apply(records, [expand(post_id(c, m)) for c, m in deleted])
+        # Tells readers holding the store open (builder.query) that its contents changed.
+        bump_generation(self.store_dir)
+
+        self.stats.batches += 1
+        self.stats.messages += len(records)
+        self.stats.deletions += stats.deleted
+        print(f"Committed {len(batch)} changes: {stats}")
+        return stats
+
@@ -0,0 +1,155 @@
+"""
+Per-stage metrics and opt-in profiling for the pipeline scripts.
+
+A script wraps its work in `stage(...)` and its sub-steps in `m.step(...)`.
+When the stage finishes (or fails) one JSON object is appended to
+`data/metrics/stages.jsonl` with the wall time, counts, bytes read and
+written and peak memory of the stage and of every step.
+
+With `--profile`, the stage also runs under cProfile and tracemalloc. It
+writes `<stage>.prof` (open with `python -m pstats` or snakeviz) and
+`<stage>.tracemalloc` (a `tracemalloc.Snapshot`) to `data/metrics/profile/`,
+and each step records its traced-memory peak.
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any
+
+METRICS_FILE = "data/metrics/stages.jsonl"
+PROFILE_DIR = "data/metrics/profile"
+
+
+def add_profile_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"write cProfile and tracemalloc dumps for this stage to {PROFILE_DIR}/",
+    )
+
+
+def _peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return round((rss if sys.platform == "darwin" else rss * 1024) / 2**20, 1)
+
+
+def path_size(path: str) -> int:
+    """Size of a file, or of every file under a directory; 0 if missing."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+@dataclass
+class Step:
+    name: str
+    counts: dict[str, int] = field(default_factory=dict)
+    duration_s: float = 0.0
+    peak_rss_mb: float = 0.0
+    # Only with --profile
+    peak_traced_mb: float | None = None
+
+    def count(self, **counts: int) -> None:
+        for k, v in counts.items():
+            self.counts[k] = self.counts.get(k, 0) + v
+
+    def as_dict(self) -> dict[str, Any]:
+        d: dict[str, Any] = {"name": self.name, "duration_s": round(self.duration_s, 4), "peak_rss_mb": self.peak_rss_mb}
+        if self.counts:
+            d["counts"] = self.counts
+        if self.peak_traced_mb is not None:
+            d["peak_traced_mb"] = self.peak_traced_mb
+        return d
+
+
+class StageMetrics(Step):
+    def __init__(self, name: str, profile: bool = False):
+        super().__init__(name)
+        self.profile = profile
+        self.steps: list[Step] = []
+        self.bytes_read = 0
+        self.outputs: list[str] = []
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[Step]:
+        s = Step(name)
+        if self.profile:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield s
+        finally:
+            s.duration_s = time.perf_counter() - start
+            s.peak_rss_mb = _peak_rss_mb()
+            if self.profile:
+                s.peak_traced_mb = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            self.steps.append(s)
+
+    def read(self, *paths: str) -> None:
+        self.bytes_read += sum(path_size(p) for p in paths)
+
+    def wrote(self, *paths: str) -> None:
+        # Sized when the stage ends, so files still being written are counted in full.
+        self.outputs.extend(paths)
+
+    def as_dict(self) -> dict[str, Any]:
+        d = super().as_dict()
+        d = {"stage": d.pop("name"), **d}
+        d["bytes_read"] = self.bytes_read
+        d["bytes_written"] = sum(path_size(p) for p in dict.fromkeys(self.outputs))
+        d["children_peak_rss_mb"] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+        d["steps"] = [s.as_dict() for s in self.steps]
+        return d
+
+
+def append_metrics(record: dict[str, Any], path: str = METRICS_FILE) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+@contextmanager
+def stage(name: str, profile: bool = False, path: str = METRICS_FILE) -> Iterator[StageMetrics]:
+    """Measure one pipeline stage and append its metrics to `path` when it ends."""
+    m = StageMetrics(name, profile=profile)
+    prof = cProfile.Profile() if profile else None
+    if prof is not None:
+        tracemalloc.start()
+        prof.enable()
+
+    status = "error"
+    start = time.perf_counter()
+    try:
+        yield m
+        status = "ok"
+    finally:
+        m.duration_s = time.perf_counter() - start
+        m.peak_rss_mb = _peak_rss_mb()
+
+        record: dict[str, Any] = {"at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "status": status}
+        if prof is not None:
+            prof.disable()
+            m.peak_traced_mb = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            stats_path = os.path.join(PROFILE_DIR, f"{name}.prof")
+            snapshot_path = os.path.join(PROFILE_DIR, f"{name}.tracemalloc")
+            prof.dump_stats(stats_path)
+            tracemalloc.take_snapshot().dump(snapshot_path)
+            tracemalloc.stop()
+            record["profile"] = [stats_path, snapshot_path]
+
+        append_metrics({"stage": name, **record, **m.as_dict()}, path)
@@ -0,0 +1,342 @@
+"""
+Single-process streaming pipeline: extract -> canonicalize -> RDF -> load.
+
+The batch scripts hand records to each other through files, so every
+message is serialized and parsed once per stage. Here messages go from
+Telegram (or an existing raw JSONL file) through `canonicalize` straight
+into the consumers, each running in its own thread behind a bounded queue:
+
+- the store: `graph_quads` fed to Oxigraph's bulk loader, one named graph
+  per community, replaced as it is first seen, plus its aggregates
+- the full-text index (`builder.search`)
+- the reply-thread index (`builder.threads`)
+- with `--keep-files`, the canonical JSONL and an N-Quads dump (plus the raw
+  JSONL when fetching), for debugging or for later `--upsert` runs
+
+Records travel in batches; a full queue blocks the producer, so a slow
+consumer throttles the fetch instead of buffering the whole window. The
+result matches `just run-all` followed by `load_into_oxigraph.py --bulk`.
+
+    uv run python -m builder.pipeline               # fetch TG_ENTITY from Telegram
+    uv run python -m builder.pipeline --from-raw    # replay data/raw/messages_last_7_days.jsonl
+"""
+
+import argparse
+import asyncio
+import os
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from dotenv import load_dotenv
+from pyoxigraph import Store
+from telethon import TelegramClient
+
+from builder.aggregates import StatsCollector
+from builder.canonical import canonicalize, drop_superseded, superseded_positions
+from builder.checkpoint import read_lines
+from builder.extract import RawWriter, coerce_entity, iter_new, project_message
+from builder.jsonl import dumps, existing_jsonl, loads, open_jsonl, target_jsonl
+from builder.metrics import add_profile_argument, stage
+from builder.rdf import graph_quads, write_quads
+from builder.search import SEARCH_DB, SearchIndex
+from builder.store import bulk_load_quads, bump_generation, replacing_chats
+from builder.threads import THREAD_DIR, build_thread_index
+
+RAW = "data/raw/messages_last_7_days.jsonl"
+CANONICAL = "data/raw/canonical_last_7_days.jsonl"
+NQUADS = "data/rdf/sioc_graph.nq"
+STORE_DIR = "data/oxigraph/store"
+
+BATCH_SIZE = 1_000
+# Batches waiting per consumer before the producer blocks
+QUEUE_SIZE = 8
+
+_END = object()
+
+
+class Aborted(Exception):
+    """Another stage of the pipeline failed."""
+
+
+class Pipeline:
+    """
+    Fans records out to consumers, each running `consume(records)` in a thread.
+
+    `send` buffers records into batches and hands every batch to each
+    consumer's bounded queue. `close` flushes, waits for the consumers and
+    returns their results by name. A failing consumer aborts the others and
+    the producer, and `close` re-raises its error.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.batch: list[Any] = []
+        self.queues: dict[str, queue.Queue] = {}
+        self.threads: dict[str, threading.Thread] = {}
+        self.results: dict[str, Any] = {}
+        self.errors: list[BaseException] = []
+        self.aborted = threading.Event()
+
+    def add(self, name: str, consume: Callable[[Iterator[Any]], Any]) -> None:
+        q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+        def run() -> None:
+            try:
+                self.results[name] = consume(self._drain(q))
+            except Aborted:
+                pass
+            except BaseException as e:
+                self.errors.append(e)
+                self.aborted.set()
+
+        self.queues[name] = q
+        self.threads[name] = threading.Thread(target=run, name=f"pipeline-{name}", daemon=True)
+        self.threads[name].start()
+
+    def _drain(self, q: queue.Queue) -> Iterator[Any]:
+        while True:
+            try:
+                batch = q.get(timeout=0.1)
+            except queue.Empty:
+                if self.aborted.is_set():
+                    raise Aborted
+                continue
+            if batch is _END:
+                return
+            yield from batch
+
+    def _put(self, item: Any) -> None:
+        for q in self.queues.values():
+            while True:
+                if self.aborted.is_set():
+                    raise Aborted
+                try:
+                    q.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+    def send(self, record: Any) -> None:
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self._put(self.batch)
+            self.batch = []
+
+    def close(self) -> dict[str, Any]:
+        try:
+            if self.batch:
+                self._put(self.batch)
+                self.batch = []
+            self._put(_END)
+        except Aborted:
+            pass
+        self._join()
+        return self.results
+
+    def abort(self) -> None:
+        self.aborted.set()
+        self._join()
+
+    def _join(self) -> None:
+        for t in self.threads.values():
+            t.join()
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self) -> "Pipeline":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc: Any) -> None:
+        if exc_type is not None:
+            self.abort()
+
+
+def load_store(store: Store) -> Callable[[Iterable[dict[str, Any]]], tuple[int, int, int]]:
+    """Consumer bulk-loading canonical records into `store`: (quads, graphs, aggregate quads)."""
+
+    def consume(records: Iterable[dict[str, Any]]) -> tuple[int, int, int]:
+        collector = StatsCollector()
+        stats = bulk_load_quads(store, collector.observe(graph_quads(replacing_chats(store, records))))
+        agg = bulk_load_quads(store, collector.quads())
+        store.flush()
+        return sum(stats.values()), len(stats), sum(agg.values())
+
+    return consume
+
+
+def sync_search(path: str = SEARCH_DB) -> Callable[[Iterable[dict[str, Any]]], Any]:
+    def consume(records: Iterable[dict[str, Any]]) -> Any:
+        with SearchIndex(path) as index:
+            return index.sync(records)
+
+    return consume
+
+
+def write_jsonl(path: str) -> Callable[[Iterable[dict[str, Any]]], str]:
+    """Consumer writing records to `path` (compressed per `KG_COMPRESS`); returns the path written."""
+
+    def consume(records: Iterable[dict[str, Any]]) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        out = target_jsonl(path)
+        with open_jsonl(out, "w") as f:
+            for obj in records:
+                f.write(dumps(obj) + "\n")
+        return out
+
+    return consume
+
+
+def write_nquads(path: str) -> Callable[[Iterable[dict[str, Any]]], int]:
+    def consume(records: Iterable[dict[str, Any]]) -> int:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            return write_quads(graph_quads(records), f)
+
+    return consume
+
+
+async def fetch_raw(
+    client, entities: list[str], since: datetime, emit: Callable[[dict[str, Any]], None], raw: str | None = None
+) -> int:
+    """
+    Fetch the window of every entity, passing each message's raw dict to
+    `emit`; with `raw`, also write the lines `extract_last_7_days.py` would.
+    """
+    count = 0
+    out = RawWriter(raw) if raw else None
+    try:
+        for entity_str in entities:
+            entity = await client.get_entity(coerce_entity(entity_str))
+            # Oldest first, like `extract_many`; `emit` blocks while the consumers catch up.
+            async for msg in iter_new(client, entity, since, {}):
+                if out is not None:
+                    out.write(msg)
+                emit(project_message(msg.to_dict()))
+                count += 1
+    finally:
+        if out is not None:
+            out.close()
+    return count
+
+
+async def fetch_telegram(
+    entities: list[str], since: datetime, emit: Callable[[dict[str, Any]], None], raw: str | None
+) -> int:
+    session = os.environ.get("TG_SESSION", "tg.session")
+    async with TelegramClient(session, int(os.environ["TG_API_ID"]), os.environ["TG_API_HASH"]) as client:
+        return await fetch_raw(client, entities, since, emit, raw)
+
+
+def run(
+    source: Callable[[Callable[[dict[str, Any]], None]], int],
+    *,
+    keep_files: bool = False,
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = QUEUE_SIZE,
+    profile: bool = False,
+) -> None:
+    """
+    Run the pipeline over the raw messages `source` passes to its callback;
+    `source` returns how many it passed.
+    """
+    os.makedirs(STORE_DIR, exist_ok=True)
+    n_canonical = 0
+    with stage("pipeline", profile=profile) as m:
+        with m.step("open_store"):
+            store = Store(STORE_DIR)
+
+        with m.step("stream") as s, Pipeline(batch_size, queue_size) as p:
+            p.add("store", load_store(store))
+            p.add("search", sync_search())
+            p.add("threads", lambda records: build_thread_index(records, THREAD_DIR))
+            if keep_files:
+                p.add("canonical", write_jsonl(CANONICAL))
+                p.add("nquads", write_nquads(NQUADS))
+
+            def emit(raw: dict[str, Any]) -> None:
+                nonlocal n_canonical
+                canonical = canonicalize(raw)
+                if canonical is not None:
+                    p.send(canonical)
+                    n_canonical += 1
+
+            n_raw = source(emit)
+            results = p.close()
+            s.count(records_in=n_raw, records_out=n_canonical)
+
+        if n_canonical == 0:
+            raise RuntimeError("No messages found in the input.")
+        quads, graphs, agg = results["store"]
+        m.count(records_in=n_raw, records_out=n_canonical, quads=quads, graphs=graphs, aggregate_quads=agg)
+        m.wrote(STORE_DIR, SEARCH_DB, THREAD_DIR)
+        if keep_files:
+            m.wrote(results["canonical"], NQUADS)
+
+    # Tells readers holding the store open (builder.query) that its contents changed.
+    bump_generation(STORE_DIR)
+
+    print(f"Streamed {n_raw} messages ({n_canonical} canonical) into {STORE_DIR}")
+    print(f"  {quads} quads in {graphs} named graphs, plus {agg} aggregate quads")
+    print(f"  search index: {results['search']}")
+    print(f"  thread index: {results['threads']} nodes")
+    if keep_files:
+        print(f"  wrote {results['canonical']} and {NQUADS} ({results['nquads']} quads)")
+
+
+def main() -> None:
+    # Before parsing: TG_ENTITY supplies the default entities, the TG_API_* settings the client.
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run extract -> canonicalize -> RDF -> load in one process.")
+    parser.add_argument(
+        "--from-raw",
+        nargs="?",
+        const=RAW,
+        metavar="PATH",
+        help=f"replay raw messages from a JSONL file (default {RAW}) instead of fetching from Telegram",
+    )
+    parser.add_argument(
+        "--entity",
+        action="append",
+        help="entity to fetch (repeatable); defaults to the comma-separated TG_ENTITY",
+    )
+    parser.add_argument("--days", type=float, default=7, help="window to fetch from Telegram (default: 7)")
+    parser.add_argument(
+        "--keep-files",
+        action="store_true",
+        help=f"also write {CANONICAL} and {NQUADS} (and {RAW} when fetching), for debugging",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="records per batch")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="batches buffered per consumer")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    if args.from_raw:
+        paths = [existing_jsonl(args.from_raw)]
+
+        def source(emit: Callable[[dict[str, Any]], None]) -> int:
+            # Appended edits replace the earlier copies of their message, as in canonicalize_last_7_days.py.
+            n = 0
+            for line, _ in drop_superseded(read_lines(paths), superseded_positions(paths)):
+                emit(loads(line))
+                n += 1
+            return n
+
+    else:
+        entities = args.entity or [e.strip() for e in os.environ.get("TG_ENTITY", "").split(",") if e.strip()]
+        if not entities:
+            parser.error("no entity to fetch: pass --entity or set TG_ENTITY")
+        since = datetime.now(timezone.utc) - timedelta(days=args.days)
+        raw = RAW if args.keep_files else None
+
+        def source(emit: Callable[[dict[str, Any]], None]) -> int:
+            return asyncio.run(fetch_telegram(entities, since, emit, raw))
+
+    run(source, keep_files=args.keep_files, batch_size=args.batch_size, queue_size=args.queue_size, profile=args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,561 @@
+"""
+Read-only query API over the Oxigraph store.
+
+`GraphQueries` opens the store read-only and answers the questions dashboards
+ask most: posts by a user, the thread around a post, top hashtags and links
+in a time window, activity over time, and full-text search (through the
+index in `builder.search`). Each query is a fixed SPARQL text;
+parameters are bound through a `VALUES` row of properly escaped RDF terms, so
+user-supplied strings never become query syntax.
+
+List queries page with keyset cursors (the sort key of the last row), which
+stay cheap and stable however deep a client pages. Results are kept in an LRU
+cache that is dropped, and the store reopened, whenever the loader bumps the
+store generation (see `builder.store.bump_generation`).
+
+Queries see the union of all graphs, so it makes no difference whether the
+store was loaded from Turtle (default graph) or with `--bulk`/`--upsert`
+(named graphs).
+"""
+
+import os
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import datetime
+from string import Template
+from typing import Any, Generic, TypeVar, cast
+
+from pyoxigraph import Literal, NamedNode, Store
+
+from builder.rdf import PREFIXES, XSD_DATETIME, expand
+from builder.search import SEARCH_DB, SearchIndex
+from builder.store import read_generation, to_node
+from builder.threads import THREAD_DIR, ThreadIndex
+from builder.transform import WINDOW, graph_id, user_id
+
+STORE_DIR = "data/oxigraph/store"
+
+T = TypeVar("T")
+
+# (created lexical form, post IRI) of the last row on a page
+Cursor = tuple[str, str]
+
+
+@dataclass(frozen=True)
+class PostRow:
+    iri: str
+    created: datetime
+    content: str | None
+    creator: str | None
+    container: str | None
+    reply_to: str | None
+
+
+@dataclass(frozen=True)
+class Page(Generic[T]):
+    items: tuple[T, ...]
+    # Pass as `after=` to get the next page; None on the last page
+    next_cursor: Cursor | None
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    post: PostRow
+    score: float  # BM25 relevance, higher is better
+
+
+@dataclass(frozen=True)
+class TermCount:
+    value: str
+    posts: int
+
+
+@dataclass(frozen=True)
+class ActivityBucket:
+    bucket: str  # "2026-01-07" (day) or "2026-01-07T13" (hour)
+    posts: int
+    users: int
+
+
+# `$values` is the VALUES row binding the query parameters; the other placeholders
+# fix the query's shape (limit, bucket width, ...).
+_POST_COLUMNS = """
+  ?post dcterms:created ?created .
+  OPTIONAL { ?post sioc:content ?content }
+  OPTIONAL { ?post sioc:has_creator ?creator }
+  OPTIONAL { ?post sioc:has_container ?container }
+  OPTIONAL { ?post sioc:reply_of ?reply_to }
+"""
+
+# Keyset filters on (created, post IRI); `?after_created`/`?after_post` are bound.
+_AFTER_DESC = "FILTER(?created < ?after_created || (?created = ?after_created && STR(?post) < ?after_post))"
+_AFTER_ASC = "FILTER(?created > ?after_created || (?created = ?after_created && STR(?post) > ?after_post))"
+
+POSTS_BY_USER = Template(
+    """
+SELECT DISTINCT ?post ?created ?content ?creator ?container ?reply_to WHERE {
+  $values
+  ?post sioc:has_creator ?user .
+  $columns
+  $after
+}
+ORDER BY DESC(?created) DESC(STR(?post))
+LIMIT $limit
+"""
+)
+
+# Walks up `reply_of` to the root (the first post with no parent, possibly outside the
+# window), then down to every post that replies to it, directly or not.
+THREAD = Template(
+    """
+SELECT DISTINCT ?post ?created ?content ?creator ?container ?reply_to WHERE {
+  $values
+  ?start sioc:reply_of* ?root .
+  FILTER NOT EXISTS { ?root sioc:reply_of ?parent }
+  ?post sioc:reply_of* ?root .
+  $columns
+  $after
+}
+ORDER BY ?created STR(?post)
+LIMIT $limit
+"""
+)
+
+# Thread members resolved by the thread index; `$posts` lists their IRIs.
+THREAD_POSTS = Template(
+    """
+SELECT DISTINCT ?post ?created ?content ?creator ?container ?reply_to WHERE {
+  $values
+  VALUES ?post { $posts }
+  $columns
+  $after
+}
+ORDER BY ?created STR(?post)
+LIMIT $limit
+"""
+)
+
+# Full-text matches from the search index; `$hits` lists `(<post> rank)` rows, best first.
+SEARCH = Template(
+    """
+SELECT ?post ?created ?content ?creator ?container ?reply_to ?rank WHERE {
+  $values
+  VALUES (?post ?rank) { $hits }
+  $columns
+  $filters
+}
+ORDER BY ?rank
+"""
+)
+
+# `?community` is left unbound (matching every community) unless given.
+TOP_TERMS = Template(
+    """
+SELECT ?value (COUNT(DISTINCT ?post) AS ?posts) WHERE {
+  $values
+  ?post $predicate ?value ;
+        dcterms:created ?created ;
+        sioc:has_container ?community .
+  FILTER(?created >= ?start && ?created < ?end)
+}
+GROUP BY ?value
+ORDER BY DESC(?posts) ?value
+LIMIT $limit
+"""
+)
+
+ACTIVITY = Template(
+    """
+SELECT ?bucket (COUNT(DISTINCT ?post) AS ?posts) (COUNT(DISTINCT ?creator) AS ?users) WHERE {
+  $values
+  ?post a sioc:Post ;
+        dcterms:created ?created ;
+        sioc:has_container ?community .
+  OPTIONAL { ?post sioc:has_creator ?creator }
+  FILTER(?created >= ?start && ?created < ?end)
+  BIND(SUBSTR(STR(?created), 1, $width) AS ?bucket)
+}
+GROUP BY ?bucket
+ORDER BY ?bucket
+"""
+)
+
+# Point lookups on the aggregates written at load time (see builder.aggregates). Windows of a
+# chat overlap (last3d is part of last7d), so `$graphs` lists the stats graphs of one window.
+STATS_GRAPHS = Template(
+    """
+SELECT ?stats ?graph WHERE { GRAPH ?stats { ?stats tg:statsOf ?graph } }
+"""
+)
+
+REPLY_COUNT = Template(
+    """
+SELECT (SUM(?n) AS ?replies) WHERE {
+  $values
+  VALUES ?stats { $graphs }
+  GRAPH ?stats { ?post tg:replyCount ?n }
+}
+"""
+)
+
+USER_DAYS = Template(
+    """
+SELECT ?day (SUM(?n) AS ?posts) WHERE {
+  $values
+  VALUES ?stats { $graphs }
+  GRAPH ?stats {
+    ?s a tg:UserDay ;
+       tg:user ?user ;
+       tg:day ?day ;
+       tg:postCount ?n .
+  }
+}
+GROUP BY ?day
+ORDER BY ?day
+"""
+)
+
+TOPIC_COUNTS = Template(
+    """
+SELECT ?value (SUM(?n) AS ?posts) WHERE {
+  $values
+  VALUES ?stats { $graphs }
+  GRAPH ?stats {
+    ?s a tg:TopicCount ;
+       tg:topic ?value ;
+       tg:postCount ?n .
+  }
+}
+GROUP BY ?value
+HAVING (SUM(?n) > 0)
+ORDER BY DESC(?posts) ?value
+LIMIT $limit
+"""
+)
+
+# URL counts are the only `tg:postCount` subjects without a type.
+LINK_COUNTS = Template(
+    """
+SELECT ?value (SUM(?n) AS ?posts) WHERE {
+  $values
+  VALUES ?stats { $graphs }
+  GRAPH ?stats {
+    ?value tg:postCount ?n .
+    FILTER NOT EXISTS { ?value a ?type }
+  }
+}
+GROUP BY ?value
+HAVING (SUM(?n) > 0)
+ORDER BY DESC(?posts) ?value
+LIMIT $limit
+"""
+)
+
+# Characters of the xsd:dateTime lexical form kept per bucket
+BUCKET_WIDTHS = {"day": 10, "hour": 13}
+
+
+def _datetime_literal(value: datetime | str) -> Literal:
+    lexical = value.isoformat() if isinstance(value, datetime) else value
+    return Literal(lexical, datatype=NamedNode(XSD_DATETIME))
+
+
+def _user_node(user: str | int) -> NamedNode:
+    # Accepts a Telegram user id, a `tg:user/...` CURIE or a full IRI.
+    return to_node(expand(user_id(user) if isinstance(user, int) else user))
+
+
+def values_clause(bindings: dict[str, Any]) -> str:
+    """`VALUES (?a ?b) { (<term> <term>) }` for the bound entries of `bindings`."""
+    bound = {k: v for k, v in bindings.items() if v is not None}
+    if not bound:
+        return ""
+    # str() of a pyoxigraph term is its N-Triples form, with IRIs and literals escaped.
+    names = " ".join(f"?{k}" for k in bound)
+    terms = " ".join(str(v) for v in bound.values())
+    return f"VALUES ({names}) {{ ({terms}) }}"
+
+
+def _value(term: Any) -> Any:
+    return None if term is None else term.value
+
+
+def _post_row(row: Any) -> PostRow:
+    return PostRow(
+        iri=row["post"].value,
+        created=datetime.fromisoformat(row["created"].value),
+        content=_value(row["content"]),
+        creator=_value(row["creator"]),
+        container=_value(row["container"]),
+        reply_to=_value(row["reply_to"]),
+    )
+
+
+class LRUCache(Generic[T]):
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: OrderedDict[Any, T] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> T | None:
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Any, value: T) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+class GraphQueries:
+    """
+    Prepared queries against a read-only store, with a result cache.
+
+    The store is reopened (and the cache dropped) when the store generation
+    changes, i.e. after every run of `load_into_oxigraph.py`. When a thread
+    index (see `builder.threads`) exists in `thread_dir`, `thread` uses it
+    instead of recursive property paths, and reopens it when it is rebuilt.
+    """
+
+    def __init__(
+        self, store_dir: str = STORE_DIR, cache_size: int = 256, thread_dir: str = THREAD_DIR, search_db: str = SEARCH_DB
+    ):
+        self.store_dir = store_dir
+        self.thread_dir = thread_dir
+        self.search_db = search_db
+        self.search_index: SearchIndex | None = None
+        self.cache: LRUCache[Any] = LRUCache(cache_size)
+        self.generation = read_generation(store_dir)
+        self.store = Store.read_only(store_dir)
+        self.threads: ThreadIndex | None = None
+        self.threads_stamp: tuple[int, int] | None = None
+        self._refresh_threads()
+
+    def _refresh_threads(self) -> None:
+        try:
+            st = os.stat(os.path.join(self.thread_dir, "meta.json"))
+        except FileNotFoundError:
+            stamp = None
+        else:
+            stamp = (st.st_ino, st.st_mtime_ns)
+        if stamp == self.threads_stamp:
+            return
+        if self.threads is not None:
+            self.threads.close()
+        self.threads = ThreadIndex(self.thread_dir) if stamp else None
+        self.threads_stamp = stamp
+        self.cache.clear()
+
+    def _refresh(self) -> None:
+        gen = read_generation(self.store_dir)
+        if gen != self.generation:
+            self.store = Store.read_only(self.store_dir)
+            self.cache.clear()
+            self.generation = gen
+        self._refresh_threads()
+
+    def _select(self, template: Template, shape: dict[str, Any], **bindings: Any) -> list[Any]:
+        """Run a SELECT with `bindings` (pyoxigraph terms; None = unbound); results are cached."""
+        self._refresh()
+        query = template.substitute(values=values_clause(bindings), **shape)
+        rows = self.cache.get(query)
+        if rows is None:
+            solutions = self.store.query(query, prefixes=PREFIXES, use_default_graph_as_union=True)
+            rows = list(cast(Iterable[Any], solutions))
+            self.cache.put(query, rows)
+        return rows
+
+    def cache_info(self) -> dict[str, int]:
+        return {
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "size": len(self.cache.entries),
+            "generation": self.generation,
+        }
+
+    def _post_page(
+        self, template: Template, after_filter: str, limit: int, after: Cursor | None, **bindings: Any
+    ) -> Page[PostRow]:
+        shape = {"columns": _POST_COLUMNS, "after": after_filter if after else "", "limit": limit + 1}
+        if "posts" in bindings:
+            shape["posts"] = bindings.pop("posts")
+        if after:
+            bindings["after_created"] = _datetime_literal(after[0])
+            bindings["after_post"] = Literal(after[1])
+        rows = self._select(template, shape, **bindings)
+
+        items = tuple(_post_row(row) for row in rows[:limit])
+        # One extra row was fetched to tell whether there is a next page.
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = (last["created"].value, last["post"].value)
+        return Page(items, next_cursor)
+
+    def posts_by_user(self, user: str | int, limit: int = 50, after: Cursor | None = None) -> Page[PostRow]:
+        """Posts written by `user`, newest first."""
+        return self._post_page(POSTS_BY_USER, _AFTER_DESC, limit, after, user=_user_node(user))
+
+    def thread(self, post: str, limit: int = 200, after: Cursor | None = None) -> Page[PostRow]:
+        """Every post in the reply thread containing `post` (a CURIE or IRI), oldest first."""
+        self._refresh_threads()
+        if self.threads is not None:
+            try:
+                members = self.threads.thread(post)
+            except KeyError:
+                pass  # not in the index (e.g. loaded after it was built)
+            else:
+                posts = " ".join(str(to_node(p)) for p in members) or str(to_node(expand(post)))
+                return self._post_page(THREAD_POSTS, _AFTER_ASC, limit, after, posts=posts)
+        return self._post_page(THREAD, _AFTER_ASC, limit, after, start=to_node(expand(post)))
+
+    def search(
+        self,
+        text: str,
+        limit: int = 20,
+        start: datetime | None = None,
+        end: datetime | None = None,
+        community: str | None = None,
+        creator: str | int | None = None,
+    ) -> list[SearchHit]:
+        """
+        Posts containing every word of `text`, most relevant first, optionally
+        restricted to [start, end), a community and a creator.
+
+        Candidates come from the full-text index in ranked batches; each batch
+        is filtered in SPARQL until `limit` hits are found.
+        """
+        if self.search_index is None:
+            if not os.path.exists(self.search_db):
+                raise FileNotFoundError(f"No search index at {self.search_db}; run load_into_oxigraph.py first")
+            self.search_index = SearchIndex(self.search_db, readonly=True)
+
+        filters = []
+        if start is not None:
+            filters.append("FILTER(?created >= ?start)")
+        if end is not None:
+            filters.append("FILTER(?created < ?end)")
+        if community is not None:
+            filters.append("FILTER(?container = ?community)")
+        if creator is not None:
+            filters.append("FILTER(?creator = ?user)")
+        bindings = {
+            "start": _datetime_literal(start) if start is not None else None,
+            "end": _datetime_literal(end) if end is not None else None,
+            "community": to_node(expand(community)) if community else None,
+            "user": _user_node(creator) if creator is not None else None,
+        }
+
+        batch = max(4 * limit, 256)
+        hits: list[SearchHit] = []
+        offset = 0
+        while len(hits) < limit:
+            ranked = self.search_index.search(text, limit=batch, offset=offset)
+            if not ranked:
+                break
+            scores = {iri: score for iri, score in ranked}
+            rows_in = " ".join(f"({to_node(iri)} {offset + n})" for n, (iri, _) in enumerate(ranked))
+            shape = {"hits": rows_in, "columns": _POST_COLUMNS, "filters": "\n  ".join(filters)}
+            for row in self._select(SEARCH, shape, **bindings):
+                hits.append(SearchHit(_post_row(row), scores[row["post"].value]))
+            if len(ranked) < batch:
+                break
+            offset += batch
+        return hits[:limit]
+
+    def _top(
+        self, predicate: str, start: datetime, end: datetime, limit: int, community: str | None
+    ) -> list[TermCount]:
+        rows = self._select(
+            TOP_TERMS,
+            {"predicate": predicate, "limit": limit},
+            start=_datetime_literal(start),
+            end=_datetime_literal(end),
+            community=to_node(expand(community)) if community else None,
+        )
+        return [TermCount(row["value"].value, int(row["posts"].value)) for row in rows]
+
+    def top_hashtags(
+        self, start: datetime, end: datetime, limit: int = 10, community: str | None = None
+    ) -> list[TermCount]:
+        """
+        Most used hashtag topics (`tg:tag/hashtag/...`) in posts created in
+        [start, end). For a whole loaded window, `window_hashtags` is cheaper.
+        """
+        return self._top("sioc:topic", start, end, limit, community)
+
+    def top_links(
+        self, start: datetime, end: datetime, limit: int = 10, community: str | None = None
+    ) -> list[TermCount]:
+        """Most linked URLs in posts created in [start, end). For a whole loaded window, see `window_links`."""
+        return self._top("sioc:links_to", start, end, limit, community)
+
+    def activity(
+        self, start: datetime, end: datetime, bucket: str = "day", community: str | None = None
+    ) -> list[ActivityBucket]:
+        """Posts and distinct authors per day (or hour) in [start, end), in UTC."""
+        if bucket not in BUCKET_WIDTHS:
+            raise ValueError(f"Unsupported bucket: {bucket!r} (expected one of {sorted(BUCKET_WIDTHS)})")
+        rows = self._select(
+            ACTIVITY,
+            {"width": BUCKET_WIDTHS[bucket]},
+            start=_datetime_literal(start),
+            end=_datetime_literal(end),
+            community=to_node(expand(community)) if community else None,
+        )
+        return [ActivityBucket(row["bucket"].value, int(row["posts"].value), int(row["users"].value)) for row in rows]
+
+    def _stats_graphs(self, window: str, community: str | None = None) -> str:
+        """
+        The stats graphs of every chat's `window` graph (or only `community`'s),
+        as a `VALUES` list. Raises ValueError if there are none, rather than
+        letting a store loaded without aggregates (the Turtle load) answer 0.
+        """
+        rows = self._select(STATS_GRAPHS, {})
+        if community is not None:
+            chat = expand(community).rsplit("/", 1)[1]
+            wanted = expand(graph_id(chat, window))
+            graphs = " ".join(str(row["stats"]) for row in rows if row["graph"].value == wanted)
+            if not graphs:
+                raise ValueError(f"No aggregates for window {window!r} of {community} in {self.store_dir}")
+            return graphs
+        suffix = f"/{window}"
+        graphs = " ".join(str(row["stats"]) for row in rows if row["graph"].value.endswith(suffix))
+        if not graphs:
+            raise ValueError(
+                f"No aggregates for window {window!r} in {self.store_dir}; load it with --bulk, --upsert or N-Quads --shards"
+            )
+        return graphs
+
+    def reply_count(self, post: str, window: str = WINDOW) -> int:
+        """Direct replies to `post` in `window`, from the load-time aggregates (`--bulk`/`--upsert` loads only)."""
+        rows = self._select(REPLY_COUNT, {"graphs": self._stats_graphs(window)}, post=to_node(expand(post)))
+        return int(rows[0]["replies"].value) if rows and rows[0]["replies"] is not None else 0
+
+    def user_days(self, user: str | int, window: str = WINDOW) -> list[TermCount]:
+        """Posts per day by `user` in `window` (`value` is the UTC date), from the load-time aggregates."""
+        rows = self._select(USER_DAYS, {"graphs": self._stats_graphs(window)}, user=_user_node(user))
+        return [TermCount(row["day"].value, int(row["posts"].value)) for row in rows]
+
+    def _window_top(self, template: Template, window: str, limit: int, community: str | None) -> list[TermCount]:
+        rows = self._select(template, {"graphs": self._stats_graphs(window, community), "limit": limit})
+        return [TermCount(row["value"].value, int(row["posts"].value)) for row in rows]
+
+    def window_hashtags(self, window: str = WINDOW, limit: int = 10, community: str | None = None) -> list[TermCount]:
+        """`top_hashtags` over a whole `window`, read from the load-time aggregates instead of every post."""
+        return self._window_top(TOPIC_COUNTS, window, limit, community)
+
+    def window_links(self, window: str = WINDOW, limit: int = 10, community: str | None = None) -> list[TermCount]:
+        """`top_links` over a whole `window`, read from the load-time aggregates instead of every post."""
+        return self._window_top(LINK_COUNTS, window, limit, community)
@@ -0,0 +1,185 @@
+"""
+Streaming RDF emitter for canonical Telegram records.
+
+Mirrors what `rdflib_dumper` produces for a `GraphDocument` built by
+`transform_to_linkml.py`, but writes one line per triple as records are read,
+so memory stays flat regardless of message count. Per-post triples come from
+`builder.sioc_triples`, which is generated from the schema.
+"""
+
+import re
+from collections.abc import Iterable, Iterator
+from typing import Any, TextIO
+
+# Class and slot URIs, prefixes and per-class triple functions are generated
+# from schemas/sioc_min.yaml (see builder.codegen); the rest of the package
+# keeps importing them from here.
+from builder.sioc_triples import (
+    GRAPH_DOCUMENT,
+    GRAPH_DOCUMENT_SLOTS,
+    LINK,
+    POST,
+    POST_SLOTS,
+    PREFIXES,
+    RDF_TYPE,
+    USER_ACCOUNT,
+    XSD_BOOLEAN,
+    XSD_DATETIME,
+    XSD_INTEGER,
+    expand,
+    link_triples,
+    post_triples,
+    user_account_triples,
+)
+from builder.terms import Literal, Quad, Triple, normalize_datetime
+from builder.transform import WINDOW, community_id, graph_id, post_record
+
+# GraphDocument slots (no slot_uri, so they live in the default `tg:` prefix)
+DOC_COMMUNITY = GRAPH_DOCUMENT_SLOTS["community"]
+DOC_USERS = GRAPH_DOCUMENT_SLOTS["users"]
+DOC_LINKS = GRAPH_DOCUMENT_SLOTS["links"]
+DOC_POSTS = GRAPH_DOCUMENT_SLOTS["posts"]
+
+# Characters that may not appear raw inside an IRIREF
+_IRI_UNSAFE = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+
+
+# chat_id -> (document IRI, users seen, links seen)
+DocumentState = dict[str, tuple[str, set[str], set[str]]]
+
+
+def graph_quads(
+    records: Iterable[dict[str, Any]], docs: DocumentState | None = None, window: str = WINDOW
+) -> Iterator[Quad]:
+    """
+    Yield the triples of one `GraphDocument` per chat for a stream of canonical
+    records, matching what `transform_to_linkml.py` builds for the same input.
+
+    Each triple carries the IRI of its document, which identifies the community
+    and time window and doubles as the named graph when loading into a store.
+    Passing the same `docs` to consecutive calls continues one stream across
+    them (the documents, users and links already written aren't repeated).
+    `window` names the documents (see `graph_id`).
+    """
+    if docs is None:
+        docs = {}
+
+    for obj in records:
+        chat_id = obj["chat_id"]
+        if chat_id not in docs:
+            doc = expand(graph_id(chat_id, window))
+            docs[chat_id] = (doc, set(), set())
+            yield doc, RDF_TYPE, GRAPH_DOCUMENT, doc
+            yield doc, DOC_COMMUNITY, expand(community_id(chat_id)), doc
+        doc, users, links = docs[chat_id]
+
+        record = post_record(obj)
+
+        creator = record["has_creator"]
+        if creator is not None and creator not in users:
+            users.add(creator)
+            yield doc, DOC_USERS, expand(creator), doc
+            for s, p, o in user_account_triples({"id": creator}):
+                yield s, p, o, doc
+
+        for url in record["links_to"] or []:
+            if url not in links:
+                links.add(url)
+                yield doc, DOC_LINKS, expand(url), doc
+                for s, p, o in link_triples({"id": url}):
+                    yield s, p, o, doc
+
+        yield doc, DOC_POSTS, expand(record["id"]), doc
+        for s, p, o in post_triples(record):
+            yield s, p, o, doc
+
+    if not docs:
+        raise RuntimeError("No messages found in canonical input file.")
+
+
+def graph_triples(records: Iterable[dict[str, Any]]) -> Iterator[Triple]:
+    """`graph_quads` without the graph name: the union of all documents."""
+    for s, p, o, _ in graph_quads(records):
+        yield s, p, o
+
+
+def escape_iri(iri: str) -> str:
+    return _IRI_UNSAFE.sub(lambda m: "".join(f"%{b:02X}" for b in m.group().encode("utf-8")), iri)
+
+
+def _escape_literal(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def nt_iri(iri: str) -> str:
+    return f"<{escape_iri(iri)}>"
+
+
+def nt_term(term: "str | Literal") -> str:
+    if isinstance(term, Literal):
+        lexical = f'"{_escape_literal(term.lexical)}"'
+        if term.datatype is None:
+            return lexical
+        return f"{lexical}^^{nt_iri(term.datatype)}"
+    return nt_iri(term)
+
+
+def _turtle_vocab() -> dict[str, str]:
+    # Predicates and classes are written as prefixed names in Turtle output,
+    # which keeps the file readable (and greppable for e.g. `sioc:Post`).
+    vocab = [RDF_TYPE, GRAPH_DOCUMENT, USER_ACCOUNT, LINK, POST, DOC_COMMUNITY, DOC_USERS, DOC_LINKS, DOC_POSTS]
+    vocab.extend(POST_SLOTS.values())
+    out: dict[str, str] = {nt_iri(RDF_TYPE): "a"}
+    for iri in vocab[1:]:
+        for prefix, ns in PREFIXES.items():
+            if iri.startswith(ns):
+                out[nt_iri(iri)] = f"{prefix}:{iri[len(ns):]}"
+                break
+    return out
+
+
+def write_triples(triples: Iterable[Triple], f: TextIO, fmt: str = "nt", header: bool = True) -> int:
+    """
+    Write triples one per line as N-Triples (`fmt="nt"`) or Turtle (`fmt="ttl"`).
+
+    The Turtle flavour is N-Triples plus a prefix header with prefixed names
+    for the schema vocabulary, so it can still be produced in a single pass.
+    `header=False` leaves out the prefixes, to append to a file that has them.
+    Returns the number of triples written.
+    """
+    if fmt not in ("nt", "ttl"):
+        raise ValueError(f"Unsupported RDF format: {fmt!r}")
+
+    vocab: dict[str, str] = {}
+    if fmt == "ttl":
+        vocab = _turtle_vocab()
+    if fmt == "ttl" and header:
+        for prefix, ns in PREFIXES.items():
+            f.write(f"@prefix {prefix}: <{ns}> .\n")
+
+    n = 0
+    for s, p, o in triples:
+        s_term = nt_iri(s)
+        p_term = nt_iri(p)
+        o_term = nt_term(o)
+        if vocab:
+            p_term = vocab.get(p_term, p_term)
+            if p_term == "a":
+                o_term = vocab.get(o_term, o_term)
+        f.write(f"{s_term} {p_term} {o_term} .\n")
+        n += 1
+    return n
+
+
+def write_quads(quads: Iterable[Quad], f: TextIO) -> int:
+    """Write quads one per line as N-Quads; returns the number written."""
+    n = 0
+    for s, p, o, g in quads:
+        f.write(f"{nt_iri(s)} {nt_iri(p)} {nt_term(o)} {nt_iri(g)} .\n")
+        n += 1
+    return n
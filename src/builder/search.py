@@ -0,0 +1,209 @@
+"""
+Full-text index over post content, in SQLite FTS5 next to the store.
+
+Oxigraph has no text index, so matching words with `FILTER(CONTAINS(...))`
+scans every post. The loader keeps this index in step with the store
+instead: each run syncs it with the canonical records it loaded, rewriting
+only posts whose content changed and dropping posts that left their graph.
+A search returns post IRIs ranked by BM25, which `GraphQueries.search` then
+joins with SPARQL filters on time, community and creator.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from typing import Any, cast
+
+from builder.rdf import expand
+from builder.transform import graph_id, post_record
+
+SEARCH_DB = "data/oxigraph/search.sqlite"
+
+# `posts.id` is the rowid of the post's row in `post_text`.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+  id INTEGER PRIMARY KEY,
+  iri TEXT NOT NULL UNIQUE,
+  graph TEXT NOT NULL,
+  hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_graph ON posts (graph);
+CREATE VIRTUAL TABLE IF NOT EXISTS post_text USING fts5 (content, tokenize = 'unicode61 remove_diacritics 2');
+"""
+
+_WORD_RE = re.compile(r"\w+\*?")
+
+
+def fts_query(text: str) -> str:
+    """
+    FTS5 query matching posts that contain every word of `text`.
+
+    Words are quoted, so operators and punctuation in user input are taken
+    literally; a trailing `*` keeps its prefix-match meaning.
+    """
+    words = [f'"{w.rstrip("*")}"' + ("*" if w.endswith("*") else "") for w in _WORD_RE.findall(text)]
+    if not words:
+        raise ValueError(f"No searchable words in {text!r}")
+    return " ".join(words)
+
+
+def _digest(content: str) -> str:
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@dataclass
+class SyncStats:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+
+    def __str__(self) -> str:
+        return f"{self.inserted} inserted, {self.updated} updated, {self.unchanged} unchanged, {self.deleted} deleted posts"
+
+
+class SearchIndex:
+    """The FTS5 index in `path`; `readonly` opens an existing one for queries only."""
+
+    def __init__(self, path: str = SEARCH_DB, readonly: bool = False):
+        self.path = path
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(path)
+            self.conn.execute("PRAGMA journal_mode = WAL")  # readers keep working during a sync
+            self.conn.executescript(_SCHEMA)
+
+    def __enter__(self) -> "SearchIndex":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def sync(self, records: Iterable[dict[str, Any]]) -> SyncStats:
+        """
+        Bring the graphs covered by canonical `records` in line with them, in one transaction.
+
+        Mirrors `upsert_records`: within a graph, posts missing from the input
+        are removed and later duplicates of a post win.
+        """
+        stats = SyncStats()
+        # graph -> {iri: (id, hash)} of stored posts not seen in the input yet
+        pending: dict[str, dict[str, tuple[int, str]]] = {}
+        # iri -> (id, hash) of posts already written by this sync
+        seen: dict[str, tuple[int, str]] = {}
+        unchanged: set[str] = set()
+        with self.conn:
+            for obj in records:
+                graph = expand(graph_id(obj["chat_id"]))
+                if graph not in pending:
+                    rows = self.conn.execute("SELECT iri, id, hash FROM posts WHERE graph = ?", (graph,))
+                    pending[graph] = {iri: (i, h) for iri, i, h in rows}
+                record = post_record(obj)
+                iri = expand(record["id"])
+                content = record["content"] or ""
+                h = _digest(content)
+
+                if iri in seen:
+                    # Later duplicate (e.g. an appended edit): it wins, but the post is only counted once.
+                    i, old_hash = seen[iri]
+                    if old_hash != h:
+                        self._update(i, h, content)
+                        seen[iri] = (i, h)
+                        if iri in unchanged:
+                            unchanged.discard(iri)
+                            stats.unchanged -= 1
+                            stats.updated += 1
+                    continue
+
+                old = pending[graph].pop(iri, None)
+                if old is None:
+                    i = self._insert(iri, graph, h, content)
+                    stats.inserted += 1
+                elif old[1] != h:
+                    i = old[0]
+                    self._update(i, h, content)
+                    stats.updated += 1
+                else:
+                    i = old[0]
+                    unchanged.add(iri)
+                    stats.unchanged += 1
+                seen[iri] = (i, h)
+
+            for gone in pending.values():
+                self._delete([i for i, _ in gone.values()])
+                stats.deleted += len(gone)
+        return stats
+
+    def apply(self, records: Iterable[dict[str, Any]], deleted: Iterable[str] = ()) -> SyncStats:
+        """
+        Index or re-index the posts of canonical `records` and drop the `deleted`
+        post IRIs, in one transaction. Other posts are left alone, as with
+        `builder.store.apply_changes`.
+        """
+        stats = SyncStats()
+        with self.conn:
+            for obj in records:
+                record = post_record(obj)
+                iri = expand(record["id"])
+                content = record["content"] or ""
+                h = _digest(content)
+                row = self.conn.execute("SELECT id, hash FROM posts WHERE iri = ?", (iri,)).fetchone()
+                if row is None:
+                    self._insert(iri, expand(graph_id(obj["chat_id"])), h, content)
+                    stats.inserted += 1
+                elif row[1] != h:
+                    self._update(row[0], h, content)
+                    stats.updated += 1
+                else:
+                    stats.unchanged += 1
+            for iri in deleted:
+                row = self.conn.execute("SELECT id FROM posts WHERE iri = ?", (iri,)).fetchone()
+                if row is not None:
+                    self._delete([row[0]])
+                    stats.deleted += 1
+        return stats
+
+    def _insert(self, iri: str, graph: str, h: str, content: str) -> int:
+        cur = self.conn.execute("INSERT INTO posts (iri, graph, hash) VALUES (?, ?, ?)", (iri, graph, h))
+        i = cast(int, cur.lastrowid)
+        self.conn.execute("INSERT INTO post_text (rowid, content) VALUES (?, ?)", (i, content))
+        return i
+
+    def _update(self, i: int, h: str, content: str) -> None:
+        self.conn.execute("UPDATE posts SET hash = ? WHERE id = ?", (h, i))
+        self.conn.execute("UPDATE post_text SET content = ? WHERE rowid = ?", (content, i))
+
+    def _delete(self, ids: list[int]) -> None:
+        rows = [(i,) for i in ids]
+        self.conn.executemany("DELETE FROM post_text WHERE rowid = ?", rows)
+        self.conn.executemany("DELETE FROM posts WHERE id = ?", rows)
+
+    def search(self, text: str, limit: int = 100, offset: int = 0) -> list[tuple[str, float]]:
+        """(post IRI, score) for posts matching every word of `text`, best first (higher is better)."""
+        rows = self.conn.execute(
+            "SELECT posts.iri, bm25(post_text) AS rank FROM post_text JOIN posts ON posts.id = post_text.rowid "
+            "WHERE post_text MATCH ? ORDER BY rank LIMIT ? OFFSET ?",
+            (fts_query(text), limit, offset),
+        )
+        return [(iri, -rank) for iri, rank in rows]
+
+    def iter_search(self, text: str, batch: int = 256) -> Iterator[tuple[str, float]]:
+        """Every match of `text`, best first, fetched `batch` rows at a time."""
+        offset = 0
+        while True:
+            rows = self.search(text, limit=batch, offset=offset)
+            yield from rows
+            if len(rows) < batch:
+                return
+            offset += batch
+
+    def close(self) -> None:
+        self.conn.close()
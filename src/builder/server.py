@@ -0,0 +1,223 @@
+"""
+Caching SPARQL HTTP front-end for the Oxigraph store.
+
+Speaks the query part of the SPARQL 1.1 protocol (`GET /query?query=...`,
+`POST /query` with a form or `application/sparql-query` body) on top of a
+read-only store opened in-process.
+
+- Incoming queries are normalized (comments dropped, whitespace collapsed
+  outside strings and IRIs) and hashed, so cosmetic differences hit the same
+  cache entry.
+- Results are cached per store generation (see `builder.store`). The ETag is
+  the generation plus the query hash, so a client's `If-None-Match` gets a
+  304 without touching the store until the loader bumps the generation.
+- Concurrent identical queries are coalesced: the first request runs the
+  query and the others wait for its result.
+"""
+
+import hashlib
+import json
+import re
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+from pyoxigraph import QueryBoolean, QueryResultsFormat, QuerySolutions, RdfFormat, Store
+
+from builder.query import STORE_DIR, LRUCache
+from builder.store import read_generation
+
+JSON_RESULTS = "application/sparql-results+json"
+N_TRIPLES = "application/n-triples"
+
+_TOKEN_RE = re.compile(
+    r'''
+      (?P<string>"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^'\\]|\\.|'(?!''))*\'\'\'
+                 |"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    | (?P<iri><[^<>"{}|^`\\\x00-\x20]*>)
+    | (?P<comment>\#[^\n]*)
+    | (?P<ws>\s+)
+    | (?P<other>[^\s"'<\#]+|.)
+    ''',
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def normalize_query(query: str) -> str:
+    """Drop comments and collapse whitespace, leaving strings and IRIs untouched."""
+    out: list[str] = []
+    for m in _TOKEN_RE.finditer(query):
+        if m.lastgroup in ("ws", "comment"):
+            if out and out[-1] != " ":
+                out.append(" ")
+        else:
+            out.append(m.group())
+    return "".join(out).strip()
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class Response:
+    status: int
+    content_type: str
+    body: bytes
+    etag: str | None = None
+
+
+class SparqlFrontend:
+    """
+    Runs and caches queries against a read-only store; independent of HTTP.
+
+    The store is reopened and the cache dropped when the store generation
+    changes. Entries are keyed by generation, so an in-flight query from
+    before a reload never answers a request made after it.
+    """
+
+    def __init__(self, store_dir: str = STORE_DIR, cache_size: int = 512):
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+        self.cache: LRUCache[Response] = LRUCache(cache_size)
+        self.inflight: dict[tuple[int, str], Future[Response]] = {}
+        self.executed = 0  # queries actually run against the store
+        self.coalesced = 0
+        self.generation = read_generation(store_dir)
+        self.store = Store.read_only(store_dir)
+
+    def _current(self) -> tuple[int, Store]:
+        gen = read_generation(self.store_dir)
+        with self.lock:
+            if gen != self.generation:
+                self.store = Store.read_only(self.store_dir)
+                self.cache.clear()
+                self.generation = gen
+            return self.generation, self.store
+
+    def _execute(self, store: Store, query: str, etag: str) -> Response:
+        try:
+            result = store.query(query, use_default_graph_as_union=True)
+        except SyntaxError as e:
+            return Response(HTTPStatus.BAD_REQUEST, "text/plain; charset=utf-8", str(e).encode("utf-8"))
+        if isinstance(result, (QuerySolutions, QueryBoolean)):
+            body = result.serialize(format=QueryResultsFormat.JSON)
+            return Response(HTTPStatus.OK, JSON_RESULTS, body or b"", etag)
+        body = result.serialize(format=RdfFormat.N_TRIPLES)
+        return Response(HTTPStatus.OK, N_TRIPLES, body or b"", etag)
+
+    def query(self, query: str, if_none_match: str | None = None) -> Response:
+        gen, store = self._current()
+        h = query_hash(query)
+        etag = f'"{gen}-{h[:32]}"'
+        if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+            return Response(HTTPStatus.NOT_MODIFIED, "", b"", etag)
+
+        key = (gen, h)
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            waiting = self.inflight.get(key)
+            if waiting is None:
+                future: Future[Response] = Future()
+                self.inflight[key] = future
+            else:
+                self.coalesced += 1
+        if waiting is not None:
+            return waiting.result()
+
+        try:
+            response = self._execute(store, query, etag)
+        except BaseException as e:
+            with self.lock:
+                del self.inflight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            # Cache before leaving the in-flight table, so no request can slip in between and rerun it.
+            if response.status == HTTPStatus.OK and self.generation == gen:
+                self.cache.put(key, response)
+            del self.inflight[key]
+            self.executed += 1
+        future.set_result(response)
+        return response
+
+    def stats(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "generation": self.generation,
+                "cached": len(self.cache.entries),
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+            }
+
+
+class SparqlHandler(BaseHTTPRequestHandler):
+    server: "SparqlServer"
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, response: Response) -> None:
+        self.send_response(response.status)
+        if response.content_type:
+            self.send_header("Content-Type", response.content_type)
+        if response.etag:
+            self.send_header("ETag", response.etag)
+            self.send_header("Cache-Control", "no-cache")  # revalidate with If-None-Match
+        self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        if response.body and self.command != "HEAD":
+            self.wfile.write(response.body)
+
+    def _error(self, status: int, message: str) -> None:
+        self._send(Response(status, "text/plain; charset=utf-8", message.encode("utf-8")))
+
+    def _answer(self, query: str | None) -> None:
+        if not query:
+            self._error(HTTPStatus.BAD_REQUEST, "missing query")
+            return
+        self._send(self.server.frontend.query(query, self.headers.get("If-None-Match")))
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            body = json.dumps(self.server.frontend.stats()).encode("utf-8")
+            self._send(Response(HTTPStatus.OK, "application/json", body))
+        elif url.path == "/query":
+            self._answer(parse_qs(url.query).get("query", [None])[0])
+        else:
+            self._error(HTTPStatus.NOT_FOUND, "not found")
+
+    do_HEAD = do_GET
+
+    def do_POST(self) -> None:
+        if urlsplit(self.path).path != "/query":
+            self._error(HTTPStatus.NOT_FOUND, "not found")
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+        if content_type == "application/sparql-query":
+            self._answer(body)
+        elif content_type == "application/x-www-form-urlencoded":
+            self._answer(parse_qs(body).get("query", [None])[0])
+        else:
+            self._error(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, f"unsupported content type: {content_type!r}")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class SparqlServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], frontend: SparqlFrontend, verbose: bool = False):
+        super().__init__(address, SparqlHandler)
+        self.frontend = frontend
+        self.verbose = verbose
@@ -0,0 +1,154 @@
+# Auto-generated from schemas/sioc_min.yaml by `python -m builder.codegen`; do not edit.
+"""
+Record -> triples functions for every class of `sioc_min`.
+
+Each `<class>_triples(record)` takes a dict keyed by slot name and yields
+the triples `rdflib_dumper` writes for that object, with URIs and datatypes
+fixed at generation time. Inlined slots recurse into the nested records.
+"""
+
+from collections.abc import Iterator
+from typing import Any
+
+from builder.terms import Literal, Triple, normalize_datetime
+
+PREFIXES = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "xsd": "http://www.w3.org/2001/XMLSchema#",
+    "sioc": "http://rdfs.org/sioc/ns#",
+    "dcterms": "http://purl.org/dc/terms/",
+    "schema": "http://schema.org/",
+    "tg": "https://example.org/telegram/",
+    "linkml": "https://w3id.org/linkml/",
+}
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+XSD_BOOLEAN = "http://www.w3.org/2001/XMLSchema#boolean"
+XSD_DATETIME = "http://www.w3.org/2001/XMLSchema#dateTime"
+XSD_INTEGER = "http://www.w3.org/2001/XMLSchema#integer"
+
+# Class URIs
+GRAPH_DOCUMENT = "https://example.org/telegram/GraphDocument"
+COMMUNITY = "http://rdfs.org/sioc/ns#Community"
+USER_ACCOUNT = "http://rdfs.org/sioc/ns#UserAccount"
+LINK = "http://schema.org/URL"
+POST = "http://rdfs.org/sioc/ns#Post"
+
+# GraphDocument slot name -> slot URI
+GRAPH_DOCUMENT_SLOTS = {
+    "community": "https://example.org/telegram/community",
+    "users": "https://example.org/telegram/users",
+    "links": "https://example.org/telegram/links",
+    "posts": "https://example.org/telegram/posts",
+}
+
+# Community slot name -> slot URI
+COMMUNITY_SLOTS: dict[str, str] = {}
+
+# UserAccount slot name -> slot URI
+USER_ACCOUNT_SLOTS: dict[str, str] = {}
+
+# Link slot name -> slot URI
+LINK_SLOTS: dict[str, str] = {}
+
+# Post slot name -> slot URI
+POST_SLOTS = {
+    "content": "http://rdfs.org/sioc/ns#content",
+    "created": "http://purl.org/dc/terms/created",
+    "has_creator": "http://rdfs.org/sioc/ns#has_creator",
+    "has_container": "http://rdfs.org/sioc/ns#has_container",
+    "reply_to": "http://rdfs.org/sioc/ns#reply_of",
+    "links_to": "http://rdfs.org/sioc/ns#links_to",
+    "forwards": "https://example.org/telegram/forwards",
+    "pinned": "https://example.org/telegram/pinned",
+    "topics": "http://rdfs.org/sioc/ns#topic",
+    "mentions": "https://example.org/telegram/mentions",
+    "entity_links": "http://rdfs.org/sioc/ns#links_to",
+}
+
+
+def expand(ref: str) -> str:
+    """Expand a CURIE using the schema prefixes; full IRIs pass through."""
+    prefix, sep, local = ref.partition(":")
+    if sep and prefix in PREFIXES and not local.startswith("//"):
+        return PREFIXES[prefix] + local
+    return ref
+
+
+def _id(v: Any) -> str:
+    # References are ids; inlined objects carry theirs in `id`.
+    return v if isinstance(v, str) else v["id"]
+
+
+def _items(v: Any) -> Any:
+    # Multivalued slots come as lists, or as dicts keyed by id when inlined as a dict.
+    return v.values() if isinstance(v, dict) else v
+
+
+def graph_document_triples(record: dict[str, Any]) -> Iterator[Triple]:
+    s = expand(record["id"])
+    yield s, RDF_TYPE, GRAPH_DOCUMENT
+    v = record.get("community")
+    if v is not None:
+        yield s, "https://example.org/telegram/community", expand(_id(v))
+    for v in _items(record.get("users") or ()):
+        yield s, "https://example.org/telegram/users", expand(_id(v))
+        if isinstance(v, dict):
+            yield from user_account_triples(v)
+    for v in _items(record.get("links") or ()):
+        yield s, "https://example.org/telegram/links", expand(_id(v))
+        if isinstance(v, dict):
+            yield from link_triples(v)
+    for v in _items(record.get("posts") or ()):
+        yield s, "https://example.org/telegram/posts", expand(_id(v))
+        if isinstance(v, dict):
+            yield from post_triples(v)
+
+
+def community_triples(record: dict[str, Any]) -> Iterator[Triple]:
+    s = expand(record["id"])
+    yield s, RDF_TYPE, COMMUNITY
+
+
+def user_account_triples(record: dict[str, Any]) -> Iterator[Triple]:
+    s = expand(record["id"])
+    yield s, RDF_TYPE, USER_ACCOUNT
+
+
+def link_triples(record: dict[str, Any]) -> Iterator[Triple]:
+    s = expand(record["id"])
+    yield s, RDF_TYPE, LINK
+
+
+def post_triples(record: dict[str, Any]) -> Iterator[Triple]:
+    s = expand(record["id"])
+    yield s, RDF_TYPE, POST
+    v = record.get("content")
+    if v is not None:
+        yield s, "http://rdfs.org/sioc/ns#content", Literal(v)
+    v = record.get("created")
+    if v is not None:
+        yield s, "http://purl.org/dc/terms/created", Literal(normalize_datetime(v), XSD_DATETIME)
+    v = record.get("has_creator")
+    if v is not None:
+        yield s, "http://rdfs.org/sioc/ns#has_creator", expand(_id(v))
+    v = record.get("has_container")
+    if v is not None:
+        yield s, "http://rdfs.org/sioc/ns#has_container", expand(_id(v))
+    v = record.get("reply_to")
+    if v is not None:
+        yield s, "http://rdfs.org/sioc/ns#reply_of", expand(_id(v))
+    for v in _items(record.get("links_to") or ()):
+        yield s, "http://rdfs.org/sioc/ns#links_to", expand(_id(v))
+    v = record.get("forwards")
+    if v is not None:
+        yield s, "https://example.org/telegram/forwards", Literal(str(int(v)), XSD_INTEGER)
+    v = record.get("pinned")
+    if v is not None:
+        yield s, "https://example.org/telegram/pinned", Literal("true" if v else "false", XSD_BOOLEAN)
+    for v in _items(record.get("topics") or ()):
+        yield s, "http://rdfs.org/sioc/ns#topic", Literal(v)
+    for v in _items(record.get("mentions") or ()):
+        yield s, "https://example.org/telegram/mentions", Literal(v)
+    for v in _items(record.get("entity_links") or ()):
+        yield s, "http://rdfs.org/sioc/ns#links_to", expand(_id(v))
@@ -0,0 +1,153 @@
+"""
+Insertion-ordered tables that move to disk past a memory budget.
+
+`SpillTable` behaves like the dicts `build_rows` fills: keys keep the
+position of their first `add` and values are the last one added. While the
+tables sharing a `MemoryBudget` fit in it they are plain dicts. Past it, the
+largest one spills: its entries, and every later `add`, are appended as
+`[seq, key, value]` lines to one of `FANOUT` files picked by hashing the key.
+
+Reading back dedups each partition on its own (re-splitting any that is
+still too large for the budget) and merges the partitions on `seq`, the
+position of each key's first occurrence. The result is the same order and
+values the dict would have held, with memory bounded by the largest
+partition instead of the whole table.
+"""
+
+import heapq
+import os
+import shutil
+import tempfile
+from collections.abc import Iterator
+from typing import Any, TextIO
+
+from builder.jsonl import dumps, loads
+
+FANOUT = 64
+# Partitions still over budget after this many splits (a few very hot keys) are loaded anyway.
+MAX_DEPTH = 3
+# Rough per-entry cost of a dict slot and two str objects, on top of their characters
+ENTRY_OVERHEAD = 120
+
+
+class MemoryBudget:
+    """Approximate bytes held in memory by the tables sharing it."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.tables: list["SpillTable"] = []
+
+    def grow(self, n: int) -> None:
+        self.used += n
+        if self.used > self.limit:
+            max(self.tables, key=lambda t: t.bytes).spill()
+
+
+class SpillTable:
+    """An insertion-ordered `key -> value` table (last value wins) within a `MemoryBudget`."""
+
+    def __init__(self, budget: MemoryBudget, tmp_dir: str | None = None):
+        self.budget = budget
+        self.tmp_dir = tmp_dir
+        self.mem: dict[str, str] = {}
+        self.bytes = 0
+        self.dir: str | None = None
+        self.parts: list[TextIO] = []
+        self.seq = 0
+        budget.tables.append(self)
+
+    @property
+    def spilled(self) -> bool:
+        return self.dir is not None
+
+    def add(self, key: str, value: str = "") -> None:
+        if self.dir is not None:
+            self.parts[hash(key) % FANOUT].write(dumps([self.seq, key, value]) + "\n")
+            self.seq += 1
+            return
+        old = self.mem.get(key)
+        n = len(key) + len(value) + ENTRY_OVERHEAD if old is None else len(value) - len(old)
+        self.mem[key] = value
+        self.bytes += n
+        self.budget.grow(n)
+
+    def spill(self) -> None:
+        """Move the table to disk; later `add`s are appended there too."""
+        if self.dir is not None:
+            return
+        self.dir = tempfile.mkdtemp(prefix=".spill-", dir=self.tmp_dir)
+        self.parts = [open(os.path.join(self.dir, f"{i:02d}"), "w", encoding="utf-8") for i in range(FANOUT)]
+        mem, self.mem = self.mem, {}
+        self.budget.used -= self.bytes
+        self.bytes = 0
+        for key, value in mem.items():
+            self.add(key, value)
+
+    def items(self) -> Iterator[tuple[str, str]]:
+        """Entries in first-seen order, each with its last value."""
+        if self.dir is None:
+            yield from self.mem.items()
+            return
+        for f in self.parts:
+            f.close()
+        paths = [self._dedup(f.name, 1) for f in self.parts]
+        files = [open(p, "r", encoding="utf-8") for p in paths]
+        try:
+            for _, key, value in heapq.merge(*(map(loads, f) for f in files), key=_seq):
+                yield key, value
+        finally:
+            for f in files:
+                f.close()
+
+    def _dedup(self, path: str, depth: int) -> str:
+        """Write the entries of partition `path` once each, in first-seen order; returns the file written."""
+        out = path + ".dedup"
+        # Loaded entries take roughly twice their size on disk.
+        if os.path.getsize(path) * 2 > self.budget.limit and depth < MAX_DEPTH:
+            subs = [open(f"{path}.{i:02d}", "w", encoding="utf-8") for i in range(FANOUT)]
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    subs[hash((depth, loads(line)[1])) % FANOUT].write(line)
+            for sub in subs:
+                sub.close()
+            deduped = [open(self._dedup(sub.name, depth + 1), "r", encoding="utf-8") for sub in subs]
+            with open(out, "w", encoding="utf-8") as f_out:
+                for line in heapq.merge(*deduped, key=lambda line: _seq(loads(line))):
+                    f_out.write(line)
+            for f in deduped:
+                f.close()
+            return out
+
+        # Lines are in `seq` order, so the dict keeps first-seen order.
+        entries: dict[str, list[Any]] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                seq, key, value = loads(line)
+                entry = entries.get(key)
+                if entry is None:
+                    entries[key] = [seq, value]
+                else:
+                    entry[1] = value
+        with open(out, "w", encoding="utf-8") as f:
+            for key, (seq, value) in entries.items():
+                f.write(dumps([seq, key, value]) + "\n")
+        return out
+
+    def close(self) -> None:
+        self.budget.tables.remove(self)
+        self.budget.used -= self.bytes
+        for f in self.parts:
+            f.close()
+        if self.dir is not None:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self) -> "SpillTable":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def _seq(entry: list[Any]) -> int:
+    return entry[0]
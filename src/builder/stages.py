@@ -0,0 +1,208 @@
+"""
+Stage cache for the batch pipeline.
+
+Each stage is fingerprinted from its inputs, the pipeline code (the stage's
+script plus the `builder` package) and the schema. A stage whose fingerprint
+matches the last successful run, and whose outputs are still in place, is
+skipped and its outputs are reused.
+
+File digests are cached by (size, mtime), so a no-op rerun does not re-hash
+large unchanged files.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import Any
+
+from builder.jsonl import existing_jsonl
+
+SCHEMA = "schemas/sioc_min.yaml"
+BUILDER_SRC = os.path.dirname(os.path.abspath(__file__))
+CACHE_FILE = "data/.stage-cache.json"
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    script: str
+    inputs: tuple[str, ...]
+    # Files or directories; those that exist after the run are recorded
+    outputs: tuple[str, ...]
+    args: tuple[str, ...] = ()
+    uses_schema: bool = False
+    # False for outputs that change on their own (the store compacts); only presence is checked
+    hash_outputs: bool = True
+
+
+STAGES = [
+    Stage(
+        "canonicalize",
+        "scripts/canonicalize_last_7_days.py",
+        # The single-entity extract and the per-chat shards of a multi-entity one (see extract_last_7_days.py)
+        inputs=("data/raw/messages_last_7_days.jsonl", "data/raw/messages"),
+        outputs=("data/raw/canonical_last_7_days.jsonl",),
+    ),
+    Stage(
+        "transform",
+        "scripts/transform_to_linkml.py",
+        inputs=("data/raw/canonical_last_7_days.jsonl",),
+        outputs=("data/raw/linkml_graph.json", "data/raw/linkml", "data/oxigraph/threads"),
+        uses_schema=True,
+    ),
+    Stage(
+        "dump-rdf",
+        "scripts/dump_rdf.py",
+        inputs=("data/raw/linkml_graph.json", "data/raw/linkml"),
+        outputs=("data/rdf/sioc_graph.ttl",),
+        uses_schema=True,
+    ),
+    Stage(
+        "load-oxigraph",
+        "scripts/load_into_oxigraph.py",
+        inputs=("data/rdf/sioc_graph.ttl",),
+        outputs=("data/oxigraph/store", "data/oxigraph/search.sqlite"),
+        hash_outputs=False,
+    ),
+]
+
+STAGES_BY_NAME = {s.name: s for s in STAGES}
+
+
+class DigestCache:
+    def __init__(self, entries: dict[str, list[Any]] | None = None):
+        # path -> [size, mtime_ns, sha256]
+        self.entries = entries or {}
+
+    def file(self, path: str) -> str:
+        st = os.stat(path)
+        cached = self.entries.get(path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self.entries[path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def path(self, path: str) -> str | None:
+        """Digest of a file, or of every file under a directory; None if missing."""
+        path = existing_jsonl(path) if path.endswith(".jsonl") else path
+        if os.path.isfile(path):
+            return self.file(path)
+        if not os.path.isdir(path):
+            return None
+        h = hashlib.sha256()
+        for p in sorted(glob.glob(os.path.join(path, "**", "*"), recursive=True)):
+            if os.path.isfile(p):
+                h.update(os.path.relpath(p, path).encode("utf-8"))
+                h.update(self.file(p).encode("ascii"))
+        return h.hexdigest()
+
+
+def load_cache(path: str = CACHE_FILE) -> dict[str, Any]:
+    if not os.path.exists(path):
+        return {"stages": {}, "files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_cache(cache: dict[str, Any], path: str = CACHE_FILE) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def code_files(stage: Stage) -> list[str]:
+    return [stage.script, *sorted(glob.glob(os.path.join(BUILDER_SRC, "*.py")))]
+
+
+def fingerprint(stage: Stage, digests: DigestCache) -> str:
+    parts: dict[str, Any] = {
+        "args": list(stage.args),
+        "inputs": {p: digests.path(p) for p in stage.inputs},
+        "code": {os.path.basename(p): digests.path(p) for p in code_files(stage)},
+    }
+    if stage.uses_schema:
+        parts["schema"] = digests.path(SCHEMA)
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+PRESENT = "present"
+
+
+def _present(path: str) -> bool:
+    path = existing_jsonl(path) if path.endswith(".jsonl") else path
+    if os.path.isdir(path):
+        return bool(os.listdir(path))
+    return os.path.exists(path)
+
+
+def record_outputs(stage: Stage, digests: DigestCache) -> dict[str, str | None]:
+    out: dict[str, str | None] = {}
+    for p in stage.outputs:
+        if _present(p):
+            out[p] = digests.path(p) if stage.hash_outputs else PRESENT
+    return out
+
+
+def outputs_intact(recorded: dict[str, str | None], digests: DigestCache) -> bool:
+    if not recorded:
+        return False
+    return all(_present(p) if d == PRESENT else digests.path(p) == d for p, d in recorded.items())
+
+
+def run_stages(
+    names: list[str], force: bool = False, dry_run: bool = False, profile: bool = False
+) -> list[tuple[str, str]]:
+    """
+    Run the named stages in order, skipping those whose fingerprint is unchanged.
+
+    `profile` passes `--profile` to the stages that run; it does not affect
+    fingerprints. Returns `(stage, "ran" | "skipped" | "would run")` for each stage.
+    """
+    cache = load_cache()
+    digests = DigestCache(cache.get("files"))
+    report: list[tuple[str, str]] = []
+    # In a dry run nothing is rebuilt, so everything after a stale stage is assumed stale too.
+    upstream_stale = False
+
+    for name in names:
+        stage = STAGES_BY_NAME[name]
+        fp = fingerprint(stage, digests)
+        prev = cache["stages"].get(name, {})
+
+        fresh = prev.get("fingerprint") == fp and outputs_intact(prev.get("outputs", {}), digests)
+        if fresh and not force and not upstream_stale:
+            report.append((name, "skipped"))
+            print(f"[{name}] unchanged, reusing cached output")
+            continue
+
+        if dry_run:
+            upstream_stale = True
+            report.append((name, "would run"))
+            print(f"[{name}] would run")
+            continue
+
+        print(f"[{name}] running {stage.script}")
+        subprocess.run([sys.executable, stage.script, *stage.args, *(["--profile"] if profile else [])], check=True)
+
+        # Inputs can't change while we run, but outputs (and the code) are re-read.
+        cache["stages"][name] = {"fingerprint": fp, "outputs": record_outputs(stage, digests)}
+        cache["files"] = digests.entries
+        save_cache(cache)
+        report.append((name, "ran"))
+
+    cache["files"] = digests.entries
+    if not dry_run:
+        save_cache(cache)
+    return report
@@ -0,0 +1,487 @@
+"""
+Oxigraph loading helpers.
+
+Quads produced by `builder.rdf` are converted to pyoxigraph terms on the fly
+and fed to `Store.bulk_extend`, so nothing is materialized in memory or on disk.
+"""
+
+import hashlib
+import os
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from itertools import batched
+from typing import Any, cast
+
+from pyoxigraph import Literal as OxLiteral
+from pyoxigraph import NamedNode, Quad, Store
+
+from builder.aggregates import POST_COUNT, REPLY_COUNT, STATS_OF, TRACKED, Key, StatsCollector, key_node, key_triples, stats_graph
+from builder.rdf import (
+    DOC_COMMUNITY,
+    DOC_LINKS,
+    DOC_POSTS,
+    DOC_USERS,
+    GRAPH_DOCUMENT,
+    LINK,
+    POST,
+    PREFIXES,
+    RDF_TYPE,
+    USER_ACCOUNT,
+    Literal,
+    Quad as QuadT,
+    Triple,
+    escape_iri,
+    expand,
+    nt_iri,
+    nt_term,
+    post_triples,
+)
+from builder.transform import WINDOW, community_id, graph_id, post_id, post_record
+
+
+def to_node(iri: str) -> NamedNode:
+    return NamedNode(escape_iri(iri))
+
+
+def to_term(term: "str | Literal") -> "NamedNode | OxLiteral":
+    if isinstance(term, Literal):
+        if term.datatype is None:
+            return OxLiteral(term.lexical)
+        return OxLiteral(term.lexical, datatype=to_node(term.datatype))
+    return to_node(term)
+
+
+def to_quads(quads: Iterable[QuadT], stats: Counter[str]) -> Iterator[Quad]:
+    """Convert quads to pyoxigraph, counting them per graph into `stats`."""
+    # Predicates and graph names repeat on every quad; build each node once.
+    nodes: dict[str, NamedNode] = {}
+
+    def cached(iri: str) -> NamedNode:
+        node = nodes.get(iri)
+        if node is None:
+            node = nodes[iri] = to_node(iri)
+        return node
+
+    for s, p, o, g in quads:
+        yield Quad(to_node(s), cached(p), to_term(o), cached(g))
+        stats[g] += 1
+
+
+def clear_graphs(store: Store, graphs: Iterable[str]) -> None:
+    """Empty `graphs` and their content-hash graphs, ahead of reloading them."""
+    for g in graphs:
+        store.clear_graph(to_node(g))
+        store.clear_graph(to_node(hash_graph(g)))
+
+
+def replacing_chats(store: Store, records: Iterable[dict[str, Any]], window: str = WINDOW) -> Iterator[dict[str, Any]]:
+    """
+    Pass `records` through, clearing each chat's window graph and stats graph
+    (see `clear_graphs`) when its first record arrives, i.e. before the bulk
+    loader has seen any of its quads. Saves a pass to collect the chats first.
+    """
+    chats: set[str] = set()
+    for obj in records:
+        if obj["chat_id"] not in chats:
+            chats.add(obj["chat_id"])
+            graph = expand(graph_id(obj["chat_id"], window))
+            clear_graphs(store, [graph, stats_graph(graph)])
+        yield obj
+
+
+def bulk_load_quads(store: Store, quads: Iterable[QuadT], replace: Iterable[str] = ()) -> Counter[str]:
+    """
+    Bulk-load quads into `store` and return the number of quads fed per graph.
+
+    Graphs listed in `replace` are cleared first (with their content hashes),
+    so reloading a community's window does not leave stale triples behind.
+    """
+    clear_graphs(store, replace)
+
+    stats: Counter[str] = Counter()
+    store.bulk_extend(to_quads(quads, stats))
+    return stats
+
+
+# --- Incremental upsert ---
+#
+# The graph is split into units: one per post (its own triples plus the
+# document's `tg:posts` edge to it) and one header per document (type,
+# community, user and link tables). Each unit's content hash is kept in a
+# companion graph, so a refresh only rewrites the units whose hash changed.
+
+HASH_PREDICATE = PREFIXES["tg"] + "contentHash"
+# Changed units per SPARQL UPDATE when an upsert is too large for one
+UPSERT_BATCH = 10_000
+
+Unit = tuple[str, str, list[Triple]]  # (graph, key subject, triples)
+
+
+def hash_graph(graph: str) -> str:
+    return f"{graph}#content-hash"
+
+
+def graph_units(records: Iterable[dict[str, Any]], window: str = WINDOW) -> Iterator[Unit]:
+    """Group the triples of `graph_quads` into post units, then one header unit per document."""
+    # document IRI -> header triples (dict as an ordered set)
+    headers: dict[str, dict[Triple, None]] = {}
+    for obj in records:
+        chat_id = obj["chat_id"]
+        doc = expand(graph_id(chat_id, window))
+        header = headers.get(doc)
+        if header is None:
+            header = headers[doc] = dict.fromkeys(
+                [(doc, RDF_TYPE, GRAPH_DOCUMENT), (doc, DOC_COMMUNITY, expand(community_id(chat_id)))]
+            )
+
+        record = post_record(obj)
+        if record["has_creator"] is not None:
+            u = expand(record["has_creator"])
+            header.update(dict.fromkeys([(doc, DOC_USERS, u), (u, RDF_TYPE, USER_ACCOUNT)]))
+        for url in record["links_to"] or []:
+            link = expand(url)
+            header.update(dict.fromkeys([(doc, DOC_LINKS, link), (link, RDF_TYPE, LINK)]))
+
+        post = expand(record["id"])
+        yield doc, post, [(doc, DOC_POSTS, post), *post_triples(record)]
+
+    for doc, header in headers.items():
+        yield doc, doc, list(header)
+
+
+def unit_hash(triples: Iterable[Triple]) -> str:
+    lines = sorted({f"{nt_iri(s)} {nt_iri(p)} {nt_term(o)} ." for s, p, o in triples})
+    return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+
+
+def stored_hashes(store: Store, graph: str, keys: Iterable[str] | None = None) -> dict[str, str]:
+    """Unit hashes stored for `graph`, all of them or only those of `keys`."""
+    values = f"VALUES ?s {{ {_values(keys)} }} " if keys is not None else ""
+    q = f"SELECT ?s ?h WHERE {{ {values}GRAPH {nt_iri(hash_graph(graph))} {{ ?s {nt_iri(HASH_PREDICATE)} ?h }} }}"
+    return {row["s"].value: row["h"].value for row in cast(Iterable[Any], store.query(q))}
+
+
+@dataclass
+class UpsertStats:
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    triples: int = 0  # triples written
+    aggregates: int = 0  # aggregate counts rewritten (see builder.aggregates)
+
+    def __str__(self) -> str:
+        return (
+            f"{self.inserted} inserted, {self.updated} updated, {self.unchanged} unchanged, "
+            f"{self.deleted} deleted units ({self.triples} triples written, {self.aggregates} aggregates updated)"
+        )
+
+
+def _values(iris: Iterable[str]) -> str:
+    return " ".join(nt_iri(i) for i in iris)
+
+
+def from_term(term: Any) -> "str | Literal":
+    if isinstance(term, OxLiteral):
+        return Literal(term.value, term.datatype.value)
+    return term.value
+
+
+def has_stats(store: Store, graph: str) -> bool:
+    stats = to_node(stats_graph(graph))
+    return next(iter(store.quads_for_pattern(stats, to_node(STATS_OF), to_node(graph), stats)), None) is not None
+
+
+def has_document(store: Store, graph: str) -> bool:
+    g = to_node(graph)
+    return next(iter(store.quads_for_pattern(g, to_node(RDF_TYPE), to_node(GRAPH_DOCUMENT), g)), None) is not None
+
+
+def stored_post_pairs(store: Store, graph: str, posts: list[str]) -> dict[str, list[tuple[str, "str | Literal"]]]:
+    """The aggregate-relevant (predicate, object) pairs of `posts` as currently stored in `graph`."""
+    out: dict[str, list[tuple[str, str | Literal]]] = {}
+    if not posts:
+        return out
+    q = (
+        f"SELECT ?s ?p ?o WHERE {{ VALUES ?s {{ {_values(posts)} }} VALUES ?p {{ {_values(TRACKED)} }} "
+        f"GRAPH {nt_iri(graph)} {{ ?s ?p ?o }} }}"
+    )
+    for row in cast(Iterable[Any], store.query(q)):
+        out.setdefault(row["s"].value, []).append((row["p"].value, from_term(row["o"])))
+    return out
+
+
+def stats_ops(store: Store, graph: str, deltas: Counter[Key], rebuild: bool) -> tuple[list[str], int]:
+    """SPARQL UPDATE operations applying `deltas` to the stats graph of `graph` (or rebuilding it)."""
+    stats = stats_graph(graph)
+    sg = nt_iri(stats)
+    if rebuild:
+        counts = {k: n for k, n in deltas.items() if n > 0}
+        ops = [f"CLEAR SILENT GRAPH {sg}"]
+    else:
+        changed = [k for k, n in deltas.items() if n != 0]
+        if not changed:
+            return [], 0
+        nodes = {key_node(stats, k): k for k in changed}
+        current: dict[Key, int] = {}
+        q = (
+            f"SELECT ?s ?p ?n WHERE {{ VALUES ?s {{ {_values(nodes)} }} VALUES ?p {{ {_values([POST_COUNT, REPLY_COUNT])} }} "
+            f"GRAPH {sg} {{ ?s ?p ?n }} }}"
+        )
+        for row in cast(Iterable[Any], store.query(q)):
+            current[nodes[row["s"].value]] = int(row["n"].value)
+        counts = {k: current.get(k, 0) + deltas[k] for k in changed}
+        ops = [f"DELETE {{ GRAPH {sg} {{ ?s ?p ?o }} }} WHERE {{ VALUES ?s {{ {_values(nodes)} }} GRAPH {sg} {{ ?s ?p ?o }} }}"]
+
+    data = [f"{nt_iri(stats)} {nt_iri(STATS_OF)} {nt_iri(graph)} ."] if rebuild else []
+    for key, n in counts.items():
+        if n > 0:
+            data.extend(f"{nt_iri(s)} {nt_iri(p)} {nt_term(o)} ." for s, p, o in key_triples(stats, key, n))
+    if data:
+        ops.append(f"INSERT DATA {{ GRAPH {sg} {{ {' '.join(data)} }} }}")
+    return ops, len(counts)
+
+
+def upsert_records(
+    store: Store, records: Callable[[], Iterable[dict[str, Any]]], batch_size: int = UPSERT_BATCH
+) -> UpsertStats:
+    """
+    Bring the named graphs covered by `records` in line with it, touching only changed units.
+
+    `records` is called twice (hash pass, then write pass), so it must return a
+    fresh iterator each time. Within a graph, posts missing from the input are
+    deleted; later duplicates of a post (e.g. edits appended by incremental
+    extraction) win. The aggregates in each graph's stats graph are adjusted
+    by what the removed and rewritten posts counted for, or rebuilt if the
+    graph has none yet.
+
+    Up to `batch_size` changed units are applied in one SPARQL UPDATE, i.e.
+    one transaction. Larger changes (a first load, a window whose posts all
+    changed) are sent in updates of at most `batch_size` units, so no request
+    holds the whole input. Their graphs' aggregates are dropped by the first
+    update and rebuilt by the last: a run interrupted in between leaves units
+    without hashes and graphs without aggregates, which the next run rewrites
+    and rebuilds.
+    """
+    # Pass 1: hash every unit of the input and compare with the stored hashes.
+    wanted: dict[str, dict[str, str]] = {}
+    for graph, key, triples in graph_units(records()):
+        wanted.setdefault(graph, {})[key] = unit_hash(triples)
+
+    stats = UpsertStats()
+    changed: dict[str, dict[str, str]] = {}
+    gone: dict[str, list[str]] = {}
+    for graph, hashes in wanted.items():
+        current = stored_hashes(store, graph)
+        changed[graph] = {}
+        for key, h in hashes.items():
+            old = current.get(key)
+            if old == h:
+                stats.unchanged += 1
+                continue
+            if old is None:
+                stats.inserted += 1
+            else:
+                stats.updated += 1
+            changed[graph][key] = h
+        gone[graph] = [key for key in current if key not in hashes]
+        stats.deleted += len(gone[graph])
+    split = sum(len(changed[g]) + len(gone[g]) for g in wanted) > batch_size
+
+    ops: list[str] = []
+    deltas = StatsCollector()
+    rebuild: set[str] = set()
+    for graph in wanted:
+        deltas.counts[graph] = Counter()
+        if split or not has_stats(store, graph):
+            rebuild.add(graph)
+        stale = [key for key in [*changed[graph], *gone[graph]] if key != graph]
+        if graph not in rebuild:
+            # Take back what the old versions of these posts counted for.
+            for pairs in stored_post_pairs(store, graph, stale).values():
+                deltas.add(graph, pairs, sign=-1)
+        g, hg = nt_iri(graph), nt_iri(hash_graph(graph))
+        for chunk in batched(stale, batch_size):
+            values = _values(chunk)
+            ops.append(f"DELETE {{ GRAPH {g} {{ ?s ?p ?o }} }} WHERE {{ VALUES ?s {{ {values} }} GRAPH {g} {{ ?s ?p ?o }} }}")
+            ops.append(
+                f"DELETE {{ GRAPH {g} {{ ?d {nt_iri(DOC_POSTS)} ?s }} }} "
+                f"WHERE {{ VALUES ?s {{ {values} }} GRAPH {g} {{ ?d {nt_iri(DOC_POSTS)} ?s }} }}"
+            )
+        if graph in changed[graph]:
+            # Header unit: everything about the document except its post edges, plus user/link types.
+            ops.append(
+                f"DELETE {{ GRAPH {g} {{ {g} ?p ?o }} }} WHERE {{ GRAPH {g} {{ {g} ?p ?o FILTER(?p != {nt_iri(DOC_POSTS)}) }} }}"
+            )
+            ops.append(
+                f"DELETE {{ GRAPH {g} {{ ?x a ?c }} }} "
+                f"WHERE {{ VALUES ?c {{ {_values([USER_ACCOUNT, LINK])} }} GRAPH {g} {{ ?x a ?c }} }}"
+            )
+        for chunk in batched([*changed[graph], *gone[graph]], batch_size):
+            values = _values(chunk)
+            ops.append(f"DELETE {{ GRAPH {hg} {{ ?s ?p ?o }} }} WHERE {{ VALUES ?s {{ {values} }} GRAPH {hg} {{ ?s ?p ?o }} }}")
+
+    if split:
+        # Aggregates go first, so an interrupted run always leaves them to be rebuilt. Then the deletes,
+        # each its own update: a rewritten post loses its old triples, then gets the new ones.
+        store.update(" ;\n".join(f"CLEAR SILENT GRAPH {nt_iri(stats_graph(g))}" for g in wanted))
+        for op in ops:
+            store.update(op)
+        ops = []
+
+    # Pass 2: regenerate only the changed units and insert them with their new hashes.
+    # Graphs without aggregates also count their unchanged posts, to rebuild them.
+    data: list[str] = []  # one entry per unit
+    written: set[tuple[str, str]] = set()
+    for graph, key, triples in graph_units(records()):
+        h = changed[graph].get(key)
+        counting = key != graph and (h is not None or graph in rebuild)
+        if (h is None and not counting) or (graph, key) in written or unit_hash(triples) != (h or wanted[graph][key]):
+            continue  # unchanged, already done, or an earlier duplicate
+        written.add((graph, key))
+        if counting:
+            deltas.add(graph, [(p, o) for s, p, o in triples if s == key])
+        if h is None:
+            continue
+        g = nt_iri(graph)
+        unit = [f"GRAPH {g} {{ {nt_iri(s)} {nt_iri(p)} {nt_term(o)} }}" for s, p, o in triples]
+        unit.append(f'GRAPH {nt_iri(hash_graph(graph))} {{ {nt_iri(key)} {nt_iri(HASH_PREDICATE)} "{h}" }}')
+        data.append(" ".join(unit))
+        stats.triples += len(triples)
+        if split and len(data) >= batch_size:
+            store.update("INSERT DATA { " + " ".join(data) + " }")
+            data = []
+
+    if data:
+        ops.append("INSERT DATA { " + " ".join(data) + " }")
+    for graph, counts in deltas.counts.items():
+        agg_ops, n = stats_ops(store, graph, counts, rebuild=graph in rebuild)
+        ops.extend(agg_ops)
+        stats.aggregates += n
+    if ops:
+        store.update(" ;\n".join(ops))
+    return stats
+
+
+def apply_changes(
+    store: Store, records: Iterable[dict[str, Any]], deleted: Iterable[tuple[str, int]] = (), window: str = WINDOW
+) -> UpsertStats:
+    """
+    Apply a micro-batch of post changes in one SPARQL UPDATE (one transaction).
+
+    Unlike `upsert_records`, only the posts named here are touched: canonical
+    `records` insert or replace their post, and `deleted` (chat_id,
+    message_id) pairs remove theirs. Users and links the new posts reference
+    are added to their document; those tables never shrink here, the next
+    `--upsert` run reconciles them. Aggregates are adjusted in graphs that
+    have them. Callers resolve the order of events first: a post should not
+    be both in `records` and `deleted`. `window` picks the graphs (see `graph_id`).
+    """
+    # graph -> {post: triples} (later records win) and graph -> posts to delete
+    units: dict[str, dict[str, list[Triple]]] = {}
+    headers: dict[str, list[Triple]] = {}
+    for graph, key, triples in graph_units(records, window):
+        if key == graph:
+            headers[graph] = triples
+        else:
+            units.setdefault(graph, {})[key] = triples
+    gone: dict[str, list[str]] = {}
+    for chat_id, message_id in deleted:
+        gone.setdefault(expand(graph_id(chat_id, window)), []).append(expand(post_id(chat_id, message_id)))
+
+    stats = UpsertStats()
+    ops: list[str] = []
+    data: list[str] = []
+    deltas = StatsCollector()
+    for graph in dict.fromkeys([*units, *gone]):
+        posts, removed = units.get(graph, {}), gone.get(graph, [])
+        g, hg = nt_iri(graph), nt_iri(hash_graph(graph))
+        keys = [*posts, *removed]
+        # Posts loaded with --bulk have no hashes yet, so look for their triples too.
+        q = f"SELECT ?s WHERE {{ VALUES ?s {{ {_values(keys)} }} GRAPH {g} {{ ?s a {nt_iri(POST)} }} }}"
+        present = {row["s"].value for row in cast(Iterable[Any], store.query(q))}
+        current = stored_hashes(store, graph, keys)
+
+        changed: dict[str, str] = {}
+        for key, triples in posts.items():
+            h = unit_hash(triples)
+            if key in present and current.get(key) == h:
+                stats.unchanged += 1
+                continue
+            if key in present:
+                stats.updated += 1
+            else:
+                stats.inserted += 1
+            changed[key] = h
+        removed = [key for key in removed if key in present]
+        stats.deleted += len(removed)
+
+        counting = has_stats(store, graph)
+        # A graph this batch creates gets its aggregates built from scratch; one loaded
+        # without them is left for `upsert_records` to rebuild.
+        rebuild = not counting and not has_document(store, graph)
+        stale = [key for key in [*changed, *removed] if key in present]
+        if stale:
+            if counting:
+                for pairs in stored_post_pairs(store, graph, stale).values():
+                    deltas.add(graph, pairs, sign=-1)
+            values = _values(stale)
+            ops.append(f"DELETE {{ GRAPH {g} {{ ?s ?p ?o }} }} WHERE {{ VALUES ?s {{ {values} }} GRAPH {g} {{ ?s ?p ?o }} }}")
+            ops.append(
+                f"DELETE {{ GRAPH {g} {{ ?d {nt_iri(DOC_POSTS)} ?s }} }} "
+                f"WHERE {{ VALUES ?s {{ {values} }} GRAPH {g} {{ ?d {nt_iri(DOC_POSTS)} ?s }} }}"
+            )
+        if changed or removed:
+            values = _values([*changed, *removed])
+            ops.append(f"DELETE {{ GRAPH {hg} {{ ?s ?p ?o }} }} WHERE {{ VALUES ?s {{ {values} }} GRAPH {hg} {{ ?s ?p ?o }} }}")
+
+        for key, h in changed.items():
+            triples = posts[key]
+            if counting or rebuild:
+                deltas.add(graph, [(p, o) for s, p, o in triples if s == key])
+            data.extend(f"GRAPH {g} {{ {nt_iri(s)} {nt_iri(p)} {nt_term(o)} }}" for s, p, o in triples)
+            data.append(f'GRAPH {hg} {{ {nt_iri(key)} {nt_iri(HASH_PREDICATE)} "{h}" }}')
+            stats.triples += len(triples)
+        if changed and graph in headers:
+            # Header triples only ever grow here; inserting ones already stored is a no-op.
+            data.extend(f"GRAPH {g} {{ {nt_iri(s)} {nt_iri(p)} {nt_term(o)} }}" for s, p, o in headers[graph])
+        if counting or (rebuild and changed):
+            agg_ops, n = stats_ops(store, graph, deltas.counts.get(graph, Counter()), rebuild=rebuild)
+            ops.extend(agg_ops)
+            stats.aggregates += n
+
+    # Deletes first: a rewritten post loses its old triples, then gets the new ones.
+    if data:
+        ops.append("INSERT DATA { " + " ".join(data) + " }")
+    if ops:
+        store.update(" ;\n".join(ops))
+    return stats
+
+
+# --- Store generation ---
+#
+# A counter next to the store directory, bumped by every load. Readers that
+# keep the store open (or cache query results) compare it to notice reloads.
+
+
+def generation_path(store_dir: str) -> str:
+    return os.path.normpath(store_dir) + ".generation"
+
+
+def read_generation(store_dir: str) -> int:
+    try:
+        with open(generation_path(store_dir), "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def bump_generation(store_dir: str) -> int:
+    gen = read_generation(store_dir) + 1
+    path = generation_path(store_dir)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(f"{gen}\n")
+    os.replace(tmp, path)
+    return gen
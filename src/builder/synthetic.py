@@ -0,0 +1,171 @@
+"""
+Deterministic synthetic Telegram corpus.
+
+Produces dicts shaped like Telethon's `Message.to_dict()` after the
+`json.dumps(..., default=str)` round trip done by the extractor, so the
+output can stand in for `messages_last_7_days.jsonl` in benchmarks.
+
+Distributions are rough but realistic: a few users write most messages
+(Pareto), about a third of messages are replies to recent ones, and
+hashtags, mentions, URLs and emoji show up at everyday rates.
+"""
+
+import json
+import random
+from collections.abc import Iterator
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from builder.jsonl import open_jsonl, target_jsonl
+
+WORDS = (
+    "the a to and of in is for on that it with this we be are have you not at "
+    "graph node data community meeting tomorrow link paper idea model thanks "
+    "great agree question release build deploy schema query store python"
+).split()
+EMOJI = ["😀", "🚀", "👍", "🔥", "🎉", "🤔", "❤️", "✅"]
+DOMAINS = ["github.com", "arxiv.org", "example.org", "docs.python.org", "t.me", "youtube.com", "fly.io"]
+
+P_REPLY = 0.3
+P_HASHTAG = 0.1
+P_MENTION = 0.08
+P_URL = 0.15
+P_BARE_DOMAIN = 0.03  # detected by Telegram as MessageEntityUrl without a scheme
+P_TEXT_URL = 0.03
+P_EMOJI = 0.2
+P_FORWARDED = 0.05
+P_PINNED = 0.002
+
+
+def _utf16_len(s: str) -> int:
+    return len(s.encode("utf-16-le")) // 2
+
+
+class _TextBuilder:
+    def __init__(self) -> None:
+        self.parts: list[str] = []
+        self.units = 0  # UTF-16 length so far
+        self.entities: list[dict[str, Any]] = []
+
+    def add(self, token: str, entity: dict[str, Any] | None = None) -> None:
+        if self.parts:
+            self.parts.append(" ")
+            self.units += 1
+        if entity is not None:
+            self.entities.append({**entity, "offset": self.units, "length": _utf16_len(token)})
+        self.parts.append(token)
+        self.units += _utf16_len(token)
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def generate_messages(
+    n: int,
+    seed: int = 0,
+    chats: int = 1,
+    users: int = 500,
+    end: datetime = datetime(2026, 1, 8, tzinfo=timezone.utc),
+    span: timedelta = timedelta(days=7),
+) -> Iterator[dict[str, Any]]:
+    """Yield `n` messages, newest first (the order `iter_messages` returns them in)."""
+    rng = random.Random(seed)
+    channel_ids = [1_000_000_000 + 7919 * i for i in range(chats)]
+    step = span / max(n, 1)
+
+    for i in range(n, 0, -1):
+        channel_id = channel_ids[i % chats]
+        date = end - step * (n - i)
+
+        # Per-message features, each inserted at a random position among the words.
+        tokens: list[tuple[str, dict[str, Any] | None]] = [(rng.choice(WORDS), None) for _ in range(rng.randint(3, 30))]
+        extras: list[tuple[str, dict[str, Any] | None]] = []
+        if rng.random() < P_EMOJI:
+            extras.append((rng.choice(EMOJI), None))
+        if rng.random() < P_HASHTAG:
+            extras.append((f"#{rng.choice(WORDS)}{rng.randint(0, 50)}", {"_": "MessageEntityHashtag"}))
+        if rng.random() < P_MENTION:
+            extras.append((f"@user{int(rng.paretovariate(1.2)) % users}", {"_": "MessageEntityMention"}))
+        if rng.random() < P_URL:
+            extras.append((f"https://{rng.choice(DOMAINS)}/{rng.randint(1, 10_000)}", {"_": "MessageEntityUrl"}))
+        if rng.random() < P_BARE_DOMAIN:
+            extras.append((rng.choice(DOMAINS), {"_": "MessageEntityUrl"}))
+        for extra in extras:
+            tokens.insert(rng.randint(0, len(tokens)), extra)
+
+        b = _TextBuilder()
+        for token, entity in tokens:
+            b.add(token, entity)
+        if rng.random() < P_TEXT_URL:
+            b.entities.append(
+                {"_": "MessageEntityTextUrl", "offset": 0, "length": 1, "url": f"https://{rng.choice(DOMAINS)}/t/{i}"}
+            )
+
+        reply_to = None
+        # Replies point at a recent message of the same chat (ids are dealt out round-robin).
+        parent = i - chats * (1 + int(rng.expovariate(0.1)))
+        if parent > 0 and rng.random() < P_REPLY:
+            reply_to = {
+                "_": "MessageReplyHeader",
+                "reply_to_scheduled": False,
+                "forum_topic": False,
+                "quote": False,
+                "reply_to_msg_id": parent,
+                "reply_to_peer_id": None,
+                "reply_from": None,
+                "reply_media": None,
+                "reply_to_top_id": None,
+                "quote_text": None,
+                "quote_entities": [],
+                "quote_offset": None,
+            }
+
+        user = int(rng.paretovariate(1.16)) % users + 1
+        yield {
+            "_": "Message",
+            "id": i,
+            "peer_id": {"_": "PeerChannel", "channel_id": channel_id},
+            "date": str(date),
+            "message": b.text(),
+            "out": False,
+            "mentioned": False,
+            "media_unread": False,
+            "silent": False,
+            "post": False,
+            "from_scheduled": False,
+            "legacy": False,
+            "edit_hide": False,
+            "pinned": rng.random() < P_PINNED,
+            "noforwards": False,
+            "invert_media": False,
+            "offline": False,
+            "from_id": {"_": "PeerUser", "user_id": 100_000 + user},
+            "from_boosts_applied": None,
+            "saved_peer_id": None,
+            "fwd_from": {"_": "MessageFwdHeader", "date": str(date - timedelta(days=1))} if rng.random() < P_FORWARDED else None,
+            "via_bot_id": None,
+            "via_business_bot_id": None,
+            "reply_to": reply_to,
+            "media": None,
+            "reply_markup": None,
+            "entities": b.entities,
+            "views": None,
+            "forwards": rng.randint(0, 20) if rng.random() < 0.5 else None,
+            "replies": {"_": "MessageReplies", "replies": rng.randint(0, 5), "replies_pts": i, "comments": False},
+            "edit_date": None,
+            "post_author": None,
+            "grouped_id": None,
+            "reactions": None,
+            "restriction_reason": [],
+            "ttl_period": None,
+            "quick_reply_shortcut_id": None,
+            "effect": None,
+            "factcheck": None,
+        }
+
+
+def write_corpus(path: str, n: int, seed: int = 0, chats: int = 1) -> None:
+    """Write `n` messages to `path`, compressed per `KG_COMPRESS` (see `builder.jsonl`)."""
+    with open_jsonl(target_jsonl(path), "w") as f:
+        for msg in generate_messages(n, seed=seed, chats=chats):
+            f.write(json.dumps(msg, ensure_ascii=False) + "\n")
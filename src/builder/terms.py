@@ -0,0 +1,24 @@
+"""
+RDF term types shared by the hand-written emitter (`builder.rdf`) and the
+code generated from the schema (`builder.sioc_triples`).
+"""
+
+from datetime import datetime
+from typing import NamedTuple
+
+
+class Literal(NamedTuple):
+    lexical: str
+    datatype: str | None = None
+
+
+Triple = tuple[str, str, "str | Literal"]
+Quad = tuple[str, str, "str | Literal", str]
+
+
+def normalize_datetime(value: str) -> str:
+    # Same normalization XSDDateTime applies (e.g. "2026-01-01 10:00:00+00:00").
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        return value
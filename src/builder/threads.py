@@ -0,0 +1,284 @@
+"""
+Reply-thread index: parent pointers and child lists in flat int32 buffers.
+
+Built from canonical records during transform and memory-mapped by readers,
+so thread, depth, root and subtree-size lookups avoid recursive SPARQL
+property paths.
+
+Posts get dense ids in depth-first preorder over the reply forest (roots,
+and each node's children, in (chat, message id) order). A post's subtree is
+then the contiguous id range `[id, id + subtree_size)`, and a whole thread is
+the subtree of its root. Replies to messages missing from the input (e.g.
+older than the window) hang under a placeholder node for the missing
+parent, so siblings still share a thread, like `sioc:reply_of*` in SPARQL.
+Placeholders are always roots, since nothing is known about their parents.
+
+Files (native byte order, recorded in `meta.json`):
+
+- `keys.bin`: int64 (chat id, message id) pairs in sorted order
+- `ids.bin`: int32 dense id for each sorted key
+- `key_of.bin`: int64 (chat id, message id) pair per dense id
+- `parent.bin`: int32 parent id, -1 for roots
+- `child_offsets.bin`, `children.bin`: CSR child lists (int32)
+- `depth.bin`, `root.bin`, `subtree.bin`: int32, precomputed per id
+- `present.bin`: uint8, 0 for placeholder nodes
+"""
+
+import json
+import mmap
+import os
+import shutil
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable
+from typing import Any
+
+from builder.rdf import PREFIXES, expand
+from builder.transform import post_id
+
+THREAD_DIR = "data/oxigraph/threads"
+VERSION = 1
+
+_POST_PREFIX = PREFIXES["tg"] + "post/"
+
+
+def post_key(post: str) -> tuple[int, int]:
+    """(chat id, message id) of a post CURIE or IRI."""
+    iri = expand(post)
+    if not iri.startswith(_POST_PREFIX):
+        raise KeyError(post)
+    chat, _, msg = iri[len(_POST_PREFIX) :].rpartition("/")
+    try:
+        return int(chat), int(msg)
+    except ValueError:
+        raise KeyError(post) from None
+
+
+def build_thread_index(records: Iterable[dict[str, Any]], out_dir: str = THREAD_DIR) -> int:
+    """
+    Build the index for canonical `records` into `out_dir`, replacing any
+    previous one atomically. Returns the number of nodes (posts plus
+    placeholders for missing parents).
+    """
+    # (chat, msg) -> parent (chat, msg) or None; dict order is irrelevant, keys get sorted.
+    parents: dict[tuple[int, int], tuple[int, int] | None] = {}
+    for obj in records:
+        chat = int(obj["chat_id"])
+        key = (chat, int(obj["message_id"]))
+        reply_to = obj.get("reply_to_message_id")
+        if key not in parents or parents[key] is None:
+            parents[key] = (chat, int(reply_to)) if reply_to is not None else None
+    present = set(parents)
+    for parent in list(parents.values()):
+        if parent is not None and parent not in parents:
+            parents[parent] = None  # placeholder for a message outside the input
+
+    keys = sorted(parents)
+    rank = {k: i for i, k in enumerate(keys)}
+    n = len(keys)
+
+    # Children per node (in key order), then an iterative preorder walk from each root.
+    kids: list[list[int]] = [[] for _ in range(n)]
+    for k, parent in parents.items():
+        if parent is not None and parent != k:
+            kids[rank[parent]].append(rank[k])
+    for c in kids:
+        c.sort()
+
+    pre = array("i", [-1]) * n  # key rank -> dense id
+    order: list[int] = []  # dense id -> key rank
+
+    def walk(start: int) -> None:
+        stack = [start]
+        while stack:
+            r = stack.pop()
+            if pre[r] != -1:
+                continue  # only reachable through a cycle; already placed
+            pre[r] = len(order)
+            order.append(r)
+            stack.extend(reversed(kids[r]))
+
+    for r, k in enumerate(keys):
+        if parents[k] is None or parents[k] == k:
+            walk(r)
+    for r in range(n):
+        if pre[r] == -1:
+            # Part of a reply cycle (never in real data): cut it here and make this a root.
+            parents[keys[r]] = None
+            walk(r)
+
+    parent = array("i", [-1]) * n
+    for i, r in enumerate(order):
+        p = parents[keys[r]]
+        if p is not None and pre[rank[p]] < i:
+            parent[i] = pre[rank[p]]
+
+    # Children in CSR form; preorder ids make every child list ascending.
+    counts = array("i", [0]) * (n + 1)
+    for i in range(n):
+        if parent[i] >= 0:
+            counts[parent[i] + 1] += 1
+    for i in range(n):
+        counts[i + 1] += counts[i]
+    offsets = array("i", counts)
+    children = array("i", [0]) * counts[n]
+    fill = array("i", counts[:n])
+    for i in range(n):
+        p = parent[i]
+        if p >= 0:
+            children[fill[p]] = i
+            fill[p] += 1
+
+    depth = array("i", [0]) * n
+    root = array("i", range(n))
+    for i in range(n):
+        p = parent[i]
+        if p >= 0:
+            depth[i] = depth[p] + 1
+            root[i] = root[p]
+    subtree = array("i", [1]) * n
+    for i in range(n - 1, -1, -1):
+        if parent[i] >= 0:
+            subtree[parent[i]] += subtree[i]
+
+    sorted_keys = array("q", [x for k in keys for x in k])
+    ids = array("i", (pre[r] for r in range(n)))
+    key_of = array("q", [x for r in order for x in keys[r]])
+    flags = array("B", (keys[r] in present for r in order))
+
+    tmp = f"{out_dir}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    buffers = {
+        "keys": sorted_keys,
+        "ids": ids,
+        "key_of": key_of,
+        "parent": parent,
+        "child_offsets": offsets,
+        "children": children,
+        "depth": depth,
+        "root": root,
+        "subtree": subtree,
+        "present": flags,
+    }
+    for name, buf in buffers.items():
+        with open(os.path.join(tmp, f"{name}.bin"), "wb") as f:
+            buf.tofile(f)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": VERSION, "nodes": n, "posts": len(present), "byteorder": sys.byteorder}, f)
+
+    # Swap directories; readers that still map the old files keep working.
+    old = f"{out_dir}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old)
+    os.rename(tmp, out_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return n
+
+
+class _Keys:
+    """Sorted (chat, msg) pairs as a sequence, for bisect."""
+
+    def __init__(self, flat: memoryview):
+        self.flat = flat
+
+    def __len__(self) -> int:
+        return len(self.flat) // 2
+
+    def __getitem__(self, i: int) -> tuple[int, int]:
+        return self.flat[2 * i], self.flat[2 * i + 1]
+
+
+class ThreadIndex:
+    """Read-only, memory-mapped view of an index written by `build_thread_index`."""
+
+    def __init__(self, path: str = THREAD_DIR):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != VERSION or self.meta.get("byteorder") != sys.byteorder:
+            raise ValueError(f"Incompatible thread index in {path}; rebuild it with transform_to_linkml.py")
+        self.path = path
+        self._maps: list[mmap.mmap] = []
+        self._views: list[memoryview] = []
+
+        self.keys = _Keys(self._map("keys", "q"))
+        self.ids = self._map("ids", "i")
+        self.key_of = self._map("key_of", "q")
+        self.parent = self._map("parent", "i")
+        self.child_offsets = self._map("child_offsets", "i")
+        self.child_ids = self._map("children", "i")
+        self.depths = self._map("depth", "i")
+        self.root = self._map("root", "i")
+        self.subtree = self._map("subtree", "i")
+        self.present = self._map("present", "B")
+
+    def _map(self, name: str, fmt: str) -> memoryview:
+        with open(os.path.join(self.path, f"{name}.bin"), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(array(fmt))  # mmap cannot map empty files
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        base = memoryview(mm)
+        view = base.cast(fmt)
+        self._maps.append(mm)
+        self._views.extend([view, base])
+        return view
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def id_of(self, post: str) -> int:
+        key = post_key(post)
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            raise KeyError(post)
+        return self.ids[i]
+
+    def iri_of(self, i: int) -> str:
+        return expand(post_id(str(self.key_of[2 * i]), self.key_of[2 * i + 1]))
+
+    def parent_of(self, post: str) -> str | None:
+        p = self.parent[self.id_of(post)]
+        return None if p < 0 else self.iri_of(p)
+
+    def children(self, post: str) -> list[str]:
+        i = self.id_of(post)
+        return [self.iri_of(c) for c in self.child_ids[self.child_offsets[i] : self.child_offsets[i + 1]]]
+
+    def root_of(self, post: str) -> str:
+        """Root of the thread; may be a message outside the input (see `is_present`)."""
+        return self.iri_of(self.root[self.id_of(post)])
+
+    def depth(self, post: str) -> int:
+        """Reply hops from `post` up to its root (0 for a root)."""
+        return self.depths[self.id_of(post)]
+
+    def subtree_size(self, post: str) -> int:
+        """Number of posts in the input that are `post` or reply to it, directly or not."""
+        i = self.id_of(post)
+        return self.subtree[i] - (0 if self.present[i] else 1)
+
+    def is_present(self, post: str) -> bool:
+        return bool(self.present[self.id_of(post)])
+
+    def thread_ids(self, post: str) -> range:
+        """Dense ids of the whole thread containing `post`, in preorder (placeholders included)."""
+        r = self.root[self.id_of(post)]
+        return range(r, r + self.subtree[r])
+
+    def thread(self, post: str) -> list[str]:
+        """IRIs of every post in the thread containing `post`, in preorder."""
+        ids = self.thread_ids(post)
+        if not self.present[ids.start]:
+            ids = ids[1:]  # placeholder root
+        return [self.iri_of(i) for i in ids]
+
+    def close(self) -> None:
+        # Views must be released (casts before their base) before the maps can close.
+        for view in self._views:
+            view.release()
+        for mm in self._maps:
+            mm.close()
+        self._views.clear()
+        self._maps.clear()
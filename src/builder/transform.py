@@ -0,0 +1,179 @@
+import re
+from typing import Any
+
+# Characters outside the BMP take two UTF-16 code units (a surrogate pair)
+_ASTRAL_RE = re.compile("[\U00010000-\U0010FFFF]")
+
+
+def community_id(chat_id: str) -> str:
+    return f"tg:community/{chat_id}"
+
+
+def user_id(user_id: int) -> str:
+    return f"tg:user/{user_id}"
+
+
+def post_id(chat_id: str, message_id: int) -> str:
+    return f"tg:post/{chat_id}/{message_id}"
+
+
+def hashtag_topic_iri(tag: str) -> str:
+    # Keep it simple + deterministic; you can URL-encode later if you want.
+    return f"tg:tag/hashtag/{tag}"
+
+
+def mention_iri(handle: str) -> str:
+    return f"tg:mention/{handle}"
+
+
+# Window of the graphs the batch stages build; `builder.days` assembles others (last30d, all, ...).
+WINDOW = "last7d"
+
+
+def graph_id(chat_id: str, window: str = WINDOW) -> str:
+    return f"tg:graph/{chat_id}/{window}"
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL-like string to a proper URL.
+
+    Telegram sometimes detects bare domain names like "Fly.io" or "Gitcoin.co"
+    as URLs. These need to be normalized to proper URLs with a protocol
+    to avoid issues with RDF serialization (where they'd be mistaken for CURIEs).
+    """
+    url = url.strip()
+    if not url:
+        return url
+
+    # If it already has a protocol, return as-is
+    if "://" in url:
+        return url
+
+    # Otherwise, add https:// prefix
+    return f"https://{url}"
+
+
+def ordered_dedup(items: list[str]) -> list[str]:
+    seen: set[str] = set()
+    out: list[str] = []
+    for x in items:
+        if not x:
+            continue
+        if x in seen:
+            continue
+        seen.add(x)
+        out.append(x)
+    return out
+
+
+def utf16_offsets(text: str) -> list[int] | None:
+    """
+    Map Telegram's UTF-16 offsets to Python string indices for `text`.
+
+    `result[u]` is the code-point index at UTF-16 offset `u` (for `u` up to and
+    including the UTF-16 length). Returns None when the text has no astral
+    characters, in which case both offset systems coincide.
+    """
+    if text.isascii() or not _ASTRAL_RE.search(text):
+        return None
+    offsets: list[int] = []
+    for i, ch in enumerate(text):
+        offsets.append(i)
+        if ord(ch) > 0xFFFF:
+            offsets.append(i)  # low surrogate: falls inside the same character
+    offsets.append(len(text))
+    return offsets
+
+
+def utf16_slice(text: str, offsets: list[int] | None, off: int, ln: int) -> str:
+    if offsets is None:
+        return text[off : off + ln]
+    end = min(off + ln, len(offsets) - 1)
+    if off >= end:
+        return ""
+    return text[offsets[off] : offsets[end]]
+
+
+def post_record(obj: dict[str, Any]) -> dict[str, Any]:
+    """
+    Build the `Post` slot values for one canonical message.
+
+    The result is a plain dict keyed by LinkML slot name, so it can be passed
+    straight to `Post(**record)` or serialized without the LinkML runtime.
+    """
+    chat_id = obj["chat_id"]
+    message_id = int(obj["message_id"])
+    created_at = obj["created_at"]
+    text = obj.get("text") or ""
+    from_user_id = obj.get("from_user_id")
+    reply_to_message_id = obj.get("reply_to_message_id")
+
+    # From Slice 3
+    urls = obj.get("urls") or []
+    forwards = obj.get("forwards")
+    pinned = obj.get("pinned")
+
+    # From Slice 4 (entities)
+    entities = obj.get("entities") or []
+
+    creator_ref = user_id(int(from_user_id)) if from_user_id is not None else None
+
+    # --- Slice 4 parsing: topics, mentions, entity URLs ---
+    # Built once per message, so each entity below is an O(1) lookup.
+    offsets = utf16_offsets(text) if entities else None
+    topics: list[str] = []
+    mentions: list[str] = []
+    entity_urls: list[str] = []
+
+    for ent in entities:
+        if not isinstance(ent, dict):
+            continue
+
+        t = ent.get("type")
+        off = ent.get("offset")
+        ln = ent.get("length")
+
+        snippet: str | None = None
+        if isinstance(off, int) and isinstance(ln, int) and off >= 0 and ln > 0:
+            # Telegram entity offsets are in UTF-16 code units.
+            snippet = utf16_slice(text, offsets, off, ln)
+
+        if t == "MessageEntityHashtag" and snippet:
+            tag = snippet.lstrip("#")
+            if tag:
+                topics.append(hashtag_topic_iri(tag))
+
+        if t == "MessageEntityMention" and snippet:
+            handle = snippet.lstrip("@")
+            if handle:
+                mentions.append(mention_iri(handle))
+
+        if t == "MessageEntityUrl" and snippet:
+            entity_urls.append(snippet)
+
+        if t == "MessageEntityTextUrl":
+            url = ent.get("url")
+            if isinstance(url, str) and url:
+                entity_urls.append(url)
+
+    topics = ordered_dedup(topics)
+    mentions = ordered_dedup(mentions)
+
+    # Merge regex URLs + entity-derived URLs, normalizing them
+    all_urls = ordered_dedup([normalize_url(u) for u in [*urls, *entity_urls]])
+
+    # NOTE: This assumes you've added `topics` and `mentions` slots to Post in your schema.
+    return {
+        "id": post_id(chat_id, message_id),
+        "content": text,
+        "created": created_at,
+        "has_container": community_id(chat_id),  # reference by id
+        "has_creator": creator_ref,  # reference by id
+        "links_to": all_urls if all_urls else None,  # list of ids
+        "reply_to": post_id(chat_id, int(reply_to_message_id)) if reply_to_message_id is not None else None,
+        "forwards": int(forwards) if forwards is not None else None,
+        "pinned": bool(pinned) if pinned is not None else None,
+        "topics": topics if topics else None,
+        "mentions": mentions if mentions else None,
+    }
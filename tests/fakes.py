@@ -0,0 +1,145 @@
+"""
+In-process stand-ins for `TelegramClient`, for driving `builder.extract`
+and `builder.listen` offline.
+
+`FakeClient` serves scripted messages from `iter_messages` with Telethon's
+filtering semantics (`min_id`/`max_id` exclusive, `reverse` for oldest
+first), can simulate latency and FloodWait errors, and records what it was
+asked for. `FakeEvents` records the handlers `Listener.attach` registers and
+replays scripted `NewMessage` and `MessageDeleted` events through them.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from telethon import events
+from telethon.errors import FloodWaitError
+from telethon.tl.types import PeerChannel
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass
+class FakeMessage:
+    channel_id: int
+    id: int
+    date: datetime
+    message: str = ""
+    from_user: int | None = None
+    reply_to: int | None = None
+    edit_date: datetime | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "_": "Message",
+            "id": self.id,
+            "peer_id": {"_": "PeerChannel", "channel_id": self.channel_id},
+            "date": self.date,
+            "edit_date": self.edit_date,
+            "message": self.message,
+            "from_id": {"_": "PeerUser", "user_id": self.from_user} if self.from_user else None,
+            "reply_to": {"_": "MessageReplyHeader", "reply_to_msg_id": self.reply_to} if self.reply_to else None,
+            "media": {"_": "MessageMediaEmpty"},
+        }
+
+
+def chat(channel_id: int, n: int, start: datetime = T0, step: timedelta = timedelta(hours=1)) -> list[FakeMessage]:
+    """`n` messages with ids 1..n, `step` apart from `start`."""
+    return [FakeMessage(channel_id, i, start + (i - 1) * step, f"message {i}", from_user=100 + i % 3) for i in range(1, n + 1)]
+
+
+@dataclass
+class FakeClient:
+    """Serves `chats` (channel id -> messages) the way `TelegramClient.iter_messages` would."""
+
+    chats: dict[int, list[FakeMessage]]
+    latency: float = 0.0
+    calls: list[dict[str, Any]] = field(default_factory=list)
+    # channel id -> (messages yielded before raising, FloodWait seconds), one per upcoming call
+    floods: dict[int, list[tuple[int, int]]] = field(default_factory=dict)
+    active: int = 0
+    max_active: int = 0
+
+    def entity(self, channel_id: int) -> str:
+        return f"-100{channel_id}"
+
+    def flood_after(self, channel_id: int, n: int, seconds: int = 3) -> None:
+        """Make the next `iter_messages` over `channel_id` raise FloodWait after `n` messages."""
+        self.floods.setdefault(channel_id, []).append((n, seconds))
+
+    def add(self, msg: FakeMessage) -> None:
+        self.chats.setdefault(msg.channel_id, []).append(msg)
+
+    def edit(self, channel_id: int, message_id: int, text: str, at: datetime) -> None:
+        for msg in self.chats[channel_id]:
+            if msg.id == message_id:
+                msg.message = text
+                msg.edit_date = at
+
+    async def get_entity(self, entity: Any) -> Any:
+        await asyncio.sleep(self.latency)
+        if not isinstance(entity, PeerChannel) or entity.channel_id not in self.chats:
+            raise ValueError(f"unknown entity {entity!r}")
+        return entity
+
+    async def iter_messages(
+        self,
+        entity: PeerChannel,
+        limit: int | None = None,
+        min_id: int = 0,
+        max_id: int = 0,
+        offset_date: datetime | None = None,
+        reverse: bool = False,
+    ):
+        channel_id = entity.channel_id
+        self.calls.append(
+            {"channel_id": channel_id, "min_id": min_id, "max_id": max_id, "offset_date": offset_date, "reverse": reverse}
+        )
+        msgs = sorted(self.chats[channel_id], key=lambda m: m.id, reverse=not reverse)
+        msgs = [m for m in msgs if m.id > min_id and (not max_id or m.id < max_id)]
+        if offset_date is not None:
+            msgs = [m for m in msgs if (m.date >= offset_date if reverse else m.date < offset_date)]
+        flood = self.floods[channel_id].pop(0) if self.floods.get(channel_id) else None
+
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            for n, msg in enumerate(msgs[:limit]):
+                if flood is not None and n == flood[0]:
+                    raise FloodWaitError(request=None, capture=flood[1])
+                await asyncio.sleep(self.latency)
+                yield msg
+        finally:
+            self.active -= 1
+
+
+@dataclass
+class NewMessage:
+    """A new or edited message event."""
+
+    message: FakeMessage
+
+
+@dataclass
+class MessageDeleted:
+    chat_id: int | None
+    deleted_ids: list[int]
+
+
+@dataclass
+class FakeEvents:
+    """Records `add_event_handler` calls; `send` replays an event through the matching handlers."""
+
+    handlers: list[tuple[Any, Any]] = field(default_factory=list)
+
+    def add_event_handler(self, callback: Any, event: Any) -> None:
+        self.handlers.append((callback, event))
+
+    async def send(self, event: NewMessage | MessageDeleted) -> None:
+        kind = events.MessageDeleted if isinstance(event, MessageDeleted) else events.NewMessage
+        for callback, builder in self.handlers:
+            # MessageEdited subclasses NewMessage; a scripted new or edited message goes to one handler.
+            if type(builder) is kind:
+                await callback(event)
@@ -0,0 +1,50 @@
+import io
+import json
+from dataclasses import replace
+
+import pytest
+from fakes import chat
+
+from builder.canonical import canonicalize
+from builder.documents import build_rows, merge_tables, partition_by_chat, stream_document, transform_shards, write_document
+from builder.extract import project_message
+
+CHANNEL = 1000
+
+
+def records(msgs):
+    return [canonicalize(project_message(m.to_dict())) for m in msgs]
+
+
+@pytest.mark.parametrize("budget", [1 << 30, 16384, 2048])
+@pytest.mark.parametrize("repeated", [False, True])
+def test_streamed_document_matches_the_in_memory_one(tmp_path, budget, repeated):
+    msgs = chat(CHANNEL, 200)
+    if repeated:
+        # Later copies replace a post in place; this text also looks like the start of a spooled entry.
+        msgs += [replace(msgs[3], message='edited\n    "tg:post/x": {'), replace(msgs[150], message="edited ✓")]
+    recs = records(msgs)
+
+    doc = build_rows(recs[0]["chat_id"], recs)
+    expected = io.StringIO()
+    write_document(doc, expected)
+    out = io.StringIO()
+    key_files = {"users": io.StringIO(), "links": io.StringIO()}
+    result = stream_document(recs[0]["chat_id"], iter(recs), out, budget, str(tmp_path), key_files)
+
+    assert out.getvalue() == expected.getvalue()
+    assert (result.posts, result.users, result.links) == (200, len(doc.users), len(doc.links))
+    assert [json.loads(line) for line in key_files["users"].getvalue().splitlines()] == list(doc.users)
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("budget", [None, 0])
+def test_tables_merge_across_shards_in_shard_order(tmp_path, budget):
+    recs = records(chat(2000, 30) + chat(CHANNEL, 30))
+    shards = partition_by_chat((json.dumps(r) for r in recs), str(tmp_path / "work"))
+    results = transform_shards(shards, str(tmp_path / "out"), memory_budget=budget)
+
+    docs = [build_rows(sh.chat_id, [r for r in recs if r["chat_id"] == sh.chat_id]) for sh in shards]
+    assert [(r.users, r.links) for r in results] == [(len(d.users), len(d.links)) for d in docs]
+    users = list(merge_tables(shards, "users", budget, str(tmp_path)))
+    assert users == list(dict.fromkeys(u for d in docs for u in d.users))
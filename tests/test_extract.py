@@ -0,0 +1,153 @@
+import asyncio
+import json
+from datetime import timedelta
+
+from fakes import T0, FakeClient, FakeMessage, chat
+
+from builder.canonical import drop_superseded, superseded_positions
+from builder.checkpoint import read_lines
+from builder.extract import RawWriter, extract_many
+
+CHANNEL = 1000
+NOW = T0 + timedelta(days=1)
+SINCE = NOW - timedelta(days=7)
+
+
+def extract(client, state, out_dir, now=NOW, incremental=True, waits=None, **kwargs):
+    async def sleep(seconds):
+        if waits is not None:
+            waits.append(seconds)
+
+    entities = [client.entity(c) for c in client.chats]
+    return asyncio.run(
+        extract_many(
+            client,
+            entities,
+            state,
+            out_dir=str(out_dir),
+            since=SINCE,
+            now=now,
+            incremental=incremental,
+            sleep=sleep,
+            **kwargs,
+        )
+    )
+
+
+def shard_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_incremental_run_appends_new_and_edited_messages(tmp_path):
+    client = FakeClient({CHANNEL: chat(CHANNEL, 10)})
+    state = {}
+    (path, _, _), = extract(client, state, tmp_path).values()
+    assert [m["id"] for m in shard_lines(path)] == list(range(1, 11))
+
+    later = NOW + timedelta(hours=1)
+    client.edit(CHANNEL, 4, "fixed typo", at=later)
+    client.add(FakeMessage(CHANNEL, 11, later, "new"))
+    (path, new, edited), = extract(client, state, tmp_path, now=later + timedelta(minutes=5)).values()
+
+    assert (new, edited) == (1, 1)
+    appended = shard_lines(path)[10:]
+    assert [(m["id"], m["message"]) for m in appended] == [(4, "fixed typo"), (11, "new")]
+    assert state[client.entity(CHANNEL)]["last_id"] == 11
+
+
+def test_floodwait_during_refresh_writes_each_edit_once(tmp_path):
+    client = FakeClient({CHANNEL: chat(CHANNEL, 10)})
+    state = {}
+    extract(client, state, tmp_path)
+
+    later = NOW + timedelta(hours=1)
+    for message_id in (9, 10):
+        client.edit(CHANNEL, message_id, f"edited {message_id}", at=later)
+    # The refresh walks newest first: both edits are written before the FloodWait.
+    client.flood_after(CHANNEL, 3, seconds=7)
+    waits = []
+    (path, new, edited), = extract(client, state, tmp_path, now=later + timedelta(minutes=5), waits=waits).values()
+
+    assert waits == [7]
+    assert (new, edited) == (0, 2)
+    assert sorted(m["id"] for m in shard_lines(path)[10:]) == [9, 10]
+
+
+def latest_lines(path):
+    paths = [str(path)]
+    return [json.loads(line) for line, _ in drop_superseded(read_lines(paths), superseded_positions(paths))]
+
+
+def test_edited_copies_supersede_earlier_lines(tmp_path):
+    client = FakeClient({CHANNEL: chat(CHANNEL, 5)})
+    state = {}
+    extract(client, state, tmp_path)
+    now = NOW
+    for text in ("a2", "a3"):
+        now += timedelta(hours=1)
+        client.edit(CHANNEL, 2, text, at=now)
+        (path, _, edited), = extract(client, state, tmp_path, now=now + timedelta(minutes=5)).values()
+        assert edited == 1
+
+    assert [m["id"] for m in shard_lines(path)] == [1, 2, 3, 4, 5, 2, 2]
+    assert [(m["id"], m["message"]) for m in latest_lines(path)][-2:] == [(5, "message 5"), (2, "a3")]
+
+
+def test_appending_to_an_unindexed_shard_indexes_it_first(tmp_path):
+    path = tmp_path / "raw.jsonl"
+    rows = [(1, "a"), (2, "b"), (1, "a2"), (3, "c"), (1, "a3")]
+    path.write_text("".join(json.dumps({"id": i, "message": t}) + "\n" for i, t in rows))
+
+    RawWriter(str(path), append=True).close()
+
+    assert [(m["id"], m["message"]) for m in latest_lines(path)] == [(2, "b"), (3, "c"), (1, "a3")]
+    assert (tmp_path / "raw.jsonl.ids").read_text().split("\n")[:2] == ["1 26", "2 52"]
+
+
+def test_entities_are_fetched_concurrently_up_to_the_limit(tmp_path):
+    channels = [1001, 1002, 1003, 1004]
+    client = FakeClient({c: chat(c, 5) for c in channels}, latency=0.01)
+    state = {}
+    results = extract(client, state, tmp_path, incremental=False, concurrency=2)
+
+    assert client.max_active == 2
+    for c in channels:
+        path, new, edited = results[client.entity(c)]
+        assert (new, edited) == (5, 0)
+        assert [m["peer_id"]["channel_id"] for m in shard_lines(path)] == [c] * 5
+        assert state[client.entity(c)]["last_id"] == 5
+
+
+def test_floodwait_resumes_from_the_high_water_mark(tmp_path):
+    client = FakeClient({CHANNEL: chat(CHANNEL, 10), 2000: chat(2000, 4)})
+    client.flood_after(CHANNEL, 6, seconds=5)
+    state = {}
+    waits = []
+    results = extract(client, state, tmp_path, incremental=False, waits=waits)
+
+    path, new, _ = results[client.entity(CHANNEL)]
+    assert waits == [5]
+    assert new == 10
+    assert [m["id"] for m in shard_lines(path)] == list(range(1, 11))
+    # The retry asked only for what the first attempt hadn't written.
+    assert [c["min_id"] for c in client.calls if c["channel_id"] == CHANNEL] == [0, 6]
+    assert state[client.entity(CHANNEL)]["last_id"] == 10
+    assert state[client.entity(2000)]["last_id"] == 4
+
+
+def test_incremental_run_fetches_above_each_chats_mark(tmp_path):
+    client = FakeClient({CHANNEL: chat(CHANNEL, 10), 2000: chat(2000, 3)})
+    state = {}
+    extract(client, state, tmp_path)
+    client.calls.clear()
+
+    later = NOW + timedelta(hours=1)
+    client.add(FakeMessage(2000, 4, later, "new"))
+    results = extract(client, state, tmp_path, now=later, refresh=timedelta(0))
+
+    fetches = {c["channel_id"]: c["min_id"] for c in client.calls if c["reverse"]}
+    assert fetches == {CHANNEL: 10, 2000: 3}
+    assert results[client.entity(CHANNEL)][1:] == (0, 0)
+    assert results[client.entity(2000)][1:] == (1, 0)
+    assert [m["id"] for m in shard_lines(results[client.entity(2000)][0])] == [1, 2, 3, 4]
@@ -0,0 +1,96 @@
+import asyncio
+import dataclasses
+
+from fakes import FakeEvents, MessageDeleted, NewMessage, chat
+from pyoxigraph import Store
+
+from builder.listen import Listener
+from builder.search import SearchIndex
+from builder.store import read_generation
+
+CHANNEL = 1000
+CHAT_ID = int(f"-100{CHANNEL}")  # the marked id Telethon puts in `event.chat_id`
+CONTENT = """
+SELECT ?post ?content WHERE { ?post <http://rdfs.org/sioc/ns#content> ?content }
+"""
+
+
+def posts(store):
+    return {
+        int(row["post"].value.rsplit("/", 1)[1]): row["content"].value
+        for row in store.query(CONTENT, use_default_graph_as_union=True)
+    }
+
+
+async def until(condition, timeout=5.0):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.005)
+
+
+def listen(tmp_path, script, **kwargs):
+    """Run a listener over the events `script(send, listener)` sends; returns (listener, store)."""
+    store_dir = str(tmp_path / "store")
+    store = Store(store_dir)
+    listener = Listener(store, store_dir, search_path=str(tmp_path / "search.sqlite"), **kwargs)
+    client = FakeEvents()
+    listener.attach(client)
+
+    async def main():
+        task = asyncio.create_task(listener.run())
+        await asyncio.sleep(0)  # let run() start, or cancelling it skips its final flush
+        await script(client.send, listener)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    return listener, store
+
+
+def test_batches_commit_when_full_or_aged(tmp_path):
+    msgs = chat(CHANNEL, 4)
+    seen = []
+
+    async def script(send, listener):
+        for m in msgs[:3]:
+            await send(NewMessage(m))
+        # A full batch is committed without waiting for max_delay.
+        await until(lambda: listener.stats.batches == 1)
+        seen.append((posts(listener.store), read_generation(listener.store_dir)))
+
+        await send(NewMessage(dataclasses.replace(msgs[1], message="edited", edit_date=msgs[3].date)))
+        await send(MessageDeleted(CHAT_ID, [3]))
+        await asyncio.sleep(0.05)
+        assert listener.stats.batches == 1
+        # Two changes stay pending until the oldest is max_delay old.
+        await until(lambda: listener.stats.batches == 2)
+        seen.append((posts(listener.store), read_generation(listener.store_dir)))
+
+    listener, store = listen(tmp_path, script, batch_size=3, max_delay=0.2)
+
+    assert seen == [
+        ({1: "message 1", 2: "message 2", 3: "message 3"}, 1),
+        ({1: "message 1", 2: "edited"}, 2),
+    ]
+    assert (listener.stats.messages, listener.stats.deletions) == (4, 1)
+    with SearchIndex(str(tmp_path / "search.sqlite"), readonly=True) as index:
+        assert [iri.rsplit("/", 1)[1] for iri, _ in index.search("edited")] == ["2"]
+        assert index.search("message 3") == []
+
+
+def test_latest_event_per_message_wins_and_cancel_flushes(tmp_path):
+    msgs = chat(CHANNEL, 3)
+
+    async def script(send, listener):
+        await send(NewMessage(msgs[0]))
+        await send(NewMessage(dataclasses.replace(msgs[0], message="second draft")))
+        await send(NewMessage(msgs[1]))
+        await send(MessageDeleted(CHAT_ID, [2]))
+        await send(NewMessage(msgs[2]))
+
+    listener, store = listen(tmp_path, script, batch_size=100, max_delay=60)
+
+    # Nothing was due, so the one batch is the one written on cancellation.
+    assert listener.stats.batches == 1
+    assert posts(store) == {1: "second draft", 3: "message 3"}
+    assert read_generation(listener.store_dir) == 1
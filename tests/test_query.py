@@ -0,0 +1,97 @@
+from datetime import timedelta
+
+from fakes import T0, FakeMessage
+import pytest
+from pyoxigraph import RdfFormat, Store
+
+from builder.aggregates import StatsCollector
+from builder.canonical import canonicalize
+from builder.extract import project_message
+from builder.query import GraphQueries
+from builder.rdf import graph_quads, write_triples
+from builder.store import bulk_load_quads
+
+USER = 101
+
+
+def records(channel_id, replies):
+    msgs = [FakeMessage(channel_id, 1, T0, "root", from_user=USER)]
+    for i in range(replies):
+        msgs.append(FakeMessage(channel_id, i + 2, T0 + timedelta(days=1), "reply", from_user=USER, reply_to=1))
+    return [canonicalize(project_message(m.to_dict())) for m in msgs]
+
+
+def test_aggregates_count_each_window_once(tmp_path):
+    store_dir = str(tmp_path / "store")
+    store = Store(store_dir)
+    # Two overlapping windows of one chat, as `daily_partitions.py window --load` leaves them, and another chat.
+    for window, recs in [("last3d", records(1000, 2)), ("last7d", records(1000, 2)), ("last7d", records(2000, 1))]:
+        collector = StatsCollector()
+        bulk_load_quads(store, collector.observe(graph_quads(recs, window=window)))
+        bulk_load_quads(store, collector.quads())
+    store.flush()
+    del store
+
+    q = GraphQueries(store_dir, thread_dir=str(tmp_path / "threads"), search_db=str(tmp_path / "search.sqlite"))
+
+    assert q.reply_count("tg:post/-1001000/1") == 2
+    assert q.reply_count("tg:post/-1001000/1", window="last3d") == 2
+    assert q.reply_count("tg:post/-1002000/1", window="last3d") == 0
+    assert [(d.value, d.posts) for d in q.user_days(USER)] == [("2026-01-01", 2), ("2026-01-02", 3)]
+    assert [(d.value, d.posts) for d in q.user_days(USER, window="last3d")] == [("2026-01-01", 1), ("2026-01-02", 2)]
+
+
+def test_aggregates_need_a_load_that_writes_them(tmp_path):
+    store_dir = str(tmp_path / "store")
+    store = Store(store_dir)
+    # What `load_into_oxigraph.py` without --bulk/--upsert loads: plain Turtle, no stats graphs.
+    turtle = tmp_path / "graph.ttl"
+    with open(turtle, "w", encoding="utf-8") as f:
+        write_triples(((s, p, o) for s, p, o, _ in graph_quads(records(1000, 2))), f, fmt="ttl")
+    store.load(path=str(turtle), format=RdfFormat.TURTLE)
+    store.flush()
+    del store
+
+    q = GraphQueries(store_dir, thread_dir=str(tmp_path / "threads"), search_db=str(tmp_path / "search.sqlite"))
+
+    with pytest.raises(ValueError, match="No aggregates for window 'last7d'"):
+        q.reply_count("tg:post/-1001000/1")
+    with pytest.raises(ValueError):
+        q.user_days(USER)
+
+
+def tagged(channel_id, rows):
+    """Canonical records of `(text, hashtag)` rows; URLs in the text become links."""
+    recs = []
+    for i, (text, tag) in enumerate(rows, 1):
+        rec = canonicalize(project_message(FakeMessage(channel_id, i, T0, text, from_user=USER).to_dict()))
+        if tag:
+            start = text.index(tag)
+            rec["entities"] = [{"type": "MessageEntityHashtag", "offset": start, "length": len(tag)}]
+        recs.append(rec)
+    return recs
+
+
+def test_window_top_lists_read_the_aggregates(tmp_path):
+    store_dir = str(tmp_path / "store")
+    store = Store(store_dir)
+    chats = {
+        1000: tagged(1000, [("#rdf https://a.example/x", "#rdf"), ("#rdf", "#rdf"), ("#sparql https://b.example", "#sparql")]),
+        2000: tagged(2000, [("#sparql https://b.example", "#sparql"), ("plain https://b.example", None)]),
+    }
+    for recs in chats.values():
+        collector = StatsCollector()
+        bulk_load_quads(store, collector.observe(graph_quads(recs)))
+        bulk_load_quads(store, collector.quads())
+    store.flush()
+    del store
+
+    q = GraphQueries(store_dir, thread_dir=str(tmp_path / "threads"), search_db=str(tmp_path / "search.sqlite"))
+    start, end = T0 - timedelta(days=1), T0 + timedelta(days=1)
+
+    for window, scan in [(q.window_hashtags, q.top_hashtags), (q.window_links, q.top_links)]:
+        assert window() == scan(start, end)
+        assert window(limit=1) == scan(start, end, limit=1)
+        assert window(community="tg:community/-1001000") == scan(start, end, community="tg:community/-1001000")
+    assert [(t.value.rsplit("/", 1)[1], t.posts) for t in q.window_hashtags()] == [("rdf", 2), ("sparql", 2)]
+    assert [(t.value, t.posts) for t in q.window_links()] == [("https://b.example", 3), ("https://a.example/x", 1)]
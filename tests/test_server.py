@@ -0,0 +1,95 @@
+import threading
+import time
+from http import HTTPStatus
+
+import pytest
+from pyoxigraph import Literal, NamedNode, Quad, Store
+
+from builder.server import SparqlFrontend, normalize_query, query_hash
+from builder.store import bump_generation
+
+EX = "http://example.org/"
+COUNT = "SELECT (COUNT(*) AS ?n) WHERE { ?s ?p ?o }"
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    path = str(tmp_path / "store")
+    add(path, "a", "1")
+    return path
+
+
+def add(store_dir, subject, value):
+    store = Store(store_dir)
+    store.add(Quad(NamedNode(EX + subject), NamedNode(EX + "value"), Literal(value)))
+    store.flush()
+    del store
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_normalize_query_ignores_comments_and_whitespace_only():
+    a = "SELECT ?s\n  WHERE { ?s ?p ?o }  # every triple\n"
+    b = "SELECT ?s WHERE {\t?s ?p ?o }"
+    assert normalize_query(a) == normalize_query(b) == "SELECT ?s WHERE { ?s ?p ?o }"
+    assert query_hash(a) == query_hash(b)
+
+    # Strings and IRIs are left alone, `#` included.
+    q = 'SELECT * WHERE { ?s ?p "a  #b" . ?s ?p <http://x/#y> }'
+    assert normalize_query(q) == q
+    assert query_hash('SELECT * WHERE { ?s ?p "a b" }') != query_hash('SELECT * WHERE { ?s ?p "a  b" }')
+
+
+def test_cosmetic_variants_hit_the_same_cache_entry(store_dir):
+    frontend = SparqlFrontend(store_dir)
+    first = frontend.query(COUNT)
+    second = frontend.query("SELECT (COUNT(*) AS ?n)\nWHERE { ?s ?p ?o } # again")
+
+    assert first.status == HTTPStatus.OK
+    assert second is first
+    assert frontend.stats()["executed"] == 1
+
+
+def test_if_none_match_gets_304_until_the_generation_changes(store_dir):
+    frontend = SparqlFrontend(store_dir)
+    response = frontend.query(COUNT)
+    assert frontend.query(COUNT, if_none_match=f'"0-x", {response.etag}').status == HTTPStatus.NOT_MODIFIED
+
+    add(store_dir, "b", "2")
+    bump_generation(store_dir)
+    fresh = frontend.query(COUNT, if_none_match=response.etag)
+
+    assert fresh.status == HTTPStatus.OK
+    assert fresh.etag != response.etag
+    assert b'"2"' in fresh.body
+    assert frontend.stats()["executed"] == 2
+
+
+def test_concurrent_identical_queries_run_once(store_dir):
+    frontend = SparqlFrontend(store_dir)
+    started, release = threading.Event(), threading.Event()
+    execute = frontend._execute
+
+    def slow_execute(*args):
+        started.set()
+        release.wait()
+        return execute(*args)
+
+    frontend._execute = slow_execute
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(frontend.query(COUNT))) for _ in range(2)]
+    threads[0].start()
+    assert started.wait(5)
+    threads[1].start()
+    wait_for(lambda: frontend.stats()["coalesced"] == 1)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert responses[0] is responses[1]
+    assert frontend.stats()["executed"] == 1